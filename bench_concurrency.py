@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Throughput vs UPDATE_CONCURRENCY, and per-user ordering, against a slow Bot API stub.
+
+Every Bot API call takes --api-latency seconds (the round trip to Telegram), so with
+sequential processing throughput is capped at ~1/latency updates/s. Each user sends a
+mixed /start, /catalog sequence; the replies must come back in the same order.
+
+    python bench_concurrency.py [--users 200] [--per-user 5] [--levels 1,4,16,64] [--api-latency 0.05]
+"""
+import os, json, time, argparse, tempfile, threading, http.client
+
+from botapi_stub import StubProcess
+from bench_search import load_importer, build_catalog
+from bench_webhook import free_port, message, personalize, post, wait_listening, start_bot, stop_bot
+
+START_REPLY = "Salom!"   # start() reply; /catalog answers with the category list
+
+def user_script(uid: int, n: int):
+    return ["/start" if (uid >> i) & 1 else "/catalog" for i in range(n)]
+
+def run_load(args, tmp: str, warm_users: int = 1, **env) -> dict:
+    """One bot.py run (extra env vars as given) under the mixed per-user load."""
+    stub = StubProcess(latency=args.api_latency).start()
+    port = free_port()
+    proc, log = start_bot(tmp, stub, port, **env)
+    try:
+        wait_listening(port, proc)
+        for uid in range(1, warm_users + 1):   # one per worker when sharded
+            post(port, json.dumps(personalize(message("/start"), uid)).encode())
+            stub.wait_for(uid, timeout=30)
+        base = stub.keyed_calls
+
+        users = [2_000_000 + u for u in range(args.users)]
+        n_senders = 4
+
+        def bodies(mine):
+            # round-robin over a sender's users; each user's updates leave in order
+            out = []
+            for step in range(args.per_user):
+                for uid in mine:
+                    upd = personalize(message(user_script(uid, args.per_user)[step]), uid)
+                    upd["update_id"] = uid * 100 + step
+                    out.append(json.dumps(upd).encode())
+            return out
+
+        def sender(batch):
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            for body in batch:
+                post(port, body, conn=conn)
+            conn.close()
+
+        batches = [bodies(users[i::n_senders]) for i in range(n_senders)]
+        t0 = time.perf_counter()
+        threads = [threading.Thread(target=sender, args=(b,)) for b in batches]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        total = args.users * args.per_user
+        ok = stub.wait_keyed_calls(base + total, timeout=max(60.0, total * args.api_latency * 2))
+        wall = time.perf_counter() - t0
+
+        out_of_order = 0
+        replies = stub.log
+        for uid in users:
+            got = ["/start" if text.startswith(START_REPLY) else "/catalog"
+                   for method, text in replies.get(str(uid), [])]
+            if got != user_script(uid, args.per_user):
+                out_of_order += 1
+        return {"updates": total, "complete": ok, "seconds": wall,
+                "per_sec": total / wall, "out_of_order_users": out_of_order}
+    finally:
+        code, out = stop_bot(proc, log)
+        stub.stop()
+        if code != 0:
+            print(out[-3000:])
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--per-user", type=int, default=5)
+    ap.add_argument("--levels", default="1,4,16,64", help="UPDATE_CONCURRENCY values to try")
+    ap.add_argument("--api-latency", type=float, default=0.05, help="seconds per Bot API call")
+    ap.add_argument("--products", type=int, default=5000)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        build_catalog(load_importer(), os.path.join(tmp, "products.db"), args.products)
+        for level in [int(x) for x in args.levels.split(",")]:
+            r = run_load(args, tmp, UPDATE_CONCURRENCY=str(level))
+            print(f"UPDATE_CONCURRENCY={level:<4} {r['updates']} updates in {r['seconds']:6.2f}s "
+                  f"= {r['per_sec']:7.1f}/s  complete={r['complete']}  "
+                  f"users out of order: {r['out_of_order_users']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""End-to-end load on the real handler set (bot.build_app()) against a local Bot API stub.
+
+Every simulated user walks /catalog -> CAT page -> next page -> PROD -> ADD -> CART|CHECKOUT
+-> address, phone, note -> confirm_yes on a synthetic catalog written with import.py's schema.
+Each step is one phase: all users' updates for it are submitted at once through the bot's
+update processor, so latency includes queueing behind UPDATE_CONCURRENCY. Reports
+p50/p95/p99 per step, SQL statements per update (bot.py's bot_sql_statements_total, all
+databases, background writers included) and orders/s. Results are saved as JSON;
+--compare prints the change against an earlier run.
+
+    python bench_e2e.py [--users 2000] [--products 20000] [--api-latency 0] [--save FILE] [--compare OLD.json]
+"""
+import os, sys, json, time, random, asyncio, sqlite3, argparse, tempfile, subprocess
+
+from botapi_stub import StubProcess
+from bench_search import BASE_DIR, load_importer, build_catalog
+from bench_webhook import message, callback, personalize, percentiles
+
+RESULTS_DIR = os.path.join(BASE_DIR, "bench_results")
+FIRST_UID = 3_000_000
+
+# ---------- user journey ----------
+def journeys(bot, users: int, seed: int = 5) -> list:
+    """[(step name, [update dict per user]), ...] in the order every user goes through them."""
+    rnd = random.Random(seed)
+    pages = {}   # cid -> (page 1 callback, SKUs on page 1)
+    for cid, category in bot.CATEGORY_ID_MAP.items():
+        first = bot.category_page(category)
+        if len(first) <= bot.PAGE_SIZE:
+            continue   # single-page category: nothing to page through
+        nxt = bot.cat_callback(cid, 1, ">" + first[bot.PAGE_SIZE - 1]["sku"])
+        second = bot.category_page(category, after=first[bot.PAGE_SIZE - 1]["sku"])[:bot.PAGE_SIZE]
+        pages[cid] = (nxt, [it["sku"] for it in second])
+    if not pages:
+        raise SystemExit("catalog has no category with two pages; use more --products")
+
+    steps = {name: [] for name in ("/catalog", "CAT", "CAT next", "PROD", "ADD", "CART|CHECKOUT",
+                                   "address", "phone", "note", "confirm_yes")}
+    for uid in range(FIRST_UID, FIRST_UID + users):
+        cid = rnd.choice(sorted(pages))
+        nxt, skus = pages[cid]
+        sku = rnd.choice(skus)
+        script = {"/catalog": message("/catalog"), "CAT": callback(f"CAT|{cid}|0"),
+                  "CAT next": callback(nxt), "PROD": callback(f"PROD|{sku}"), "ADD": callback(f"ADD|{sku}"),
+                  "CART|CHECKOUT": callback("CART|CHECKOUT"), "address": message("Chilonzor 9, 12-uy"),
+                  "phone": message(f"+99890{uid % 10_000_000:07d}"), "note": message("Yo‘q"),
+                  "confirm_yes": callback("confirm_yes")}
+        for name, upd in script.items():
+            steps[name].append(personalize(upd, uid))
+    return list(steps.items())
+
+def sql_count(bot) -> float:
+    return bot.metrics.counter_total("bot_sql_statements_total")
+
+async def run_phase(bot, app, updates: list) -> dict:
+    """Submit every update at once through app.update_processor; per-update latency in ms."""
+    from telegram import Update
+    proc = app.update_processor
+    lat = []
+
+    async def one(data):
+        upd = Update.de_json(data, app.bot)
+        t0 = time.perf_counter()
+        await proc.process_update(upd, app.process_update(upd))
+        lat.append((time.perf_counter() - t0) * 1000)
+
+    sql0 = sql_count(bot)
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(d) for d in updates))
+    wall = time.perf_counter() - t0
+    p50, p95, p99, mx = percentiles(lat)
+    return {"updates": len(updates), "seconds": round(wall, 3), "per_sec": round(len(updates) / wall, 1),
+            "p50_ms": round(p50, 2), "p95_ms": round(p95, 2), "p99_ms": round(p99, 2), "max_ms": round(mx, 2),
+            "sql_per_update": round((sql_count(bot) - sql0) / len(updates), 2)}
+
+async def run(bot, args, stub) -> dict:
+    errors = {}
+    app = bot.build_app()
+
+    async def count_error(update, context):
+        name = type(context.error).__name__
+        errors[name] = errors.get(name, 0) + 1
+
+    app.add_error_handler(count_error)
+    async with app:
+        await bot.post_init(app)
+        steps = journeys(bot, args.users)
+        await bot.product_index()
+        out = {}
+        for name, updates in steps:
+            before = dict(errors)
+            out[name] = r = await run_phase(bot, app, updates)
+            r["errors"] = sum(errors.values()) - sum(before.values())
+            print(f"{name:14} {r['per_sec']:8.1f} upd/s  p50={r['p50_ms']:7.2f}ms  p95={r['p95_ms']:7.2f}ms  "
+                  f"p99={r['p99_ms']:7.2f}ms  sql/upd={r['sql_per_update']:5.2f}  errors={r['errors']}")
+        await bot.post_shutdown(app)   # flushes queued orders and sessions
+
+    with sqlite3.connect(bot.ORDERS_DB) as conn:
+        stored = conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+    total_s = sum(r["seconds"] for r in out.values())
+    return {"steps": out, "errors": errors, "orders_stored": stored,
+            "orders_per_sec": out["confirm_yes"]["per_sec"],
+            "journeys_per_sec": round(args.users / total_s, 1),
+            "bot_api_calls": stub.total_calls()}
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                              capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+def compare(old: dict, new: dict) -> None:
+    def delta(a, b):
+        return f"{b:8.2f} ({(b - a) / a * 100:+5.0f}%)" if a else f"{b:8.2f}"
+    print(f"\nvs {old.get('saved_as', 'previous run')} (rev {old['config'].get('revision') or '?'}):")
+    differ = [f"{k} {old['config'].get(k)} -> {v}" for k, v in new["config"].items()
+              if k not in ("revision", "time") and old["config"].get(k) != v]
+    if differ:
+        print("  [warn] runs are not comparable 1:1: " + ", ".join(differ))
+    for name, r in new["steps"].items():
+        o = old["steps"].get(name)
+        if o:
+            print(f"{name:14} p95 {o['p95_ms']:8.2f} -> {delta(o['p95_ms'], r['p95_ms'])}  "
+                  f"sql/upd {o['sql_per_update']:5.2f} -> {r['sql_per_update']:5.2f}")
+    print(f"{'orders/s':14} {old['orders_per_sec']:8.1f} -> {delta(old['orders_per_sec'], new['orders_per_sec'])}")
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--users", type=int, default=2000)
+    ap.add_argument("--products", type=int, default=20000)
+    ap.add_argument("--api-latency", type=float, default=0.0, help="seconds per Bot API call")
+    ap.add_argument("--save", help="results file (default: bench_results/e2e-<time>.json)")
+    ap.add_argument("--compare", help="earlier results file to compare with")
+    args = ap.parse_args()
+
+    stub = StubProcess(latency=args.api_latency).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        build_catalog(load_importer(), os.path.join(tmp, "products.db"), args.products)
+        # bot.py reads its config and relative DB paths at import time
+        os.chdir(tmp)
+        os.environ.update(BOT_TOKEN="123:bench", BOT_API_URL=stub.url, WORKERS_CHAT_ID="-1001",
+                          CLIENT_GROUP_IDS="", OWNER_USER_ID="0", METRICS_PORT="0")
+        sys.path.insert(0, BASE_DIR)
+        import bot
+
+        t0 = time.perf_counter()
+        try:
+            result = asyncio.run(run(bot, args, stub))
+        finally:
+            os.chdir(BASE_DIR)
+            stub.stop()
+    result["config"] = {"users": args.users, "products": args.products, "api_latency": args.api_latency,
+                        "update_concurrency": bot.UPDATE_CONCURRENCY, "bot_api_connections": bot.BOT_API_CONNECTIONS,
+                        "revision": git_revision(), "time": time.strftime("%Y-%m-%d %H:%M:%S")}
+    print(f"{args.users} journeys in {time.perf_counter() - t0:.1f}s: {result['orders_stored']} orders stored, "
+          f"{result['orders_per_sec']} orders/s at confirm, {result['journeys_per_sec']} journeys/s, "
+          f"{result['bot_api_calls']} Bot API calls, errors: {result['errors'] or 'none'}")
+
+    path = args.save or os.path.join(RESULTS_DIR, time.strftime("e2e-%Y%m%d-%H%M%S.json"))
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    result["saved_as"] = os.path.basename(path)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"saved {path}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), result)
+
+if __name__ == "__main__":
+    main()
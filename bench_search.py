@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""/find latency: old LIKE scan vs FTS5 index on a synthetic catalog, plus the free-text
+order resolver (trigram index) and inline prefix search on the same catalog.
+
+    python bench_search.py [--products 100000] [--queries 200]
+"""
+import os, time, random, argparse, tempfile, statistics, importlib.util
+
+os.environ.setdefault("BOT_TOKEN", "bench:token")  # bot.py refuses to import without one
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def load_importer():
+    # import.py can't be imported by name ("import" is a keyword)
+    spec = importlib.util.spec_from_file_location("catalog_import", os.path.join(BASE_DIR, "import.py"))
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+WORDS = ["Труба", "Смеситель", "Унитаз", "Раковина", "Кран", "Фильтр", "Колба", "Шланг",
+         "dush", "geli", "sovun", "unitaz", "rakovina", "kran", "quvur", "o‘tkazgich",
+         "Atlas", "Kalde", "PN", "ХВС", "ГВС", "латунь", "белый", "хром", "3/4", "1/2", "110х45"]
+SYLLABLES = ["ka", "lo", "mi", "ra", "su", "to", "ne", "vi", "ze", "bo", "gu", "sh", "ch", "ya", "qo"]
+CATEGORIES = ["Kalde", "Santan", "Atlas Filtri", "Vanna", "Oshxona", "Сантехника", "Fitinglar"]
+
+def model_words(n: int = 3000):
+    """Brand/model-like words so that most queries are selective, as in a real price list."""
+    rnd = random.Random(1)
+    return ["".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4))) for _ in range(n)]
+
+def build_catalog(imp, path: str, n: int) -> None:
+    imp.DB_PATH = path
+    imp.ensure_schema()
+    rnd = random.Random(42)
+    models = model_words()
+    rows = []
+    for i in range(n):
+        title = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 3)))
+        title += " " + " ".join(rnd.choice(models) for _ in range(rnd.randint(1, 3))) + f" {i}"
+        cat = rnd.choice(CATEGORIES)
+        rows.append((imp.md5(f"{cat}|{title}"), title, float(rnd.randint(1, 5000)), cat))
+    with imp.db() as conn:
+        imp.write_rows(conn, rows)
+        imp.refresh_categories(conn)
+
+def timed(fn, queries):
+    out = []
+    for q in queries:
+        t0 = time.perf_counter()
+        fn(q)
+        out.append((time.perf_counter() - t0) * 1000)
+    return out
+
+def report(name, ms):
+    ms = sorted(ms)
+    p95 = ms[int(len(ms) * 0.95) - 1]
+    print(f"{name:7} mean={statistics.mean(ms):8.2f}ms  p50={statistics.median(ms):8.2f}ms  p95={p95:8.2f}ms")
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--products", type=int, default=100000)
+    ap.add_argument("--queries", type=int, default=200)
+    args = ap.parse_args()
+
+    imp = load_importer()
+    import bot
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "products.db")
+        t0 = time.perf_counter()
+        build_catalog(imp, path, args.products)
+        print(f"built {args.products} products + index in {time.perf_counter() - t0:.1f}s")
+        bot.DB = path
+
+        rnd = random.Random(7)
+        models = model_words()
+        queries = [rnd.choice(WORDS)[:rnd.randint(3, 6)] + " " + rnd.choice(models)[:rnd.randint(3, 6)]
+                   for _ in range(args.queries)]
+        report("LIKE", timed(lambda q: bot.search_products(q, limit=bot.PAGE_SIZE), queries))
+        report("FTS", timed(lambda q: bot.search_products_fts(q, limit=bot.PAGE_SIZE), queries))
+
+        t0 = time.perf_counter()
+        index = bot.ProductIndex.load(0)
+        print(f"built order resolver index ({len(index)} products) in {time.perf_counter() - t0:.1f}s")
+        # order lines as customers type them: part of a real title, lower-case, a typo, a quantity
+        lines = []
+        for title in rnd.sample(index.titles, args.queries):
+            words = title.split()[:rnd.randint(2, 4)]
+            w = rnd.randrange(len(words))
+            if len(words[w]) > 4:
+                words[w] = words[w][:2] + words[w][3:]
+            lines.append(" ".join(words) + rnd.choice(["", " x2", " 3 ta", " 2шт"]))
+        hits = sum(1 for line in lines if bot.resolve_order_text(index, line)[0][2])
+        report("RESOLVE", timed(lambda line: bot.resolve_order_text(index, line), lines))
+        print(f"resolved {hits}/{len(lines)} lines")
+
+        # inline queries as Telegram sends them while typing: "u", "un", "uni", ... per keystroke
+        typed = []
+        for title in rnd.sample(index.titles, args.queries // 4):
+            text = " ".join(title.split()[:2])
+            typed += [text[:i] for i in range(1, len(text) + 1) if not text[i - 1].isspace()]
+        report("INLINE", timed(lambda q: index.prefix_search(q, 0, bot.INLINE_PAGE_SIZE), typed))
+        report("INLINE2", timed(lambda q: index.prefix_search(q, bot.INLINE_PAGE_SIZE, bot.INLINE_PAGE_SIZE), typed))
+        empty = sum(1 for q in typed if not index.prefix_search(q, 0, 1)[0])
+        print(f"{len(typed)} keystroke queries, {empty} without results")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""Throughput vs BOT_WORKERS: the front process shards updates by user over N bot.py workers.
+
+Same load as bench_concurrency.py (mixed /start, /catalog per user, replies checked for
+per-user order), against a Bot API stub in its own process. Gains need free CPU cores:
+each worker is one event loop on one core.
+
+    python bench_shards.py [--users 400] [--per-user 5] [--workers 1,2,4] [--api-latency 0.02]
+"""
+import os, argparse, tempfile
+
+from bench_search import load_importer, build_catalog
+from bench_webhook import free_port
+from bench_concurrency import run_load
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--users", type=int, default=400)
+    ap.add_argument("--per-user", type=int, default=5)
+    ap.add_argument("--workers", default="1,2,4", help="BOT_WORKERS values to try")
+    ap.add_argument("--api-latency", type=float, default=0.02, help="seconds per Bot API call")
+    ap.add_argument("--products", type=int, default=5000)
+    args = ap.parse_args()
+    print(f"CPU cores: {os.cpu_count()}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        build_catalog(load_importer(), os.path.join(tmp, "products.db"), args.products)
+        for n in [int(x) for x in args.workers.split(",")]:
+            r = run_load(args, tmp, warm_users=n, BOT_WORKERS=str(n), WORKER_BASE_PORT=str(free_port()))
+            print(f"BOT_WORKERS={n:<3} {r['updates']} updates in {r['seconds']:6.2f}s "
+                  f"= {r['per_sec']:7.1f}/s  complete={r['complete']}  "
+                  f"users out of order: {r['out_of_order_users']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""Webhook mode end to end: POST recorded updates to a bot.py started with BOT_MODE=webhook.
+
+The bot talks to a local Bot API stub (botapi_stub.py); latency is measured from our POST
+until the bot's first API call for that update (its reply / answerCallbackQuery).
+
+    python bench_webhook.py [--updates 500] [--concurrency 1] [--products 5000] [--recorded FILE.jsonl]
+"""
+import os, sys, copy, json, time, signal, socket, argparse, tempfile, subprocess, http.client
+from concurrent.futures import ThreadPoolExecutor
+
+from botapi_stub import StubBotAPI
+from bench_search import BASE_DIR, load_importer, build_catalog
+
+SECRET = "bench-secret"
+PATH = "/telegram"
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def message(text: str) -> dict:
+    msg = {"message_id": 1, "date": int(time.time()), "text": text,
+           "chat": {"id": 0, "type": "private", "first_name": "Test"},
+           "from": {"id": 0, "is_bot": False, "first_name": "Test", "language_code": "uz"}}
+    if text.startswith("/"):
+        msg["entities"] = [{"offset": 0, "length": len(text.split()[0]), "type": "bot_command"}]
+    return {"update_id": 0, "message": msg}
+
+def callback(data: str) -> dict:
+    return {"update_id": 0, "callback_query": {
+        "id": "0", "chat_instance": "1", "data": data,
+        "from": {"id": 0, "is_bot": False, "first_name": "Test"},
+        "message": {"message_id": 2, "date": int(time.time()), "text": "Katalog",
+                    "chat": {"id": 0, "type": "private", "first_name": "Test"},
+                    "from": {"id": 1, "is_bot": True, "first_name": "Stub"}}}}
+
+def recorded_updates(imp, db_path: str) -> dict:
+    """Update shapes as Telegram sends them for the bot's main entry points."""
+    imp.DB_PATH = db_path
+    with imp.db() as conn:
+        cid = conn.execute("SELECT id FROM categories ORDER BY name LIMIT 1").fetchone()[0]
+    return {
+        "/start": message("/start"),
+        "/catalog": message("/catalog"),
+        "/find": message("/find kran"),
+        "menu text": message("🛒 Katalog"),
+        "CAT": callback(f"CAT|{cid}|0"),
+    }
+
+def load_recorded(path: str) -> dict:
+    out = {}
+    with open(path, encoding="utf-8") as f:
+        for i, line in enumerate(l for l in f if l.strip()):
+            upd = json.loads(line)
+            kind = "callback" if "callback_query" in upd else (upd.get("message", {}).get("text") or "message")
+            out[f"{kind.split()[0]}#{i}"] = upd
+    return out
+
+def personalize(update: dict, uid: int) -> dict:
+    """Unique update_id / user / chat per POST, so the stub can match the bot's answer to it."""
+    u = copy.deepcopy(update)
+    u["update_id"] = uid
+    msg = u.get("message") or (u.get("callback_query") or {}).get("message")
+    if msg:
+        msg["chat"]["id"] = uid
+        if "from" in msg and not msg["from"].get("is_bot"):
+            msg["from"]["id"] = uid
+    if "callback_query" in u:
+        u["callback_query"]["id"] = str(uid)
+        u["callback_query"]["from"]["id"] = uid
+    return u
+
+def post(port: int, body: bytes, secret: str = SECRET, path: str = PATH, conn=None) -> int:
+    c = conn or http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    c.request("POST", path, body, {"Content-Type": "application/json",
+                                   "X-Telegram-Bot-Api-Secret-Token": secret})
+    r = c.getresponse()
+    r.read()
+    if conn is None:
+        c.close()
+    return r.status
+
+def wait_listening(port: int, proc, timeout: float = 30.0) -> None:
+    t_end = time.time() + timeout
+    while time.time() < t_end:
+        if proc.poll() is not None:
+            raise RuntimeError(f"bot.py exited with code {proc.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("bot.py did not start listening")
+
+def start_bot(cwd: str, stub: StubBotAPI, port: int, **env_extra):
+    """bot.py in webhook mode on `port`, talking to `stub`; output goes to cwd/bot.log."""
+    env = dict(os.environ, BOT_TOKEN="123:bench", BOT_MODE="webhook", BOT_API_URL=stub.url,
+               WEBHOOK_PORT=str(port), WEBHOOK_SECRET=SECRET, WEBHOOK_PATH=PATH, WEBHOOK_URL="",
+               WORKERS_CHAT_ID="0", CLIENT_GROUP_IDS="", **env_extra)
+    log = open(os.path.join(cwd, "bot.log"), "w+")
+    proc = subprocess.Popen([sys.executable, os.path.join(BASE_DIR, "bot.py")],
+                            cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+    return proc, log
+
+def stop_bot(proc, log):
+    """SIGINT, wait -> (exit code, bot output)."""
+    proc.send_signal(signal.SIGINT)
+    try:
+        code = proc.wait(timeout=20)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        code = "killed"
+    log.seek(0)
+    out = log.read()
+    log.close()
+    return code, out
+
+def percentiles(ms):
+    ms = sorted(ms)
+    pick = lambda q: ms[min(len(ms) - 1, int(len(ms) * q))]
+    return pick(0.50), pick(0.95), pick(0.99), ms[-1]
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--updates", type=int, default=500)
+    ap.add_argument("--concurrency", type=int, default=1, help="parallel HTTP connections")
+    ap.add_argument("--products", type=int, default=5000)
+    ap.add_argument("--recorded", help="JSON lines of real updates to replay instead of the built-in ones")
+    args = ap.parse_args()
+
+    stub = StubBotAPI().start()
+    port = free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        imp = load_importer()
+        build_catalog(imp, os.path.join(tmp, "products.db"), args.products)
+        updates = load_recorded(args.recorded) if args.recorded else \
+            recorded_updates(imp, os.path.join(tmp, "products.db"))
+
+        proc, log = start_bot(tmp, stub, port)
+        try:
+            wait_listening(port, proc)
+            body = json.dumps(personalize(updates[next(iter(updates))], 1)).encode()
+            print(f"secret check: wrong={post(port, body, secret='nope')} "
+                  f"missing={post(port, body, secret='')} bad path={post(port, body, path='/x')}")
+            stub.wait_for(1)   # warm-up update: categories/caches loaded
+
+            kinds = list(updates)
+            lat = {k: [] for k in kinds}
+            acks = []
+
+            def worker(ids):
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+                for i in ids:
+                    kind = kinds[i % len(kinds)]
+                    uid = 1_000_000 + i
+                    body = json.dumps(personalize(updates[kind], uid)).encode()
+                    t0 = time.perf_counter()
+                    status = post(port, body, conn=conn)
+                    acks.append((time.perf_counter() - t0) * 1000)
+                    t1 = stub.wait_for(uid) if status == 200 else None
+                    if t1 is not None:
+                        lat[kind].append((t1 - t0) * 1000)
+                conn.close()
+
+            t0 = time.perf_counter()
+            n = max(1, args.concurrency)
+            with ThreadPoolExecutor(n) as pool:
+                list(pool.map(worker, [range(j, args.updates, n) for j in range(n)]))
+            wall = time.perf_counter() - t0
+        finally:
+            code, bot_log = stop_bot(proc, log)
+            stub.stop()
+
+    done = sum(len(v) for v in lat.values())
+    print(f"{done}/{args.updates} updates answered in {wall:.2f}s ({done / wall:.0f} updates/s), "
+          f"{stub.total_calls()} Bot API calls, bot exit={code}")
+    p50, p95, p99, mx = percentiles(acks)
+    print(f"{'HTTP ack':12} p50={p50:7.2f}ms  p95={p95:7.2f}ms  p99={p99:7.2f}ms  max={mx:7.2f}ms")
+    for kind, ms in lat.items():
+        if ms:
+            p50, p95, p99, mx = percentiles(ms)
+            print(f"{kind[:12]:12} p50={p50:7.2f}ms  p95={p95:7.2f}ms  p99={p99:7.2f}ms  max={mx:7.2f}ms")
+    if done < args.updates or code != 0:
+        print("---- bot.py output ----")
+        print(bot_log[-3000:])
+
+if __name__ == "__main__":
+    main()
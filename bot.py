@@ -1,6 +1,12 @@
-import os, re, csv, uuid, sqlite3
-from datetime import time, datetime
-from typing import Dict, Any
+import os, re, sys, csv, hmac, html, json, uuid, queue, signal, sqlite3, asyncio, functools, threading
+from datetime import time, datetime, timedelta
+from typing import Dict, Any, Tuple, List, Optional
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from bisect import bisect_left
+from collections import OrderedDict, Counter
+from array import array
+from time import monotonic
 from hashlib import md5
 from telegram.constants import ChatType
 from telegram import ReplyKeyboardMarkup, KeyboardButton
@@ -10,18 +16,22 @@ from dotenv import load_dotenv
 
 from telegram import (
     Update, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove,
-    InlineKeyboardMarkup, InlineKeyboardButton
+    InlineKeyboardMarkup, InlineKeyboardButton, InlineQueryResultArticle,
+    InlineQueryResultPhoto, InlineQueryResultCachedPhoto, InputTextMessageContent
 )
 from telegram.ext import (
-    Application, CommandHandler, MessageHandler, CallbackQueryHandler,
-    ContextTypes, filters
+    Application, CommandHandler, MessageHandler, CallbackQueryHandler, InlineQueryHandler,
+    ContextTypes, filters, BaseUpdateProcessor
 )
 from telegram.request import HTTPXRequest
-from telegram.error import NetworkError, RetryAfter, TimedOut
+from telegram.error import NetworkError, RetryAfter, TimedOut, TelegramError, BadRequest, Forbidden
 
 from hashlib import md5   # add this with your imports
 
-CATEGORY_ID_MAP = {}      # 🔹 add this near the top, a global dictionary
+from textnorm import tokens as search_tokens, normalize as search_normalize
+
+CATEGORY_ID_MAP = {}      # cid -> category name, loaded from the categories table (see load_categories)
+CATEGORY_COUNTS: Dict[str, int] = {}  # category name -> product count
 
 # ==================== ENV / CONFIG ====================
 load_dotenv()
@@ -53,7 +63,49 @@ TZ = pytz.timezone(TZ_NAME)
 
 ORDERS_CSV = "orders.csv"
 DB = "products.db"
+SESSIONS_DB = os.getenv("SESSIONS_DB", "sessions.db")
+ORDERS_DB = os.getenv("ORDERS_DB", "orders.db")
+ORDER_BATCH_SIZE = int(os.getenv("ORDER_BATCH_SIZE", "50"))
+
+# Telegram limits: ~30 messages/s overall, ~20 messages/min into one group
+SEND_RATE = float(os.getenv("SEND_RATE", "25"))                    # global messages per second
+GROUP_SEND_INTERVAL = float(os.getenv("GROUP_SEND_INTERVAL", "3"))  # seconds between messages to one chat
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+OUTBOX_DB = os.getenv("OUTBOX_DB", "outbox.db")
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "20"))
+BROADCAST_MAX_ATTEMPTS = int(os.getenv("BROADCAST_MAX_ATTEMPTS", "4"))  # for timeouts/network errors
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "5000"))        # users kept in memory
+SESSION_IDLE_SECONDS = int(os.getenv("SESSION_IDLE_SECONDS", "1800"))    # in-memory TTL
+SESSION_MAX_AGE_DAYS = int(os.getenv("SESSION_MAX_AGE_DAYS", "30"))      # on-disk retention
+SESSION_FLUSH_SECONDS = float(os.getenv("SESSION_FLUSH_SECONDS", "5"))   # write-behind interval
 PAGE_SIZE = 6  # products per page
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "2000"))    # cached catalog screens
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))              # long-lived read connections / DB threads
+CATALOG_CHECK_SECONDS = float(os.getenv("CATALOG_CHECK_SECONDS", "10"))  # how often to poll the generation
+INLINE_PAGE_SIZE = int(os.getenv("INLINE_PAGE_SIZE", "20"))            # results per inline answer (max 50)
+INLINE_CACHE_SECONDS = int(os.getenv("INLINE_CACHE_SECONDS", "300"))    # Telegram-side cache_time
+INLINE_CACHE_SIZE = int(os.getenv("INLINE_CACHE_SIZE", "5000"))         # cached inline answers here
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))  # updates handled at once (1 = sequential)
+BOT_API_CONNECTIONS = int(os.getenv("BOT_API_CONNECTIONS", "16"))  # httpx pool; gets slower past ~32
+
+# serving: "polling" (default) or "webhook" (Telegram POSTs updates to our local HTTP endpoint)
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")             # public https URL; empty = webhook is set elsewhere
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")       # X-Telegram-Bot-Api-Secret-Token
+BOT_API_URL = os.getenv("BOT_API_URL", "https://api.telegram.org/bot")  # or a local Bot API server
+
+# Prometheus text metrics on http://METRICS_LISTEN:METRICS_PORT/metrics (0 = off); worker i uses METRICS_PORT+1+i
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+
+# scale-out: with BOT_WORKERS > 1 this process only receives updates and routes them by user id
+# to N bot.py workers (worker i listens on 127.0.0.1:WORKER_BASE_PORT+i, WORKER_INDEX=i)
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "-1"))   # -1: not a worker (single process or the front)
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", "8600"))
 
 # ==================== UI TEXT (UZ) ====================
 MAIN_MENU = ReplyKeyboardMarkup(
@@ -79,8 +131,327 @@ PHONE_KB = ReplyKeyboardMarkup(
     resize_keyboard=True, one_time_keyboard=True
 )
 
+# ==================== METRICS ====================
+# Latency histograms and counters for handlers, DB helpers and Bot API calls, kept in
+# process and rendered in Prometheus text format (see serve_metrics). Recording is a
+# dict lookup under a lock, so it is safe from the DB threads too.
+METRIC_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRIC_HELP = {
+    "bot_handler_seconds": ("histogram", "Time spent in each update handler"),
+    "bot_handler_errors_total": ("counter", "Exceptions raised by update handlers"),
+    "bot_db_seconds": ("histogram", "Time spent in products.db helpers"),
+    "bot_db_errors_total": ("counter", "Exceptions raised by products.db helpers"),
+    "bot_sql_statements_total": ("counter", "SQL statements executed, per database"),
+    "bot_api_seconds": ("histogram", "Bot API call latency, per method"),
+    "bot_api_errors_total": ("counter", "Failed Bot API calls (RetryAfter is counted separately)"),
+    "bot_api_retry_after_total": ("counter", "Bot API calls rejected with RetryAfter (flood control)"),
+    "bot_sessions_in_memory": ("gauge", "User states held in memory"),
+    "bot_order_queue_depth": ("gauge", "Orders accepted but not written to orders.db yet"),
+    "bot_outbox_pending": ("gauge", "Staff notifications waiting for delivery"),
+    "bot_update_queue_depth": ("gauge", "Updates received but not picked up yet"),
+    "bot_update_users_waiting": ("gauge", "Users with updates queued or running"),
+    "bot_render_cache_entries": ("gauge", "Cached catalog screens"),
+    "bot_inline_cache_entries": ("gauge", "Cached inline query answers"),
+}
+
+class Metrics:
+    def __init__(self, buckets=METRIC_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._hist: Dict[Tuple[str, tuple], list] = {}      # (name, labels) -> [per-bucket counts..., +Inf, sum]
+        self._counters: Dict[Tuple[str, tuple], float] = {}
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        i = bisect_left(self.buckets, seconds)
+        with self._lock:
+            h = self._hist.get(key)
+            if h is None:
+                h = self._hist[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            h[i] += 1
+            h[-1] += seconds
+
+    def inc(self, name: str, n: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + n
+
+    def histograms(self, name: str) -> Dict[tuple, list]:
+        with self._lock:
+            return {labels: list(h) for (n, labels), h in self._hist.items() if n == name}
+
+    def counter_total(self, name: str) -> float:
+        with self._lock:
+            return sum(v for (n, _), v in self._counters.items() if n == name)
+
+    def quantile(self, h: list, q: float) -> Optional[float]:
+        """Upper bucket bound below which a q share of the observations fall (inf past the last bucket)."""
+        total = sum(h[:-1])
+        if not total:
+            return None
+        acc = 0
+        for bound, c in zip(self.buckets + (float("inf"),), h):
+            acc += c
+            if acc >= q * total:
+                return bound
+
+    def render(self, gauges: Dict[str, float]) -> str:
+        """Prometheus text exposition format (0.0.4)."""
+        def fmt(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+        with self._lock:
+            hist = sorted(self._hist.items())
+            counters = sorted(self._counters.items())
+        out, seen = [], set()
+
+        def head(name):
+            if name not in seen:
+                seen.add(name)
+                kind, text = METRIC_HELP.get(name, ("untyped", ""))
+                out.append(f"# HELP {name} {text}")
+                out.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), h in hist:
+            head(name)
+            acc = 0
+            for bound, c in zip(self.buckets + (float("inf"),), h):
+                acc += c
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                out.append(f"{name}_bucket{fmt(labels, [('le', le)])} {acc}")
+            out.append(f"{name}_sum{fmt(labels)} {h[-1]:.6f}")
+            out.append(f"{name}_count{fmt(labels)} {acc}")
+        for (name, labels), v in counters:
+            head(name)
+            out.append(f"{name}{fmt(labels)} {v:g}")
+        for name, v in sorted(gauges.items()):
+            head(name)
+            out.append(f"{name} {v:g}")
+        return "\n".join(out) + "\n"
+
+metrics = Metrics()
+
+def timed_db(fn):
+    """Record a DB helper's latency (bot_db_seconds{helper=...}) and exceptions."""
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        t0 = monotonic()
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            metrics.inc("bot_db_errors_total", helper=name, error=type(e).__name__)
+            raise
+        finally:
+            metrics.observe("bot_db_seconds", monotonic() - t0, helper=name)
+    return wrapper
+
+def timed_handler(callback):
+    """Record an update handler's latency (bot_handler_seconds{handler=...}) and exceptions."""
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        t0 = monotonic()
+        try:
+            return await callback(update, context)
+        except Exception as e:
+            metrics.inc("bot_handler_errors_total", handler=name, error=type(e).__name__)
+            raise
+        finally:
+            metrics.observe("bot_handler_seconds", monotonic() - t0, handler=name)
+    return wrapper
+
+class MeteredRequest(HTTPXRequest):
+    """HTTPXRequest that records every Bot API call: latency per method, errors, RetryAfter."""
+
+    async def post(self, url, *args, **kwargs):
+        method = url.rsplit("/", 1)[-1]
+        t0 = monotonic()
+        try:
+            return await super().post(url, *args, **kwargs)
+        except RetryAfter:
+            metrics.inc("bot_api_retry_after_total", method=method)
+            raise
+        except TelegramError as e:
+            metrics.inc("bot_api_errors_total", method=method, error=type(e).__name__)
+            raise
+        finally:
+            metrics.observe("bot_api_seconds", monotonic() - t0, method=method)
+
+def count_statements(conn: sqlite3.Connection, db: str) -> sqlite3.Connection:
+    """Count statements run on conn in bot_sql_statements_total{db=...}."""
+    def trace(sql: str) -> None:
+        if not sql.startswith("--"):   # "-- ..." are FTS5/trigger sub-statements of one query
+            metrics.inc("bot_sql_statements_total", db=db)
+    conn.set_trace_callback(trace)
+    return conn
+
 # ==================== STATE ====================
-user_state: Dict[int, Dict[str, Any]] = {}
+class SessionStore:
+    """
+    Per-user conversation state (step, cart, address, ...).
+
+    Memory tier: LRU of at most SESSION_CACHE_SIZE users, entries idle for
+    SESSION_IDLE_SECONDS are dropped. Persistent tier: `sessions` table in
+    SESSIONS_DB, written behind every SESSION_FLUSH_SECONDS by one thread, so
+    carts and half-finished checkouts survive restarts. Handlers mutate the
+    returned dict in place (also after awaits), so every user accessed since
+    shortly before the previous flush is re-serialized and written only if it
+    actually changed.
+    """
+    HANDLER_GRACE = 120  # seconds a handler may keep mutating a state it got earlier
+
+    def __init__(self, path: str, size: int, idle_seconds: int, max_age_days: int):
+        self.path = path
+        self.size = size
+        self.idle_seconds = idle_seconds
+        self.max_age_days = max_age_days
+        self._mem: "OrderedDict[int, list]" = OrderedDict()   # uid -> [state, last_access], LRU order
+        self._flushed_at = 0.0
+        self._pending: Dict[int, str] = {}   # evicted before flush: uid -> json
+        self._deleted: set = set()
+        self._saved: Dict[int, str] = {}     # last persisted json of in-memory users
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sessions")
+        self._conn = None
+        self._task = None
+
+    # --- persistent tier (runs on the single session thread) ---
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = count_statements(sqlite3.connect(self.path), "sessions")
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS sessions (
+                                      user_id INTEGER PRIMARY KEY,
+                                      state TEXT NOT NULL,
+                                      updated_at REAL NOT NULL)""")
+        return self._conn
+
+    def _load(self, uid: int):
+        cutoff = datetime.now().timestamp() - self.max_age_days * 86400
+        r = self._db().execute("SELECT state FROM sessions WHERE user_id=? AND updated_at>=?",
+                               (uid, cutoff)).fetchone()
+        return r[0] if r else None
+
+    def _write(self, upserts: Dict[int, str], deletes: set) -> None:
+        now = datetime.now().timestamp()
+        conn = self._db()
+        with conn:
+            conn.executemany("INSERT INTO sessions (user_id, state, updated_at) VALUES (?, ?, ?) "
+                             "ON CONFLICT(user_id) DO UPDATE SET state=excluded.state, updated_at=excluded.updated_at",
+                             [(uid, blob, now) for uid, blob in upserts.items()])
+            conn.executemany("DELETE FROM sessions WHERE user_id=?", [(uid,) for uid in deletes])
+            conn.execute("DELETE FROM sessions WHERE updated_at<?", (now - self.max_age_days * 86400,))
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    # --- memory tier ---
+    def _remember(self, uid: int, state: Dict[str, Any]) -> Dict[str, Any]:
+        self._mem[uid] = [state, monotonic()]
+        self._mem.move_to_end(uid)
+        self._evict()
+        return state
+
+    def _evict(self) -> None:
+        now = monotonic()
+        while self._mem:
+            uid, (state, seen) = next(iter(self._mem.items()))
+            if len(self._mem) <= self.size and now - seen < self.idle_seconds:
+                break
+            self._mem.popitem(last=False)
+            blob = self._dump(state)
+            if blob != self._saved.pop(uid, ""):
+                self._pending[uid] = blob
+
+    @staticmethod
+    def _dump(state: Dict[str, Any]) -> str:
+        return json.dumps(state, ensure_ascii=False, sort_keys=True, default=str) if state else ""
+
+    async def get(self, uid: int):
+        """The user's state dict, or None if they have none."""
+        hit = self._mem.get(uid)
+        if hit is not None:
+            hit[1] = monotonic()
+            self._mem.move_to_end(uid)
+            return hit[0]
+        if uid in self._deleted:
+            return None
+        blob = self._pending.get(uid)
+        if blob is None:
+            blob = await self._run(self._load, uid)
+            if uid in self._mem:  # another update for this user loaded it meanwhile
+                return await self.get(uid)
+            if blob:
+                self._saved[uid] = blob
+        elif blob:
+            self._pending.pop(uid)   # not persisted yet: no _saved entry, so the next flush writes it
+        if not blob:
+            return None
+        return self._remember(uid, json.loads(blob))
+
+    async def setdefault(self, uid: int) -> Dict[str, Any]:
+        state = await self.get(uid)
+        return state if state is not None else self.set(uid, {})
+
+    def set(self, uid: int, state: Dict[str, Any]) -> Dict[str, Any]:
+        self._deleted.discard(uid)
+        self._pending.pop(uid, None)
+        return self._remember(uid, state)
+
+    def pop(self, uid: int) -> None:
+        self._mem.pop(uid, None)
+        self._pending.pop(uid, None)
+        self._saved.pop(uid, None)
+        self._deleted.add(uid)
+
+    def __len__(self) -> int:
+        return len(self._mem)
+
+    async def flush(self) -> None:
+        self._evict()
+        upserts = {uid: blob for uid, blob in self._pending.items() if blob}
+        deletes = set(self._deleted) | {uid for uid, blob in self._pending.items() if not blob}
+        since = self._flushed_at - self.HANDLER_GRACE
+        self._flushed_at = monotonic()
+        for uid in reversed(self._mem):  # most recently used first
+            state, seen = self._mem[uid]
+            if seen < since:
+                break
+            blob = self._dump(state)
+            if blob != self._saved.get(uid, ""):
+                if blob:
+                    upserts[uid] = blob
+                else:
+                    deletes.add(uid)
+                self._saved[uid] = blob
+        self._pending.clear()
+        self._deleted.clear()
+        if upserts or deletes:
+            await self._run(self._write, upserts, deletes)
+
+    async def _flush_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"[warn] session flush failed: {e}")
+
+    def start(self, interval: float) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._flush_loop(interval))
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+        await self.flush()
+
+sessions = SessionStore(SESSIONS_DB, SESSION_CACHE_SIZE, SESSION_IDLE_SECONDS, SESSION_MAX_AGE_DAYS)
 
 import os, csv
 from datetime import datetime
@@ -104,60 +475,396 @@ def location_keyboard_for(chat) -> ReplyKeyboardMarkup:
             one_time_keyboard=False
         )
 
-def save_order_row(row: Dict[str, Any]):
-    file_exists = os.path.exists(ORDERS_CSV)
-    # master schema — now includes 'location'
-    fieldnames = [
-        "time",
-        "user_id",
-        "username",
-        "name",
-        "phone",
-        "address",
-        "location",   # ← NEW
-        "items",
-        "note",
-        "total",
-        "status",
-    ]
+# ==================== ORDERS ====================
+# master schema of an order; also the column order of the CSV export
+ORDER_FIELDS = ["id", "time", "user_id", "username", "name", "phone", "address",
+                "location", "items", "note", "total", "status"]
+
+# column sets orders.csv went through before the SQLite store (matched by field count)
+LEGACY_CSV_LAYOUTS = {
+    8: ["user_id", "username", "name", "phone", "address", "items", "note", "status"],
+    9: ["user_id", "username", "name", "phone", "address", "items", "note", "total", "status"],
+    11: ["time", "user_id", "username", "name", "phone", "address", "location", "items", "note", "total", "status"],
+    12: ORDER_FIELDS,  # an export written by OrderStore.export_csv
+}
 
-    # add time and write safely
-    row = dict(row)
-    row.setdefault("time", datetime.now().isoformat(timespec="seconds"))
+def _order_total(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None  # "(aniqlanmagan)" / empty
+
+# "Title x2 — 15000 so‘m; Other x1 — 900 so‘m" (catalog checkout) or free text lines ("Unitaz x2")
+ORDER_ITEM_RE = re.compile(r"^(?P<item>.*?)\s*[xх×]\s*(?P<qty>\d+)(?:\s*—\s*(?P<price>[\d.]+)\s*so‘m)?\s*$")
+
+def parse_order_items(items):
+    """[(item, qty, unit_price or None)] from an order's items text."""
+    out = []
+    for part in re.split(r"[;\n]", items or ""):
+        part = part.strip(" -•\t")
+        if not part:
+            continue
+        m = ORDER_ITEM_RE.match(part)
+        if m and m.group("item").rstrip(" ,"):
+            price = m.group("price")
+            out.append((m.group("item").rstrip(" ,"), int(m.group("qty")), float(price) if price else None))
+        else:
+            out.append((part, 1, None))
+    return out
+
+class OrderStore:
+    """
+    Orders in an indexed SQLite table. confirm_callback only calls submit(): the
+    order gets its id immediately and is queued; a single writer task drains the
+    queue and commits in batches on its own thread, so handlers never wait on disk
+    and concurrent confirmations can't interleave or get lost.
+    """
 
-    with open(ORDERS_CSV, "a", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
-        if not file_exists:
-            writer.writeheader()
-        writer.writerow(row)
+    def __init__(self, path: str, batch_size: int = 50, batch_wait: float = 0.2):
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self._queue: "asyncio.Queue[Dict[str, Any]]" = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="orders")
+        self._conn = None
+        self._next_id = None
+        self._id_step = 1
+        self._task = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = count_statements(sqlite3.connect(self.path), "orders")
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS orders (
+                    id INTEGER PRIMARY KEY,
+                    time TEXT NOT NULL,
+                    user_id INTEGER,
+                    username TEXT,
+                    name TEXT,
+                    phone TEXT,
+                    address TEXT,
+                    location TEXT,
+                    items TEXT,
+                    note TEXT,
+                    total REAL,
+                    status TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_orders_time ON orders (time);
+                CREATE INDEX IF NOT EXISTS idx_orders_user ON orders (user_id, time);
+
+                -- daily rollups for /report, maintained in the same transaction as the orders
+                CREATE TABLE IF NOT EXISTS order_daily (
+                    day TEXT PRIMARY KEY,
+                    orders INTEGER NOT NULL,
+                    revenue REAL NOT NULL,
+                    priced INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS order_daily_items (
+                    day TEXT NOT NULL,
+                    item TEXT NOT NULL,
+                    qty INTEGER NOT NULL,
+                    revenue REAL NOT NULL,
+                    PRIMARY KEY (day, item)
+                );
+                CREATE TABLE IF NOT EXISTS order_daily_customers (
+                    day TEXT NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    orders INTEGER NOT NULL,
+                    PRIMARY KEY (day, user_id)
+                );
+                CREATE TABLE IF NOT EXISTS customers (
+                    user_id INTEGER PRIMARY KEY,
+                    first_day TEXT NOT NULL,
+                    orders INTEGER NOT NULL
+                );
+
+                -- orders the writer could not store (constraint violations, bad values), kept as JSON
+                CREATE TABLE IF NOT EXISTS orders_failed (
+                    id INTEGER,
+                    payload TEXT NOT NULL,
+                    error TEXT,
+                    failed_at REAL NOT NULL
+                );
+            """)
+        return self._conn
+
+    def _open(self, legacy_csv: str) -> int:
+        conn = self._db()
+        if legacy_csv and os.path.exists(legacy_csv) and not conn.execute("SELECT 1 FROM orders LIMIT 1").fetchone():
+            n = self._import_legacy_csv(legacy_csv)
+            if n:
+                print(f"{legacy_csv}: {n} ta eski buyurtma {self.path} ga ko‘chirildi")
+        if (conn.execute("SELECT 1 FROM orders LIMIT 1").fetchone()
+                and not conn.execute("SELECT 1 FROM order_daily LIMIT 1").fetchone()):
+            # orders.db from before the rollups: aggregate the history once
+            with conn:
+                self._rollup(conn, [dict(zip(ORDER_FIELDS, r)) for r in
+                                    conn.execute(f"SELECT {','.join(ORDER_FIELDS)} FROM orders ORDER BY id")])
+        return conn.execute("SELECT COALESCE(MAX(id), 0) FROM orders").fetchone()[0]
+
+    def _import_legacy_csv(self, path: str) -> int:
+        rows = []
+        with open(path, newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            next(reader, None)  # header of the first layout only
+            for rec in reader:
+                cols = LEGACY_CSV_LAYOUTS.get(len(rec))
+                if cols:
+                    rows.append(dict(zip(cols, rec)))
+        self._write(rows)
+        return len(rows)
+
+    def _write(self, rows) -> None:
+        conn = self._db()
+        with conn:
+            conn.executemany(
+                f"INSERT INTO orders ({','.join(ORDER_FIELDS)}) VALUES ({','.join('?' * len(ORDER_FIELDS))})",
+                [(r.get("id"), r.get("time") or "", r.get("user_id"), r.get("username"), r.get("name"),
+                  r.get("phone"), r.get("address"), r.get("location") or "", r.get("items"), r.get("note"),
+                  _order_total(r.get("total")), r.get("status")) for r in rows])
+            self._rollup(conn, rows)
+
+    @staticmethod
+    def _rollup(conn: sqlite3.Connection, rows) -> None:
+        """Fold orders into the daily rollups (orders without a time can't be dated and are skipped)."""
+        for r in rows:
+            day = (r.get("time") or "")[:10]
+            if not day:
+                continue
+            total = _order_total(r.get("total"))
+            conn.execute("""INSERT INTO order_daily (day, orders, revenue, priced) VALUES (?, 1, ?, ?)
+                            ON CONFLICT(day) DO UPDATE SET orders=orders+1, revenue=revenue+excluded.revenue,
+                                                           priced=priced+excluded.priced""",
+                         (day, total or 0, 1 if total is not None else 0))
+            for item, qty, price in parse_order_items(r.get("items")):
+                conn.execute("""INSERT INTO order_daily_items (day, item, qty, revenue) VALUES (?, ?, ?, ?)
+                                ON CONFLICT(day, item) DO UPDATE SET qty=qty+excluded.qty,
+                                                                     revenue=revenue+excluded.revenue""",
+                             (day, item, qty, (price or 0) * qty))
+            uid = r.get("user_id")
+            if uid in (None, ""):
+                continue
+            conn.execute("""INSERT INTO order_daily_customers (day, user_id, orders) VALUES (?, ?, 1)
+                            ON CONFLICT(day, user_id) DO UPDATE SET orders=orders+1""", (day, uid))
+            conn.execute("""INSERT INTO customers (user_id, first_day, orders) VALUES (?, ?, 1)
+                            ON CONFLICT(user_id) DO UPDATE SET orders=orders+1,
+                                                               first_day=MIN(first_day, excluded.first_day)""",
+                         (uid, day))
+
+    def _report(self, since: str, top: int) -> Dict[str, Any]:
+        conn = self._db()
+        n, revenue, priced = conn.execute(
+            "SELECT COALESCE(SUM(orders),0), COALESCE(SUM(revenue),0), COALESCE(SUM(priced),0) "
+            "FROM order_daily WHERE day>=?", (since,)).fetchone()
+        items = conn.execute(
+            "SELECT item, SUM(qty) AS q, SUM(revenue) FROM order_daily_items WHERE day>=? "
+            "GROUP BY item ORDER BY q DESC, item LIMIT ?", (since, top)).fetchall()
+        customers, repeat = conn.execute("""
+            SELECT COUNT(*), COALESCE(SUM(p.n >= 2 OR c.first_day < ?), 0)
+            FROM (SELECT user_id, SUM(orders) AS n FROM order_daily_customers
+                  WHERE day>=? GROUP BY user_id) p
+            JOIN customers c ON c.user_id = p.user_id""", (since, since)).fetchone()
+        return {"orders": n, "revenue": revenue, "priced": priced, "items": items,
+                "customers": customers, "repeat": repeat}
+
+    async def report(self, since: str, top: int = 5) -> Dict[str, Any]:
+        """Aggregates for days >= since (YYYY-MM-DD), read from the rollups only."""
+        return await self._run(self._report, since, top)
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def start(self, legacy_csv: str = "", shard: Tuple[int, int] = (0, 1)) -> None:
+        """shard=(i, n): one of n processes writing the same orders.db; it hands out ids ≡ i (mod n)."""
+        self._queue = asyncio.Queue()
+        first = await self._run(self._open, legacy_csv) + 1
+        i, n = shard
+        self._id_step = n
+        self._next_id = first + (i - first) % n
+        self._task = asyncio.get_running_loop().create_task(self._writer())
+
+    def submit(self, row: Dict[str, Any]) -> int:
+        """Queue an order and return its id right away (no I/O)."""
+        row = dict(row)
+        row["id"] = self._next_id
+        self._next_id += self._id_step
+        row.setdefault("time", datetime.now().isoformat(timespec="seconds"))
+        self._queue.put_nowait(row)
+        return row["id"]
+
+    async def _writer(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_wait
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), max(0, deadline - loop.time())))
+                except asyncio.TimeoutError:
+                    break
+            todo = [batch]
+            while todo:
+                rows = todo[0]
+                try:
+                    await self._run(self._write, rows)
+                    todo.pop(0)
+                except sqlite3.OperationalError as e:
+                    # locked/busy/disk full: keep the batch and retry, losing an order is worse than a late one
+                    print(f"[warn] orders write failed ({len(rows)} ta): {e}")
+                    await asyncio.sleep(1)
+                except sqlite3.Error as e:
+                    # IntegrityError & co. fail the same way every time: retrying would hold back
+                    # every later order. Write the batch row by row and park the bad ones.
+                    todo.pop(0)
+                    if len(rows) > 1:
+                        todo[:0] = [[r] for r in rows]
+                    else:
+                        await self._park(rows[0], e)
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _park(self, row: Dict[str, Any], error: Exception) -> None:
+        print(f"[warn] order #{row.get('id')} not stored, moved to orders_failed: {error}")
+        try:
+            await self._run(self._dead_letter, row, f"{type(error).__name__}: {error}")
+        except sqlite3.Error as e:
+            print(f"[warn] order #{row.get('id')} lost: {json.dumps(row, ensure_ascii=False, default=str)} ({e})")
+
+    def _dead_letter(self, row: Dict[str, Any], error: str) -> None:
+        with self._db() as conn:
+            conn.execute("INSERT INTO orders_failed (id, payload, error, failed_at) VALUES (?, ?, ?, ?)",
+                         (row.get("id"), json.dumps(row, ensure_ascii=False, default=str), error,
+                          datetime.now().timestamp()))
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def stop(self) -> None:
+        if self._task:
+            await self._queue.join()
+            self._task.cancel()
+
+    async def export(self, path: str) -> Tuple[int, bytes]:
+        """Write the CSV export to path; returns (row count, file contents). No file I/O on the loop."""
+        if self._queue:
+            await self._queue.join()  # include orders still waiting for the writer
+        return await self._run(self._export_file, path)
+
+    def _export_file(self, path: str) -> Tuple[int, bytes]:
+        n = self.export_csv(path)
+        with open(path, "rb") as f:
+            return n, f.read()
+
+    def export_csv(self, path: str) -> int:
+        """Write every order to a CSV file (ORDER_FIELDS columns); returns the row count."""
+        cur = self._db().execute(f"SELECT {','.join(ORDER_FIELDS)} FROM orders ORDER BY id")
+        n = 0
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(ORDER_FIELDS)
+            for r in cur:
+                writer.writerow(r)
+                n += 1
+        return n
+
+orders = OrderStore(ORDERS_DB, ORDER_BATCH_SIZE)
 
 # ==================== DB HELPERS ====================
+# Read-only access to products.db goes through a small pool of long-lived connections
+# (WAL, mmap, per-connection statement cache). Handlers never query on the event loop:
+# they await run_db(fn, ...), which runs the sync helper below on DB_EXECUTOR.
+class ReadPool:
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+
+    def _open(self) -> sqlite3.Connection:
+        conn = count_statements(sqlite3.connect(self.path, check_same_thread=False, cached_statements=256), "products")
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")  # readers don't block import.py's writer
+        except sqlite3.OperationalError:
+            pass  # DB busy/locked right now; stays in its current mode
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA query_only=1")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._open()  # never block: nested helpers may need a second one
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            if self._idle.qsize() < self.size:
+                self._idle.put(conn)
+            else:
+                conn.close()
+
+_pools: Dict[str, ReadPool] = {}
+DB_EXECUTOR = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+
 def db_conn():
-    return sqlite3.connect(DB)
+    pool = _pools.get(DB)
+    if pool is None:
+        pool = _pools[DB] = ReadPool(DB, DB_POOL_SIZE)
+    return pool.connection()
+
+async def run_db(fn, *args, **kwargs):
+    """Run a blocking DB helper on the DB thread pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(DB_EXECUTOR, lambda: fn(*args, **kwargs))
 
 def location_request_keyboard():
     kb = [[KeyboardButton("📍 Manzilimni ulashish", request_location=True)],
           ["◀️ Ortga"]]
     return ReplyKeyboardMarkup(kb, resize_keyboard=True, one_time_keyboard=True)
 
+@timed_db
 def list_categories():
+    """[{"id","category","count"}] from import.py's categories table (GROUP BY fallback for old DBs)."""
     if not os.path.exists(DB): return []
     with db_conn() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT COALESCE(category,'Other') AS c, COUNT(*) FROM products GROUP BY c ORDER BY c")
-        return [{"category": r[0], "count": r[1]} for r in cur.fetchall()]
+        try:
+            cur.execute("SELECT id, name, count FROM categories ORDER BY name")
+            rows = cur.fetchall()
+        except sqlite3.OperationalError:
+            rows = None
+        if not rows:
+            cur.execute("SELECT COALESCE(category,'Other') AS c, COUNT(*) FROM products GROUP BY c ORDER BY c")
+            rows = [(category_id(c), c, n) for c, n in cur.fetchall()]
+    return [{"id": r[0], "category": r[1], "count": r[2]} for r in rows]
+
+def load_categories():
+    """Refresh CATEGORY_ID_MAP so CAT|cid|... buttons resolve without a /catalog first (also after restarts)."""
+    cats = list_categories()
+    # update in place without an empty window: handlers read these from the event loop
+    with _categories_lock:
+        for target, fresh in ((CATEGORY_ID_MAP, {c["id"]: c["category"] for c in cats}),
+                              (CATEGORY_COUNTS, {c["category"]: c["count"] for c in cats})):
+            target.update(fresh)
+            for k in [k for k in target if k not in fresh]:
+                target.pop(k, None)
+    return cats
+
+_categories_lock = threading.Lock()
 
 def category_id(name: str) -> str:
     """
-    Return a short, stable ID for a category (10 hex chars).
-    Also store mapping for reverse lookup.
+    Short, stable ID for a category (10 hex chars, same as import.py's categories.id).
+    Only used for databases without the categories table.
     """
     if not name:
         name = "Other"
-    cid = md5(name.encode("utf-8")).hexdigest()[:10]
-    CATEGORY_ID_MAP[cid] = name
-    return cid
+    return md5(name.encode("utf-8")).hexdigest()[:10]
 
+@timed_db
 def get_product(sku):
     if not os.path.exists(DB): return None
     with db_conn() as conn:
@@ -169,6 +876,22 @@ def get_product(sku):
         keys = ["sku","title","price","category","subcategory","description","image_url","image_path","stock"]
         return dict(zip(keys, r))
 
+@timed_db
+def get_products(skus):
+    """Bulk lookup for cart rendering: one query, {sku: {"sku","title","price"}} (missing SKUs are absent)."""
+    skus = list(dict.fromkeys(skus))
+    if not skus or not os.path.exists(DB): return {}
+    out = {}
+    with db_conn() as conn:
+        cur = conn.cursor()
+        # stay well under SQLITE_MAX_VARIABLE_NUMBER even for absurd carts
+        for i in range(0, len(skus), 500):
+            chunk = skus[i:i + 500]
+            cur.execute(f"SELECT sku,title,price FROM products WHERE sku IN ({','.join('?' * len(chunk))})", chunk)
+            out.update((a, {"sku": a, "title": b, "price": c}) for (a, b, c) in cur.fetchall())
+    return out
+
+@timed_db
 def search_products(q, limit=PAGE_SIZE, offset=0, category=None):
     if not os.path.exists(DB): return []
     q_like = f"%{q}%" if q else "%"
@@ -184,22 +907,194 @@ def search_products(q, limit=PAGE_SIZE, offset=0, category=None):
         cur.execute(sql, args)
         return [{"sku":a, "title":b, "price":c} for (a,b,c) in cur.fetchall()]
 
-def category_id(name: str) -> str:
+@timed_db
+def category_page(category, after=None, before=None, limit=PAGE_SIZE):
     """
-    Make a short, stable ID for a category (<=64 bytes safe).
-    Stores mapping for reverse lookup when user clicks buttons.
+    Keyset page of a category ordered by (title, sku), served from
+    idx_products_category_title. `after`/`before` is the SKU of the last/first
+    item of the neighbouring page, so deep pages cost the same as the first one.
+    Returns up to limit+1 rows; the extra row only signals that more exist.
     """
-    if not name:
-        name = "Other"
-    cid = md5(name.encode("utf-8")).hexdigest()[:10]
-    CATEGORY_ID_MAP[cid] = name
-    return cid
+    if not os.path.exists(DB): return []
+    cols = "SELECT sku,title,price FROM products WHERE category=?"
+    if after:
+        sql = cols + " AND (title, sku) > (SELECT title, sku FROM products WHERE sku=?) ORDER BY title, sku LIMIT ?"
+        args = (category, after, limit + 1)
+    elif before:
+        sql = cols + " AND (title, sku) < (SELECT title, sku FROM products WHERE sku=?) ORDER BY title DESC, sku DESC LIMIT ?"
+        args = (category, before, limit)
+    else:
+        sql = cols + " ORDER BY title, sku LIMIT ?"
+        args = (category, limit + 1)
+    with db_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(sql, args)
+        rows = cur.fetchall()
+    if before:
+        rows.reverse()
+    return [{"sku":a, "title":b, "price":c} for (a,b,c) in rows]
+
+def count_category(category) -> int:
+    if category in CATEGORY_COUNTS:
+        return CATEGORY_COUNTS[category]
+    if not os.path.exists(DB): return 0
+    with db_conn() as conn:
+        return conn.execute("SELECT COUNT(*) FROM products WHERE category=?", (category,)).fetchone()[0]
+
+# ==================== PHOTO FILE_ID CACHE ====================
+# After the first upload Telegram gives us a file_id; sending that instead of the bytes
+# (or URL) is instant. Keys are content based (see image_key), so a photo that import.py
+# replaced simply gets a new key.
+_image_hashes: Dict[tuple, str] = {}   # (path, size, mtime_ns) -> md5 of the file
+
+def image_key(p):
+    """Cache key for a product's photo, or None if it has none. May read the file: call via run_db."""
+    if p.get("image_url"):
+        return md5(f"url:{p['image_url']}".encode("utf-8")).hexdigest()
+    path = p.get("image_path")
+    if not path:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    sig = (path, st.st_size, st.st_mtime_ns)
+    h = _image_hashes.get(sig)
+    if h is None:
+        with open(path, "rb") as f:
+            h = md5(f.read()).hexdigest()
+        _image_hashes[sig] = h
+    return h
+
+class PhotoCache:
+    """image_key -> file_id, in memory with the photo_file_ids table in products.db behind it."""
+
+    def __init__(self):
+        self._mem: Dict[str, str] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="photos")
+        self._conn = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = count_statements(sqlite3.connect(DB, timeout=30), "products")
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS photo_file_ids (
+                                      image_key TEXT PRIMARY KEY,
+                                      file_id TEXT NOT NULL,
+                                      updated_at REAL NOT NULL)""")
+        return self._conn
+
+    def _load(self, key: str):
+        r = self._db().execute("SELECT file_id FROM photo_file_ids WHERE image_key=?", (key,)).fetchone()
+        return r[0] if r else None
+
+    def _store(self, key: str, file_id) -> None:
+        with self._db() as conn:
+            if file_id:
+                conn.execute("INSERT INTO photo_file_ids (image_key, file_id, updated_at) VALUES (?, ?, ?) "
+                             "ON CONFLICT(image_key) DO UPDATE SET file_id=excluded.file_id, updated_at=excluded.updated_at",
+                             (key, file_id, datetime.now().timestamp()))
+            else:
+                conn.execute("DELETE FROM photo_file_ids WHERE image_key=?", (key,))
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def get(self, key: str):
+        if key not in self._mem:
+            self._mem[key] = await self._run(self._load, key)
+        return self._mem[key]
+
+    def peek(self, key: str):
+        """file_id if already known in memory (no DB read), else None."""
+        return self._mem.get(key)
+
+    async def put(self, key: str, file_id) -> None:
+        self._mem[key] = file_id
+        try:
+            await self._run(self._store, key, file_id)
+        except sqlite3.Error as e:
+            print(f"[warn] photo cache write failed: {e}")  # still cached in memory
+
+photo_cache = PhotoCache()
+
+# ==================== RENDERED CATALOG CACHE ====================
+# (text, InlineKeyboardMarkup) per catalog screen: "ROOT" for /catalog, the CAT|... callback
+# data for category pages. Dropped as a whole when import.py bumps catalog_meta.generation.
+RENDER_CACHE: "OrderedDict[str, tuple]" = OrderedDict()
+_catalog_gen = {"value": None, "checked": 0.0}
+
+def catalog_generation():
+    """Generation written by import.py (products.db mtime for DBs that predate it)."""
+    if not os.path.exists(DB): return None
+    with db_conn() as conn:
+        try:
+            r = conn.execute("SELECT value FROM catalog_meta WHERE key='generation'").fetchone()
+        except sqlite3.OperationalError:
+            r = None
+    return r[0] if r else os.path.getmtime(DB)
+
+async def _check_catalog_generation():
+    now = monotonic()
+    if now - _catalog_gen["checked"] < CATALOG_CHECK_SECONDS:
+        return
+    _catalog_gen["checked"] = now
+    gen = await run_db(catalog_generation)
+    if gen != _catalog_gen["value"]:
+        _catalog_gen["value"] = gen
+        RENDER_CACHE.clear()
+        INLINE_CACHE.clear()
+        await run_db(load_categories)
+
+async def cached_render(key, build):
+    """Return the cached (text, markup) for key, or run build() on the DB pool and cache it.
+    build() may return None (not cached)."""
+    await _check_catalog_generation()
+    hit = RENDER_CACHE.get(key)
+    if hit is not None:
+        RENDER_CACHE.move_to_end(key)
+        return hit
+    gen = _catalog_gen["value"]
+    out = await run_db(build)
+    if out is not None and gen == _catalog_gen["value"]:   # catalog didn't change while building
+        RENDER_CACHE[key] = out
+        if len(RENDER_CACHE) > RENDER_CACHE_SIZE:
+            RENDER_CACHE.popitem(last=False)
+    return out
+
+def fts_match_query(q: str) -> str:
+    """'Dush gel' -> '"dush"* "gel"*' (every word must match, as a prefix)."""
+    return " ".join(f'"{t}"*' for t in search_tokens(q))
+
+@timed_db
+def search_products_fts(q, limit=PAGE_SIZE):
+    """Ranked full-text search (products_fts, built by import.py); LIKE scan if the index is missing."""
+    if not os.path.exists(DB): return []
+    match = fts_match_query(q)
+    if not match:
+        return []
+    sql = """SELECT p.sku, p.title, p.price
+             FROM products_fts f JOIN products p ON p.rowid = f.rowid
+             WHERE products_fts MATCH ?
+             ORDER BY bm25(products_fts, 0.0, 10.0, 3.0, 1.0)
+             LIMIT ?"""
+    with db_conn() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(sql, (match, limit))
+            rows = cur.fetchall()
+        except sqlite3.OperationalError:
+            rows = None
+    if rows is None:
+        # products.db from before the FTS index: re-run import.py to build it
+        return search_products(q, limit=limit)
+    return [{"sku":a, "title":b, "price":c} for (a,b,c) in rows]
 
 def compute_cart_total(cart):
     total = 0
     lines = []
+    products = get_products(item["sku"] for item in cart)
     for item in cart:
-        p = get_product(item["sku"])
+        p = products.get(item["sku"])
         if not p: 
             continue
         qty = item["qty"]
@@ -214,6 +1109,202 @@ def apply_pricing_rules(subtotal: int):
     grand = after + delivery
     return {"subtotal": subtotal, "discount": discount, "delivery": delivery, "total": grand}
 
+# ==================== ORDER TEXT RESOLVER ====================
+# Free-text orders ("Dush geli x2", "2 ta sovun", "кран 2шт") -> catalog SKUs through an
+# in-memory trigram index over product titles. The index is rebuilt in the background
+# when the catalog generation changes (see product_index).
+QTY_RE = re.compile(
+    r"(?:^|\s)[xх×*]\s*(?P<a>\d{1,3})(?=\s|$)"                                     # x2, х 2, ×2
+    r"|(?:^|\s)(?P<b>\d{1,3})\s*(?:x|х|×|ta|dona|шт\.?|штук[аи]?|pcs)(?=\s|$|[.!])",  # 2x, 2 ta, 2шт
+    re.IGNORECASE)
+LIST_MARK_RE = re.compile(r"^\s*(?:[-–•*]+|\d{1,2}[.)])\s+")
+# lines are split on newlines and ";". Titles contain commas ("Aquarius 1,2", "трубе, септик"),
+# so a comma only separates items when a quantity or list marker follows it: "Sovun x2, 3 ta dush"
+LINE_SPLIT_RE = re.compile(
+    r"[\n;]+"
+    r"|,(?=\s+(?:[xх×*]\s*\d|\d{1,3}\s*(?:x|х|×|ta|dona|шт\.?|штук[аи]?|pcs)(?:\s|$)|[-–•]\s))",
+    re.IGNORECASE)
+RESOLVE_MIN_SCORE = float(os.getenv("RESOLVE_MIN_SCORE", "0.55"))
+RESOLVE_CANDIDATES = 40
+RESOLVE_MAX_DF = 0.05   # trigrams found in >5% of titles only rank candidates, they don't produce them
+INLINE_PREFIX_LEN = 3   # word prefixes up to this length have precomputed postings; longer ones bisect the vocabulary
+
+def trigrams(text: str) -> set:
+    """Trigrams of normalized text, words padded like pg_trgm ("  ab", " ab", "ab ")."""
+    out = set()
+    for w in text.split():
+        w = f"  {w} "
+        out.update(w[i:i + 3] for i in range(len(w) - 2))
+    return out
+
+def split_order_lines(text: str) -> List[Tuple[str, int]]:
+    """'Dush geli x2\n- 3 ta sovun' -> [('Dush geli', 2), ('sovun', 3)]"""
+    out = []
+    for raw in LINE_SPLIT_RE.split(text or ""):
+        line = LIST_MARK_RE.sub("", raw).strip()
+        qty = 1
+        m = None
+        for m in QTY_RE.finditer(line):
+            pass   # the last quantity wins: "Truba 20 x 2 x3" -> 3
+        if m:
+            qty = int(m.group("a") or m.group("b"))
+            line = (line[:m.start()] + " " + line[m.end():]).strip()
+        if line:
+            out.append((line, max(1, qty)))
+    return out
+
+class ProductIndex:
+    """
+    In-memory index over the catalog, products numbered in catalog (price list) order:
+    trigram postings for the order resolver, word postings + precomputed short prefixes for
+    inline search. Postings are ascending arrays of product positions.
+    """
+
+    def __init__(self, gen, rows, file_ids: Optional[Dict[str, str]] = None):
+        self.gen = gen
+        self.skus: List[str] = []
+        self.titles: List[str] = []   # normalized
+        self.display: List[Tuple[str, Any, Optional[str], Optional[str]]] = []   # (title, price, image_url, image_key)
+        self.sku_pos: Dict[str, int] = {}
+        self.postings: Dict[str, array] = {}
+        self.file_ids = file_ids or {}   # image_key -> Telegram file_id, as of the build
+        words: Dict[str, array] = {}
+        prefixes: Dict[str, array] = {}
+        for row in rows:
+            sku, title = row[0], row[1]
+            pid = len(self.skus)
+            norm = search_normalize(title)
+            self.skus.append(sku)
+            self.titles.append(norm)
+            self.sku_pos[sku] = pid
+            if len(row) > 2:
+                self.display.append(tuple(row[1:]))
+            for t in trigrams(norm):
+                p = self.postings.get(t)
+                if p is None:
+                    p = self.postings[t] = array("I")
+                p.append(pid)
+            toks = set(norm.split())
+            for w in toks:
+                words.setdefault(w, array("I")).append(pid)
+            for pre in {w[:n] for w in toks for n in range(1, min(len(w), INLINE_PREFIX_LEN) + 1)}:
+                prefixes.setdefault(pre, array("I")).append(pid)
+        self.max_df = max(50, int(len(self.skus) * RESOLVE_MAX_DF))
+        self.vocab: List[str] = sorted(words)
+        self.word_postings: List[array] = [words[w] for w in self.vocab]
+        self.prefixes = prefixes
+
+    @classmethod
+    def load(cls, gen) -> "ProductIndex":
+        if not os.path.exists(DB):
+            return cls(gen, [])
+        with db_conn() as conn:
+            rows = conn.execute("SELECT sku, title, price, image_url, image_path FROM products "
+                                "WHERE title<>'' ORDER BY rowid").fetchall()
+            try:
+                file_ids = dict(conn.execute("SELECT image_key, file_id FROM photo_file_ids"))
+            except sqlite3.OperationalError:
+                file_ids = {}   # no photo has been sent yet
+        return cls(gen, [(sku, title, price, url,
+                          image_key({"image_url": url, "image_path": path}) if url or path else None)
+                         for sku, title, price, url, path in rows], file_ids)
+
+    def __len__(self) -> int:
+        return len(self.skus)
+
+    def match(self, name: str) -> Optional[str]:
+        """Best SKU for one order line, or None if nothing is similar enough."""
+        if name in self.sku_pos:
+            return name
+        q = trigrams(search_normalize(name))
+        lists = sorted((self.postings[t] for t in q if t in self.postings), key=len)
+        if not lists:
+            return None
+        counts = Counter()
+        for p in [p for p in lists if len(p) <= self.max_df] or lists[:2]:
+            counts.update(p)
+        best, best_score = None, RESOLVE_MIN_SCORE
+        for pid, _ in counts.most_common(RESOLVE_CANDIDATES):
+            t = trigrams(self.titles[pid])
+            common = len(q & t)
+            # mostly "how much of what the customer typed is in the title", a bit of the reverse
+            score = 0.8 * common / len(q) + 0.2 * common / len(t)
+            if score > best_score:
+                best, best_score = pid, score
+        return None if best is None else self.skus[best]
+
+    def prefix_postings(self, prefix: str):
+        """Ascending positions of products with a title word starting with `prefix`."""
+        if len(prefix) <= INLINE_PREFIX_LEN:
+            return self.prefixes.get(prefix, ())
+        lo = bisect_left(self.vocab, prefix)
+        hi = bisect_left(self.vocab, prefix + "\uffff", lo)
+        if hi - lo == 1:
+            return self.word_postings[lo]
+        return sorted(set().union(*self.word_postings[lo:hi]))
+
+    def prefix_search(self, query: str, offset: int = 0, limit: int = 20) -> Tuple[List[int], bool]:
+        """
+        Positions of products where every query word is a prefix of some title word, in catalog
+        order: (page at offset, more pages?). Stops as soon as the page is known to be full.
+        """
+        words = search_tokens(query)
+        if not words:
+            return list(range(offset, min(offset + limit, len(self)))), offset + limit < len(self)
+        lists = sorted((self.prefix_postings(w) for w in set(words)), key=len)
+        need = offset + limit + 1
+        driver, others = lists[0], lists[1:]
+        if not others:
+            found = list(driver[offset:need])
+        elif len(driver) > 2000:   # big lists: intersect in C, then order
+            common = set(driver)
+            for o in others:
+                common.intersection_update(o)
+            found = sorted(common)[offset:need]
+        else:
+            found = []
+            for pid in driver:
+                for o in others:
+                    i = bisect_left(o, pid)
+                    if i == len(o) or o[i] != pid:
+                        break
+                else:
+                    found.append(pid)
+                    if len(found) >= need:
+                        break
+            found = found[offset:]
+        return found[:limit], len(found) > limit
+
+def resolve_order_text(index: ProductIndex, text: str) -> List[Tuple[str, int, Optional[str]]]:
+    """[(line, qty, sku or None)] for each line of a free-text order."""
+    return [(name, qty, index.match(name)) for name, qty in split_order_lines(text)]
+
+_product_index: Dict[str, Any] = {"index": None, "gen": None, "task": None}
+
+async def product_index() -> ProductIndex:
+    """Index for the current catalog generation; while a rebuild runs, the previous one is served."""
+    await _check_catalog_generation()
+    gen = _catalog_gen["value"]
+    idx = _product_index["index"]
+    if idx is not None and idx.gen == gen:
+        return idx
+    if _product_index["task"] is None or _product_index["gen"] != gen:
+        _product_index["gen"] = gen
+        _product_index["task"] = asyncio.ensure_future(run_db(ProductIndex.load, gen))
+    task = _product_index["task"]
+    if idx is not None:
+        if not task.done():
+            return idx
+    try:
+        new = await asyncio.shield(task)
+    except Exception as e:
+        print(f"[warn] product index build failed: {e}")
+        _product_index["task"] = None
+        return idx or ProductIndex(gen, [])
+    if _product_index["index"] is None or _product_index["index"].gen != new.gen:
+        _product_index["index"] = new
+    return new
+
 # ==================== GENERIC SAFE SEND ====================
 async def safe_send_message(bot, chat_id, **kwargs):
     try:
@@ -229,7 +1320,254 @@ async def safe_send_photo(bot, chat_id, **kwargs):
         # fallback to text if caption exists
         cap = kwargs.get("caption")
         if cap:
-            await safe_send_message(bot, chat_id, text=cap)
+            await safe_send_message(bot, chat_id, text=cap, reply_markup=kwargs.get("reply_markup"))
+
+def retry_after_seconds(e: RetryAfter) -> float:
+    ra = e.retry_after  # int in PTB 20.x, timedelta in newer releases
+    return ra.total_seconds() if hasattr(ra, "total_seconds") else float(ra)
+
+class TokenBucket:
+    """Async token bucket: acquire() waits until a send is allowed under `rate` per second."""
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.updated = monotonic()
+
+    async def acquire(self) -> None:
+        while True:
+            now = monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+SEND_BUCKET = TokenBucket(SEND_RATE)
+_chat_last_send: Dict[int, float] = {}
+
+async def broadcast(bot, chat_ids, **kwargs) -> Dict[str, int]:
+    """
+    Send one message (send_message kwargs) to every chat concurrently, within
+    SEND_BUCKET and GROUP_SEND_INTERVAL per chat. RetryAfter re-queues the chat
+    after the requested delay, timeouts/network errors are retried with backoff
+    up to BROADCAST_MAX_ATTEMPTS. Returns delivered/failed/retried counts.
+    """
+    chat_ids = list(dict.fromkeys(chat_ids))
+    stats = {"delivered": 0, "failed": 0, "retried": 0}
+    if not chat_ids:
+        return stats
+    loop = asyncio.get_running_loop()
+    q: "asyncio.Queue[tuple]" = asyncio.Queue()
+    done = asyncio.Event()
+    remaining = len(chat_ids)
+    for cid in chat_ids:
+        q.put_nowait((cid, 1))
+
+    def later(delay, item):
+        loop.call_later(max(0.0, delay), q.put_nowait, item)
+
+    def finish(key):
+        nonlocal remaining
+        stats[key] += 1
+        remaining -= 1
+        if remaining == 0:
+            done.set()
+
+    async def worker():
+        while True:
+            cid, attempt = await q.get()
+            wait = _chat_last_send.get(cid, 0.0) + GROUP_SEND_INTERVAL - monotonic()
+            if wait > 0:
+                later(wait, (cid, attempt))
+                continue
+            await SEND_BUCKET.acquire()
+            _chat_last_send[cid] = monotonic()
+            try:
+                await bot.send_message(chat_id=cid, **kwargs)
+                finish("delivered")
+            except RetryAfter as e:
+                stats["retried"] += 1
+                later(retry_after_seconds(e), (cid, attempt))
+            except (BadRequest, Forbidden) as e:  # chat not found, bot blocked, ...: retrying won't help
+                print(f"[warn] broadcast to {cid} failed: {e}")
+                finish("failed")
+            except (TimedOut, NetworkError) as e:
+                if attempt < BROADCAST_MAX_ATTEMPTS:
+                    stats["retried"] += 1
+                    later(2 ** attempt, (cid, attempt + 1))
+                else:
+                    print(f"[warn] broadcast to {cid} failed after {attempt} attempts: {e}")
+                    finish("failed")
+            except TelegramError as e:  # other API errors: permanent as well
+                print(f"[warn] broadcast to {cid} failed: {e}")
+                finish("failed")
+            except Exception as e:   # bug or unexpected client error: count it, keep the worker alive
+                print(f"[warn] broadcast to {cid} failed: {type(e).__name__}: {e}")
+                finish("failed")
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(BROADCAST_CONCURRENCY, len(chat_ids)))]
+    try:
+        await done.wait()
+    finally:
+        for w in workers:
+            w.cancel()
+    return stats
+
+# ==================== STAFF OUTBOX ====================
+class Outbox:
+    """
+    Durable queue for staff notifications (WORKERS_CHAT_ID). post() returns at
+    once; the row is stored in OUTBOX_DB and a dispatcher task delivers it,
+    oldest first per chat, with exponential backoff and RetryAfter handling.
+    Rows still pending at shutdown/crash are replayed on the next start.
+    """
+    POLL_SECONDS = 5
+
+    def __init__(self, path: str, max_attempts: int):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="outbox")
+        self._conn = None
+        self._wake: asyncio.Event = None
+        self._task = None
+        self._inflight: set = set()
+        self.bot = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = count_statements(sqlite3.connect(self.path), "outbox")
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    method TEXT NOT NULL,
+                    chat_id INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_at REAL NOT NULL,
+                    last_error TEXT,
+                    created_at REAL NOT NULL,
+                    done_at REAL
+                );
+                CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (status, next_at);
+            """)
+        return self._conn
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _insert(self, method: str, chat_id: int, payload: str) -> None:
+        now = datetime.now().timestamp()
+        with self._db() as conn:
+            conn.execute("INSERT INTO outbox (method, chat_id, payload, next_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                         (method, chat_id, payload, now, now))
+
+    def _due(self, limit: int = 20):
+        now = datetime.now().timestamp()
+        due = self._db().execute("""
+            SELECT id, method, chat_id, payload, attempts FROM outbox o
+            WHERE status='pending' AND next_at<=?
+              AND NOT EXISTS (SELECT 1 FROM outbox p WHERE p.status='pending'
+                              AND p.chat_id=o.chat_id AND p.id<o.id)
+            ORDER BY id LIMIT ?""", (now, limit)).fetchall()
+        nxt = self._db().execute("SELECT MIN(next_at) FROM outbox WHERE status='pending'").fetchone()[0]
+        return due, nxt
+
+    def _mark(self, item_id: int, status: str, attempts: int, next_at: float = 0, error: str = None) -> None:
+        now = datetime.now().timestamp()
+        with self._db() as conn:
+            conn.execute("UPDATE outbox SET status=?, attempts=?, next_at=?, last_error=?, done_at=? WHERE id=?",
+                         (status, attempts, next_at or now, error, now if status != "pending" else None, item_id))
+            # keep the table small: delivered rows are only useful for a while
+            conn.execute("DELETE FROM outbox WHERE status='done' AND done_at<?", (now - 7 * 86400,))
+
+    def pending(self) -> int:
+        return self._db().execute("SELECT COUNT(*) FROM outbox WHERE status='pending'").fetchone()[0]
+
+    async def pending_count(self) -> int:
+        return await self._run(self.pending)
+
+    def post(self, method: str, chat_id: int, **kwargs) -> None:
+        """Queue bot.<method>(chat_id=..., **kwargs) for delivery; never waits on Telegram."""
+        task = asyncio.get_running_loop().create_task(self._post(method, chat_id, json.dumps(kwargs, ensure_ascii=False)))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _post(self, method: str, chat_id: int, payload: str) -> None:
+        await self._run(self._insert, method, chat_id, payload)
+        if self._wake:
+            self._wake.set()
+
+    async def _deliver(self, item_id: int, method: str, chat_id: int, payload: str, attempts: int) -> None:
+        attempts += 1
+        now = datetime.now().timestamp()
+        try:
+            await SEND_BUCKET.acquire()
+            await getattr(self.bot, method)(chat_id=chat_id, **json.loads(payload))
+        except RetryAfter as e:
+            await self._run(self._mark, item_id, "pending", attempts, now + retry_after_seconds(e), str(e))
+        except (BadRequest, Forbidden) as e:  # before NetworkError (BadRequest subclasses it): a retry fails again
+            print(f"[warn] outbox #{item_id} failed: {e}")
+            await self._run(self._mark, item_id, "failed", attempts, 0, str(e))
+        except (TimedOut, NetworkError) as e:
+            if attempts >= self.max_attempts:
+                print(f"[warn] outbox #{item_id} gave up after {attempts} attempts: {e}")
+                await self._run(self._mark, item_id, "failed", attempts, 0, str(e))
+            else:
+                await self._run(self._mark, item_id, "pending", attempts, now + min(2 ** attempts, 600), str(e))
+        except TelegramError as e:  # other API errors: the same request will fail again
+            print(f"[warn] outbox #{item_id} failed: {e}")
+            await self._run(self._mark, item_id, "failed", attempts, 0, str(e))
+        except Exception as e:   # unexpected (bad method/payload, client bug): back off, give up like timeouts
+            error = f"{type(e).__name__}: {e}"
+            print(f"[warn] outbox #{item_id}: {error}")
+            if attempts >= self.max_attempts:
+                await self._run(self._mark, item_id, "failed", attempts, 0, error)
+            else:
+                await self._run(self._mark, item_id, "pending", attempts, now + min(2 ** attempts, 600), error)
+        else:
+            await self._run(self._mark, item_id, "done", attempts)
+
+    async def _dispatch_loop(self) -> None:
+        while True:
+            try:
+                due, nxt = await self._run(self._due)
+                for row in due:
+                    await self._deliver(*row)
+                if due:
+                    continue
+                timeout = self.POLL_SECONDS if nxt is None else min(self.POLL_SECONDS, max(0.0, nxt - datetime.now().timestamp()))
+            except Exception as e:   # keep dispatching: rows posted meanwhile must still go out
+                print(f"[warn] outbox: {type(e).__name__}: {e}")
+                timeout = self.POLL_SECONDS
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self, bot, dispatch: bool = True) -> None:
+        """dispatch=False: only store posts; another process sharing OUTBOX_DB delivers them."""
+        self.bot = bot
+        if not dispatch:
+            return
+        self._wake = asyncio.Event()
+        n = await self._run(self.pending)
+        if n:
+            print(f"Outbox: {n} ta yuborilmagan xabar qayta yuboriladi")
+        self._task = asyncio.get_running_loop().create_task(self._dispatch_loop())
+
+    async def stop(self) -> None:
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)  # make queued posts durable
+        if self._task:
+            self._task.cancel()
+
+outbox = Outbox(OUTBOX_DB, OUTBOX_MAX_ATTEMPTS)
 
 # ==================== BASIC COMMANDS ====================
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -245,17 +1583,57 @@ async def status_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
     if OWNER_USER_ID and u.id != OWNER_USER_ID:
         return
-    cats = list_categories()
+    cats = await run_db(list_categories)
     msg = (
         "<b>Bot holati</b>\n"
         f"Token: <code>{_mask_token(BOT_TOKEN)}</code>\n"
         f"Workers chat: <code>{WORKERS_CHAT_ID}</code>\n"
         f"Client groups: <code>{','.join(map(str, CLIENT_GROUP_IDS)) or '(none)'}</code>\n"
         f"TZ: <code>{TZ_NAME}</code> | Morning: <code>{MORNING_HOUR}:00</code> | Evening: <code>{EVENING_HOUR}:00</code>\n"
-        f"Products DB: <code>{'mavjud' if cats else 'yo‘q yoki bo‘sh'}</code>"
+        f"Products DB: <code>{'mavjud' if cats else 'yo‘q yoki bo‘sh'}</code>\n\n"
+        + metrics_summary(await metric_gauges(context.application))
+    )
+    await update.message.reply_html(msg)
+
+REPORT_PERIODS = {"day": (1, "bugun"), "week": (7, "so‘nggi 7 kun"), "month": (30, "so‘nggi 30 kun")}
+
+async def report_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Owner only: /report [day|week|month] from the daily order rollups."""
+    u = update.effective_user
+    if OWNER_USER_ID and u.id != OWNER_USER_ID:
+        return
+    period = (context.args[0].lower() if context.args else "day")
+    if period not in REPORT_PERIODS:
+        return await update.message.reply_text("Foydalanish: /report [day|week|month]")
+    days, label = REPORT_PERIODS[period]
+    since = (datetime.now() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    r = await orders.report(since)
+
+    avg = round(r["revenue"] / r["priced"]) if r["priced"] else 0
+    top = "\n".join(f"{i}. {html.escape(item)} — {qty} ta" + (f", {round(rev)} so‘m" if rev else "")
+                    for i, (item, qty, rev) in enumerate(r["items"], 1)) or "—"
+    msg = (
+        f"<b>Hisobot — {label}</b> (<code>{since}</code> dan)\n\n"
+        f"Buyurtmalar: <b>{r['orders']}</b>\n"
+        f"Tushum: <b>{round(r['revenue'])} so‘m</b> (narxi aniq: {r['priced']} ta)\n"
+        f"O‘rtacha chek: {avg} so‘m\n"
+        f"Mijozlar: {r['customers']} | qayta xarid qilganlar: {r['repeat']}\n\n"
+        f"<b>Top mahsulotlar:</b>\n{top}"
     )
     await update.message.reply_html(msg)
 
+async def export_orders_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Owner only: current orders as a CSV document (same file name as the old orders.csv).
+    Refused unless OWNER_USER_ID is set: the file has every customer's phone and address."""
+    u = update.effective_user
+    if not OWNER_USER_ID:
+        return await update.message.reply_text("Eksport o‘chirilgan: OWNER_USER_ID sozlanmagan.")
+    if u.id != OWNER_USER_ID:
+        return
+    n, data = await orders.export(ORDERS_CSV)
+    await update.message.reply_document(data, filename=os.path.basename(ORDERS_CSV),
+                                        caption=f"Buyurtmalar: {n} ta")
+
 async def faq(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_html(FAQ_TEXT, reply_markup=MAIN_MENU)
 
@@ -264,13 +1642,13 @@ async def contact_operator(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if WORKERS_CHAT_ID:
         u = update.effective_user
         txt = (f"🆘 <b>Mijoz operator so‘radi</b>\n"
-               f"ID: <code>{u.id}</code>\nUsername: @{u.username}\nIsm: {u.full_name}")
-        await safe_send_message(context.bot, WORKERS_CHAT_ID, text=txt, parse_mode="HTML")
+               f"ID: <code>{u.id}</code>\nUsername: @{html.escape(str(u.username))}\nIsm: {html.escape(u.full_name)}")
+        outbox.post("send_message", WORKERS_CHAT_ID, text=txt, parse_mode="HTML")
 
 # ==================== ORDER FLOW ====================
 async def order_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
-    user_state[uid] = {"step":"items"}
+    sessions.set(uid, {"step":"items"})
     await update.message.reply_text(
         "Buyurtma beramiz. Qaysi mahsulot(lar) va miqdor(lar)ni yozing.\n"
         "Masalan:\n- Dush geli x2\n- Tualet qog‘ozi x3\n- Sovun x1",
@@ -280,7 +1658,7 @@ async def order_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = update.message
     uid = update.effective_user.id
-    state = user_state.get(uid)
+    state = await sessions.get(uid)
 
     low = (msg.text or "").strip().lower()
     if low in ["❓ savollar (faq)", "faq", "savol", "savollar"]:
@@ -299,20 +1677,36 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not state:
         return  # ignore unrelated text
 
-    if state.get("step") == "items":
-        state["items"] = msg.text
-        kb = location_keyboard_for(update.effective_chat)
-        note = ""
-        if update.effective_chat.type != ChatType.PRIVATE:
-            note = (
-                "\n\nℹ️ Lokatsiya tugmasi faqat shaxsiy chatda ishlaydi. "
-                "Iltimos botga private yozing yoki manzilni yozib yuboring."
-    )
-        await update.message.reply_text(
-            "Manzilingizni kiriting yoki (shaxsiy chatda) pastdagi tugma orqali lokatsiya yuboring:" + note,
-            reply_markup=kb
-        )
-        state["step"] = "address"
+    if state.get("step") in ("items", "items_confirm"):
+        resolved = resolve_order_text(await product_index(), msg.text)
+        cart: Dict[str, int] = {}
+        for _, qty, sku in resolved:
+            if sku:
+                cart[sku] = cart.get(sku, 0) + qty
+        if not cart:   # nothing recognised: keep the text, staff match it by hand
+            state["items"] = msg.text
+            state.pop("cart_total", None)
+            state["step"] = "address"
+            return await ask_address(msg, update.effective_chat)
+
+        subtotal, lines = await run_db(compute_cart_total, [{"sku": k, "qty": v} for k, v in cart.items()])
+        missing = [f"{name} x{qty}" for name, qty, sku in resolved if not sku]
+        totals = apply_pricing_rules(subtotal)
+        state["draft"] = {"items": "; ".join(lines + missing), "total": None if missing else totals["total"]}
+        state["step"] = "items_confirm"
+        txt = "🧾 <b>Buyurtmangiz</b>\n" + "\n".join(html.escape(l) for l in lines)
+        if missing:
+            txt += "\n\n❓ <b>Topilmadi</b> (operator aniqlashtiradi):\n" + "\n".join(html.escape(m) for m in missing)
+        txt += (f"\n\nOraliq: {totals['subtotal']} so‘m"
+                f"\nChegirma: {totals['discount']} so‘m"
+                f"\nYetkazib berish: {totals['delivery']} so‘m"
+                f"\n<b>Jami{' (topilganlar)' if missing else ''}: {totals['total']} so‘m</b>"
+                "\n\nTo‘g‘rimi?")
+        kb = InlineKeyboardMarkup([
+            [InlineKeyboardButton("✅ To‘g‘ri", callback_data="ITEMS|OK"),
+             InlineKeyboardButton("✏️ Qayta yozaman", callback_data="ITEMS|EDIT")]
+        ])
+        await msg.reply_html(txt, reply_markup=kb)
         return
 
     if state.get("step") == "address":
@@ -355,9 +1749,42 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await msg.reply_html(summary, reply_markup=kb)
         return
 
+async def ask_address(message, chat):
+    kb = location_keyboard_for(chat)
+    note = ""
+    if chat.type != ChatType.PRIVATE:
+        note = (
+            "\n\nℹ️ Lokatsiya tugmasi faqat shaxsiy chatda ishlaydi. "
+            "Iltimos botga private yozing yoki manzilni yozib yuboring."
+        )
+    await message.reply_text(
+        "Manzilingizni kiriting yoki (shaxsiy chatda) pastdagi tugma orqali lokatsiya yuboring:" + note,
+        reply_markup=kb
+    )
+
+async def items_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """✅ / ✏️ under the resolved free-text order."""
+    q = update.callback_query
+    await q.answer()
+    state = await sessions.get(q.from_user.id)
+    if not state or state.get("step") != "items_confirm":
+        return
+    draft = state.pop("draft", None) or {}
+    if q.data == "ITEMS|OK":
+        state["items"] = draft.get("items", "")
+        if draft.get("total") is not None:
+            state["cart_total"] = draft["total"]
+        else:
+            state.pop("cart_total", None)
+        state["step"] = "address"
+        await q.edit_message_reply_markup(reply_markup=None)
+        return await ask_address(q.message, q.message.chat)
+    state["step"] = "items"
+    await q.edit_message_text("Qaytadan yozing: qaysi mahsulot(lar) va miqdor(lar)?")
+
 async def on_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
-    state = user_state.get(uid)
+    state = await sessions.get(uid)
     if not state or state.get("step") != "phone":
         return
     c = update.message.contact
@@ -372,7 +1799,7 @@ async def on_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def confirm_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     uid = q.from_user.id
-    state = user_state.get(uid)
+    state = await sessions.get(uid)
     await q.answer()
 
     # guard
@@ -399,62 +1826,58 @@ async def confirm_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         elif isinstance(loc_str, str):
             loc_str = loc_str.strip() or None
 
-        # Build workers message
+        # Queue the order: id comes back at once, the row is written in the background
+        order_id = orders.submit({
+            "user_id": u.id,
+            "username": u.username,
+            "name": u.full_name,
+            "phone": phone,
+            "address": addr,
+            "location": loc_str or "",   # keep this!
+            "items": items,
+            "note": note,
+            "total": cart_total,
+            "status": "Yuborildi",
+        })
+
+        # Build workers message (HTML: every customer-supplied field is escaped,
+        # a stray "<" or "&" would make Telegram reject the whole notification)
+        esc = lambda v: html.escape(str(v))
         text = (
-            "🆕 <b>Yangi buyurtma</b>\n\n"
-            f"👤 <b>Mijoz:</b> {u.full_name} "
-            f"(@{u.username}) | ID: <code>{u.id}</code>\n"
-            f"🛒 <b>Mahsulotlar:</b> {items}\n"
-            f"🏠 <b>Manzil:</b> {addr}\n"
-            f"📞 <b>Telefon:</b> {phone}\n"
-            f"📝 <b>Izoh:</b> {note}\n"
-            f"💰 <b>Jami:</b> {cart_total} so‘m"
+            f"🆕 <b>Yangi buyurtma #{order_id}</b>\n\n"
+            f"👤 <b>Mijoz:</b> {esc(u.full_name)} "
+            f"(@{esc(u.username)}) | ID: <code>{u.id}</code>\n"
+            f"🛒 <b>Mahsulotlar:</b> {esc(items)}\n"
+            f"🏠 <b>Manzil:</b> {esc(addr)}\n"
+            f"📞 <b>Telefon:</b> {esc(phone)}\n"
+            f"📝 <b>Izoh:</b> {esc(note)}\n"
+            f"💰 <b>Jami:</b> {esc(cart_total)} so‘m"
         )
 
         # Add location + map link if present
         if loc_str:
-            text += f"\n🗺️ <b>Lokatsiya:</b> {loc_str}\n"
-            text += f"🔗 <a href='https://maps.google.com/?q={loc_str}'>Xaritada ochish</a>"
+            text += f"\n🗺️ <b>Lokatsiya:</b> {esc(loc_str)}\n"
+            text += f"🔗 <a href='https://maps.google.com/?q={esc(loc_str)}'>Xaritada ochish</a>"
 
-        # Send to workers group
+        # Staff notification goes through the durable outbox (delivered in the background)
         if WORKERS_CHAT_ID:
-            await safe_send_message(
-                context.bot, WORKERS_CHAT_ID, text=text, parse_mode="HTML"
-            )
+            outbox.post("send_message", WORKERS_CHAT_ID, text=text, parse_mode="HTML")
             # (Optional) also drop a map pin in the group
             if loc_str:
                 try:
                     lat, lon = map(float, loc_str.split(","))
-                    await context.bot.send_venue(
-                        chat_id=WORKERS_CHAT_ID,
-                        latitude=lat,
-                        longitude=lon,
-                        title=f"Mijoz lokatsiyasi — {u.full_name}",
-                        address=addr or "Mijoz lokatsiyasi",
-                    )
-                except Exception:
-                    pass
-
-        # Save order row (add location)
-        try:
-            save_order_row({
-        "user_id": u.id,
-        "username": u.username,
-        "name": u.full_name,
-        "phone": phone,
-        "address": addr,
-        "location": loc_str or "",   # keep this!
-        "items": items,
-        "note": note,
-        "total": cart_total,
-        "status": "Yuborildi",
-    })
-        except Exception as e:
-            print("save_order_row error:", e)
+                except ValueError:
+                    lat = lon = None
+                if lat is not None:
+                    outbox.post("send_venue", WORKERS_CHAT_ID,
+                                latitude=lat,
+                                longitude=lon,
+                                title=f"Mijoz lokatsiyasi — {u.full_name}",
+                                address=addr or "Mijoz lokatsiyasi")
 
         # Confirm to client
-        await q.edit_message_text("Rahmat! Buyurtmangiz qabul qilindi va ishlov berilmoqda ✅")
-        user_state.pop(uid, None)
+        await q.edit_message_text(f"Rahmat! Buyurtmangiz #{order_id} qabul qilindi va ishlov berilmoqda ✅")
+        sessions.pop(uid)
         await context.bot.send_message(
             chat_id=q.from_user.id,
             text="Bosh menyu ⬇️",
@@ -462,7 +1885,7 @@ async def confirm_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if q.data == "confirm_no":
-        user_state[uid]["step"] = "items"
+        state["step"] = "items"
         await q.edit_message_text(
             "❌ Buyurtma bekor qilindi.\n\nKeling, qaytadan kiritamiz. Qaysi mahsulot(lar) va miqdorini yozing."
     )
@@ -473,16 +1896,23 @@ async def confirm_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
 # ==================== CATALOG / SEARCH / CART ====================
-async def cmd_catalog(update, context):
-    cats = list_categories()
+def render_catalog_root():
+    cats = load_categories()
     if not cats:
-        return await update.message.reply_text("Katalog hozircha bo‘sh.")
+        return None
     rows = []
     for c in cats:
         cat = c["category"] or "Other"
-        cid = category_id(cat)  # short ID for callback (fixes Button_data_invalid)
+        cid = c["id"]  # short ID for callback (fixes Button_data_invalid)
         rows.append([InlineKeyboardButton(f"{cat} ({c['count']})", callback_data=f"CAT|{cid}|0")])
-    await update.message.reply_text("Bo‘limni tanlang:", reply_markup=InlineKeyboardMarkup(rows))
+    return "Bo‘limni tanlang:", InlineKeyboardMarkup(rows)
+
+async def cmd_catalog(update, context):
+    screen = await cached_render("ROOT", render_catalog_root)
+    if not screen:
+        return await update.message.reply_text("Katalog hozircha bo‘sh.")
+    text, kb = screen
+    await update.message.reply_text(text, reply_markup=kb)
 
 async def cmd_start(update, context):
     await update.message.reply_text(
@@ -501,7 +1931,7 @@ async def on_location(update, context):
     lat, lon = loc.latitude, loc.longitude
 
     uid = update.effective_user.id
-    state = user_state.setdefault(uid, {})   # use user_state (NOT context.user_data)
+    state = await sessions.setdefault(uid)   # use sessions (NOT context.user_data)
     step = state.get("step", "")
 
     # store normalized coords for reuse
@@ -520,7 +1950,7 @@ async def cmd_find(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = " ".join(context.args) if context.args else ""
     if not q:
         return await update.message.reply_text("Qidirish uchun: /find <matn yoki SKU>")
-    items = search_products(q, limit=PAGE_SIZE, offset=0)
+    items = await run_db(search_products_fts, q, limit=PAGE_SIZE)
     if not items:
         return await update.message.reply_text("Hech narsa topilmadi.")
     kb = InlineKeyboardMarkup(
@@ -547,7 +1977,7 @@ async def on_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
     lat, lon = loc.latitude, loc.longitude
 
     uid = update.effective_user.id
-    state = user_state.setdefault(uid, {})
+    state = await sessions.setdefault(uid)
     step = state.get("step", "")
 
     # Store normalized "lat,lon" for reuse
@@ -563,30 +1993,61 @@ async def on_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         # If user sends location at other times
         await update.message.reply_text(f"Rahmat! Lokatsiya olindi: {lat:.6f},{lon:.6f}")
-async def show_category_page(q, cid, page):
-    page = max(0, int(page))
+def cat_callback(cid, page, cursor=""):
+    """CAT|cid|page[|>sku or <sku]; falls back to plain page numbers if a cursor would not fit 64 bytes."""
+    data = f"CAT|{cid}|{page}|{cursor}" if cursor else f"CAT|{cid}|{page}"
+    if len(data.encode("utf-8")) > 64:
+        data = f"CAT|{cid}|{page}"
+    return data
+
+async def show_category_page(q, cid, page, cursor=""):
+    await _check_catalog_generation()
     category = CATEGORY_ID_MAP.get(cid)
     if not category:
-        # If bot restarted and map is empty, ask user to reopen /catalog
+        # category no longer exists after a catalog update: ask user to reopen /catalog
         return await q.edit_message_text("Katalog yangilandi. Iltimos, /catalog ni qaytadan oching.")
+    key = cat_callback(cid, page, cursor)
+    screen = await cached_render(key, lambda: render_category_page(cid, category, page, cursor))
+    if not screen:
+        return await q.edit_message_text("Bu bo‘limda mahsulot topilmadi.")
+    text, kb = screen
+    await q.edit_message_text(text, reply_markup=kb)
 
-    offset = page * PAGE_SIZE
-    items = search_products("", limit=PAGE_SIZE, offset=offset, category=category)
+def render_category_page(cid, category, page, cursor=""):
+    page = max(0, int(page))
+
+    if cursor[:1] == ">":
+        items = category_page(category, after=cursor[1:])
+    elif cursor[:1] == "<":
+        items = category_page(category, before=cursor[1:])
+    elif page:
+        # old-style button without a cursor: offset paging
+        items = search_products("", limit=PAGE_SIZE + 1, offset=page * PAGE_SIZE, category=category)
+    else:
+        items = category_page(category)
+    if not items and page:
+        # cursor SKU vanished after a catalog update: start over from the first page
+        page, cursor = 0, ""
+        items = category_page(category)
     if not items:
-        return await q.edit_message_text("Bu bo‘limda mahsulot topilmadi.")
+        return None
+
+    has_next = cursor[:1] == "<" or len(items) > PAGE_SIZE
+    items = items[:PAGE_SIZE]
+    pages = max(1, -(-count_category(category) // PAGE_SIZE))
 
     rows = [[InlineKeyboardButton(f"{it['title']} — {it['price']} so‘m", callback_data=f"PROD|{it['sku']}")]
             for it in items]
 
     nav = []
     if page > 0:
-        nav.append(InlineKeyboardButton("◀️ Oldingi", callback_data=f"CAT|{cid}|{page-1}"))
+        nav.append(InlineKeyboardButton("◀️ Oldingi", callback_data=cat_callback(cid, page-1, "<" + items[0]["sku"])))
     nav.append(InlineKeyboardButton("🧺 Savatcha", callback_data="CART|VIEW"))
-    if len(items) == PAGE_SIZE:
-        nav.append(InlineKeyboardButton("▶️ Keyingi", callback_data=f"CAT|{cid}|{page+1}"))
+    if has_next:
+        nav.append(InlineKeyboardButton("▶️ Keyingi", callback_data=cat_callback(cid, page+1, ">" + items[-1]["sku"])))
     rows.append(nav)
 
-    await q.edit_message_text(f"{category} — mahsulotlar:", reply_markup=InlineKeyboardMarkup(rows))
+    return f"{category} — mahsulotlar ({page+1}/{pages}):", InlineKeyboardMarkup(rows)
 
 async def send_product_card(chat_id, p, context, reply_to=None):
     cap = f"{p['title']}\nNarx: {p['price']} so‘m\nSKU: {p['sku']}"
@@ -594,21 +2055,36 @@ async def send_product_card(chat_id, p, context, reply_to=None):
         [InlineKeyboardButton("➕ Savatchaga", callback_data=f"ADD|{p['sku']}")],
         [InlineKeyboardButton("🧺 Savatcha", callback_data="CART|VIEW")]
     ])
-    if p.get("image_url"):
-        await safe_send_photo(context.bot, chat_id, photo=p["image_url"], caption=cap, reply_markup=kb)
-    elif p.get("image_path") and os.path.exists(p["image_path"]):
-        with open(p["image_path"], "rb") as f:
-            await safe_send_photo(context.bot, chat_id, photo=f, caption=cap, reply_markup=kb)
+    key = await run_db(image_key, p)
+    if key:
+        file_id = await photo_cache.get(key)
+        if file_id:
+            # not safe_send_photo: it swallows BadRequest (a NetworkError), which is how a stale file_id shows up
+            try:
+                return await context.bot.send_photo(chat_id=chat_id, photo=file_id, caption=cap, reply_markup=kb)
+            except BadRequest as e:
+                print(f"[warn] cached photo for {p['sku']} rejected ({e}), uploading again")
+                await photo_cache.put(key, None)  # file_id no longer valid: upload again below
+            except (RetryAfter, TimedOut, NetworkError) as e:
+                print(f"[warn] send_photo failed: {e}")
+                return await safe_send_message(context.bot, chat_id, text=cap, reply_markup=kb)
+        if p.get("image_url"):
+            msg = await safe_send_photo(context.bot, chat_id, photo=p["image_url"], caption=cap, reply_markup=kb)
+        else:
+            with open(p["image_path"], "rb") as f:
+                msg = await safe_send_photo(context.bot, chat_id, photo=f, caption=cap, reply_markup=kb)
+        if msg and msg.photo:
+            await photo_cache.put(key, msg.photo[-1].file_id)
     else:
         await safe_send_message(context.bot, chat_id, text=cap, reply_markup=kb)
 
 async def view_cart(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
-    state = user_state.setdefault(uid, {})
+    state = await sessions.get(uid) or {}
     cart = state.get("cart", [])
     if not cart:
         return await update.message.reply_text("Savatcha bo‘sh.")
-    subtotal, lines = compute_cart_total(cart)
+    subtotal, lines = await run_db(compute_cart_total, [dict(x) for x in cart])
     totals = apply_pricing_rules(subtotal)
     kb = InlineKeyboardMarkup([[InlineKeyboardButton("➡️ Rasmiylashtirish", callback_data="CART|CHECKOUT")]])
     txt = ("🧺 <b>Savatcha</b>\n" + "\n".join(lines) +
@@ -620,11 +2096,11 @@ async def view_cart(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def view_cart_inline(q, context):
     uid = q.from_user.id
-    state = user_state.setdefault(uid, {})
+    state = await sessions.get(uid) or {}
     cart = state.get("cart", [])
     if not cart:
         return await q.edit_message_text("Savatcha bo‘sh.")
-    subtotal, lines = compute_cart_total(cart)
+    subtotal, lines = await run_db(compute_cart_total, [dict(x) for x in cart])
     totals = apply_pricing_rules(subtotal)
     kb = InlineKeyboardMarkup([[InlineKeyboardButton("➡️ Rasmiylashtirish", callback_data="CART|CHECKOUT")]])
     txt = ("🧺 Savatcha\n" + "\n".join(lines) +
@@ -640,19 +2116,19 @@ async def catalog_callback(update, context):
     data = q.data or ""
 
     if data.startswith("CAT|"):
-        _, cid, page = data.split("|", 2)
-        return await show_category_page(q, cid, page)
+        _, cid, page, *cursor = data.split("|", 3)
+        return await show_category_page(q, cid, page, cursor[0] if cursor else "")
 
     if data.startswith("PROD|"):
         _, sku = data.split("|", 1)
-        p = get_product(sku)
+        p = await run_db(get_product, sku)
         if not p: return await q.answer("Topilmadi", show_alert=True)
         return await send_product_card(q.message.chat_id, p, context, reply_to=q)
 
     if data.startswith("ADD|"):
         _, sku = data.split("|", 1)
         uid = q.from_user.id
-        state = user_state.setdefault(uid, {})
+        state = await sessions.setdefault(uid)
         cart = state.setdefault("cart", [])
         row = next((x for x in cart if x["sku"] == sku), None)
         if row: row["qty"] += 1
@@ -664,39 +2140,538 @@ async def catalog_callback(update, context):
 
     if data == "CART|CHECKOUT":
         uid = q.from_user.id
-        state = user_state.setdefault(uid, {})
+        state = await sessions.get(uid) or {}
         cart = state.get("cart", [])
         if not cart:
             return await q.answer("Savatcha bo‘sh", show_alert=True)
-        subtotal, lines = compute_cart_total(cart)
+        subtotal, lines = await run_db(compute_cart_total, [dict(x) for x in cart])
         totals = apply_pricing_rules(subtotal)
         state["items"] = "; ".join(lines)
         state["cart_total"] = totals["total"]
         state["step"] = "address"
         return await q.edit_message_text("Yetkazib berish manzilini yozing (ko‘cha, uy, mo‘ljal).")
 
+# ==================== INLINE SEARCH ====================
+# "@bot unitaz" in any chat: prefix search over the in-memory ProductIndex. Answers are
+# cached here per (generation, query, offset) and by Telegram for INLINE_CACHE_SECONDS.
+# Inline mode has to be switched on for the bot in @BotFather (/setinline).
+INLINE_CACHE: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+def inline_result(index: ProductIndex, pid: int):
+    sku = index.skus[pid]
+    title, price, image_url, key = index.display[pid]
+    cap = f"{title}\nNarx: {price} so‘m\nSKU: {sku}"
+    kb = InlineKeyboardMarkup([[InlineKeyboardButton("➕ Savatchaga", callback_data=f"ADD|{sku}")]])
+    file_id = key and (photo_cache.peek(key) or index.file_ids.get(key))
+    if file_id:
+        return InlineQueryResultCachedPhoto(id=sku, photo_file_id=file_id, title=title,
+                                            description=f"{price} so‘m", caption=cap, reply_markup=kb)
+    if image_url:
+        return InlineQueryResultPhoto(id=sku, photo_url=image_url, thumbnail_url=image_url, title=title,
+                                      description=f"{price} so‘m", caption=cap, reply_markup=kb)
+    return InlineQueryResultArticle(id=sku, title=title, description=f"Narx: {price} so‘m",
+                                    input_message_content=InputTextMessageContent(cap), reply_markup=kb)
+
+async def inline_search(query: str, offset: int) -> Tuple[list, str]:
+    """(results, next_offset) for one inline query page."""
+    index = await product_index()
+    key = (index.gen, " ".join(search_tokens(query)), offset)
+    hit = INLINE_CACHE.get(key)
+    if hit is not None:
+        INLINE_CACHE.move_to_end(key)
+        return hit
+    pids, more = index.prefix_search(query, offset, INLINE_PAGE_SIZE)
+    out = ([inline_result(index, pid) for pid in pids], str(offset + len(pids)) if more else "")
+    INLINE_CACHE[key] = out
+    if len(INLINE_CACHE) > INLINE_CACHE_SIZE:
+        INLINE_CACHE.popitem(last=False)
+    return out
+
+async def on_inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    iq = update.inline_query
+    offset = int(iq.offset) if iq.offset.isdigit() else 0
+    results, next_offset = await inline_search(iq.query, offset)
+    try:
+        await iq.answer(results, cache_time=INLINE_CACHE_SECONDS, next_offset=next_offset)
+    except BadRequest as e:
+        print(f"[warn] inline answer failed: {e}")   # e.g. "query is too old": the user typed on
+
 # ==================== BROADCASTS ====================
 async def morning_broadcast(context: ContextTypes.DEFAULT_TYPE):
     msg = "Assalomu alaykum! Bugungi kuningizda ishingizga rivoj va barokat tilab qolamiz! 😊 Bugun qanday buyurtma beramiz? Chegirmalar va yangi kelganlar haqida so‘rashingiz mumkin."
-    for gid in CLIENT_GROUP_IDS:
-        await safe_send_message(context.bot, gid, text=msg)
+    stats = await broadcast(context.bot, CLIENT_GROUP_IDS, text=msg)
+    print(f"[broadcast] morning: {stats}")
 
 async def evening_broadcast(context: ContextTypes.DEFAULT_TYPE):
     msg = "Tuningiz xayrli o‘tsin! 🌙 Agar ertangi kun uchun buyurtma qilmoqchi bo‘lsangiz, yozib qoldiring. Santan jamoasi siz bilan 24/7 birga!"
-    for gid in CLIENT_GROUP_IDS:
-        await safe_send_message(context.bot, gid, text=msg)
+    stats = await broadcast(context.bot, CLIENT_GROUP_IDS, text=msg)
+    print(f"[broadcast] evening: {stats}")
+
+# ==================== UPDATE PROCESSING ====================
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Handle updates concurrently, but each user's updates one at a time, in arrival order.
+
+    A slow photo upload for one customer no longer holds up everybody else, while one
+    customer's own checkout steps (on_text / confirm_callback) still never interleave
+    over their session state.
+    """
+
+    def __init__(self, limit: int):
+        # PTB's own semaphore is taken before do_process_update; if it were the real limit,
+        # updates queued behind their own user's lock would hold slots other users need.
+        super().__init__(max(limit * 16, 256))
+        self.limit = limit
+        self._running = asyncio.BoundedSemaphore(limit)
+        self._users: Dict[Any, list] = {}   # user/chat id -> [lock, updates queued or running]
+
+    @staticmethod
+    def _key(update):
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine) -> None:
+        key = self._key(update)
+        if key is None:
+            async with self._running:
+                await coroutine
+            return
+        entry = self._users.get(key)
+        if entry is None:
+            entry = self._users[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        started = False
+        try:
+            async with entry[0]:          # asyncio.Lock is FIFO: arrival order per user
+                async with self._running:
+                    started = True
+                    await coroutine
+        finally:
+            if not started:
+                coroutine.close()         # cancelled while waiting
+            entry[1] -= 1
+            if not entry[1]:
+                del self._users[key]
+
+    def waiting_users(self) -> int:
+        return len(self._users)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+# ==================== WEBHOOK SERVER ====================
+# A small asyncio HTTP/1.1 server, so webhook mode needs no extra dependency
+# (PTB's own run_webhook wants tornado). Only what Telegram's webhook client uses:
+# POST with Content-Length, keep-alive.
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+                405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error"}
+HTTP_MAX_BODY = 1 << 20
+
+# update types each handler class can react to; allowed_updates() asks Telegram for exactly these
+HANDLER_UPDATE_TYPES = {
+    CommandHandler: (Update.MESSAGE,),
+    MessageHandler: (Update.MESSAGE,),
+    CallbackQueryHandler: (Update.CALLBACK_QUERY,),
+    InlineQueryHandler: (Update.INLINE_QUERY,),
+}
+
+def allowed_updates(app: Application) -> list:
+    types = set()
+    for group in app.handlers.values():
+        for h in group:
+            kinds = HANDLER_UPDATE_TYPES.get(type(h))
+            if kinds is None:
+                return Update.ALL_TYPES   # handler we don't know how to map: don't drop its updates
+            types.update(kinds)
+    return sorted(types)
+
+def http_response(status: int, body: bytes = b"", content_type: str = "text/plain; charset=utf-8") -> bytes:
+    head = (f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n")
+    return head.encode("latin-1") + body
+
+async def serve_http(host: str, port: int, handle) -> asyncio.AbstractServer:
+    """Serve handle(method, path, headers, body) -> (status, body[, content_type]) on host:port."""
+    conns = set()
+
+    async def on_conn(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        conns.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    method, target, _ = line.decode("latin-1").split(" ", 2)
+                except ValueError:
+                    writer.write(http_response(400))
+                    break
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    k, _, v = h.decode("latin-1").partition(":")
+                    headers[k.strip().lower()] = v.strip()
+                try:
+                    n = int(headers.get("content-length") or 0)
+                except ValueError:
+                    n = -1
+                if n < 0:
+                    writer.write(http_response(400))
+                    break
+                if n > HTTP_MAX_BODY:
+                    writer.write(http_response(413))
+                    break
+                body = await reader.readexactly(n) if n else b""
+                try:
+                    res = await handle(method, target.split("?", 1)[0], headers, body)
+                except Exception as e:
+                    print(f"[warn] HTTP handler failed: {e}")
+                    res = (500, b"")
+                writer.write(http_response(*res))
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            conns.discard(writer)
+            writer.close()
+
+    server = await asyncio.start_server(on_conn, host, port)
+    if not hasattr(server, "close_clients"):   # built in since 3.13; idle keep-alives block wait_closed()
+        server.close_clients = lambda: [w.close() for w in list(conns)]
+    return server
+
+async def read_http_response(reader: asyncio.StreamReader) -> int:
+    """Read one response from a keep-alive connection; returns the status code."""
+    status = int((await reader.readuntil(b"\r\n")).split()[1])
+    n = 0
+    while True:
+        h = await reader.readuntil(b"\r\n")
+        if h == b"\r\n":
+            break
+        k, _, v = h.decode("latin-1").partition(":")
+        if k.strip().lower() == "content-length":
+            n = int(v)
+    if n:
+        await reader.readexactly(n)
+    return status
+
+def webhook_handler(secret: str, deliver):
+    """HTTP handler for Telegram's webhook POSTs; deliver(data, body) gets each verified update."""
+    async def handle(method, path, headers, body):
+        if path != WEBHOOK_PATH:
+            return (404, b"")
+        if method != "POST":
+            return (405, b"")
+        if not hmac.compare_digest(headers.get("x-telegram-bot-api-secret-token", ""), secret):
+            return (403, b"")
+        try:
+            data = json.loads(body)
+            if not isinstance(data, dict):
+                return (400, b"")
+            await deliver(data, body)
+        except (ValueError, TypeError, KeyError):
+            return (400, b"")
+        return (200, b"")
+    return handle
+
+def webhook_secret() -> str:
+    secret = WEBHOOK_SECRET or (uuid.uuid4().hex if WEBHOOK_URL else "")
+    if not secret:
+        raise RuntimeError("Missing required env var: WEBHOOK_SECRET (needed when WEBHOOK_URL is not set)")
+    return secret
+
+def stop_event() -> asyncio.Event:
+    """Set on SIGINT/SIGTERM."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    return stop
+
+async def run_webhook(app: Application) -> None:
+    secret = webhook_secret()
+    stop = stop_event()
+
+    async def deliver(data, body):
+        # ack right away; handlers run from PTB's update queue like in polling mode
+        await app.update_queue.put(Update.de_json(data, app.bot))
+
+    async with app:
+        if app.post_init:
+            await app.post_init(app)
+        await app.start()
+        server = await serve_http(WEBHOOK_LISTEN, WEBHOOK_PORT, webhook_handler(secret, deliver))
+        if WEBHOOK_URL:
+            await app.bot.set_webhook(WEBHOOK_URL, secret_token=secret,
+                                      allowed_updates=allowed_updates(app))
+        print(f"Webhook: http://{WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        try:
+            await stop.wait()
+        finally:
+            server.close()
+            server.close_clients()
+            await server.wait_closed()
+            await app.stop()
+    if app.post_shutdown:
+        await app.post_shutdown(app)
+
+# ==================== METRICS ENDPOINT ====================
+_metrics_server: Dict[str, Any] = {"server": None}
+
+async def metric_gauges(app: Application) -> Dict[str, float]:
+    """Current values of the gauges, read at scrape time."""
+    out = {"bot_sessions_in_memory": len(sessions), "bot_order_queue_depth": orders.queue_depth(),
+           "bot_update_queue_depth": app.update_queue.qsize(),
+           "bot_render_cache_entries": len(RENDER_CACHE), "bot_inline_cache_entries": len(INLINE_CACHE)}
+    if isinstance(app.update_processor, PerUserUpdateProcessor):
+        out["bot_update_users_waiting"] = app.update_processor.waiting_users()
+    try:
+        out["bot_outbox_pending"] = await outbox.pending_count()
+    except sqlite3.Error as e:
+        print(f"[warn] outbox size unavailable: {e}")
+    return out
+
+def metrics_handler(app: Application):
+    async def handle(method, path, headers, body):
+        if path != "/metrics":
+            return (404, b"")
+        text = metrics.render(await metric_gauges(app))
+        return (200, text.encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8")
+    return handle
+
+async def serve_metrics(app: Application) -> None:
+    if not METRICS_PORT:
+        return
+    port = METRICS_PORT + 1 + WORKER_INDEX if WORKER_INDEX >= 0 else METRICS_PORT
+    try:
+        _metrics_server["server"] = await serve_http(METRICS_LISTEN, port, metrics_handler(app))
+    except OSError as e:
+        print(f"[warn] metrics endpoint not started on {METRICS_LISTEN}:{port}: {e}")   # the bot runs on without it
+
+async def stop_metrics() -> None:
+    server = _metrics_server["server"]
+    if server is not None:
+        _metrics_server["server"] = None
+        server.close()
+        server.close_clients()
+        await server.wait_closed()
+
+def metrics_summary(gauges: Dict[str, float], top: int = 5) -> str:
+    """Short HTML block for /status: queues, Bot API health and the busiest handlers."""
+    api = metrics.histograms("bot_api_seconds")
+    lines = [
+        "<b>Metrikalar</b>",
+        f"Navbat: buyurtmalar <code>{gauges.get('bot_order_queue_depth', 0):g}</code> | "
+        f"outbox <code>{gauges.get('bot_outbox_pending', '?')}</code> | "
+        f"yangilanishlar <code>{gauges.get('bot_update_queue_depth', 0):g}</code> | "
+        f"sessiyalar <code>{gauges.get('bot_sessions_in_memory', 0):g}</code>",
+        f"Bot API: <code>{sum(sum(h[:-1]) for h in api.values())}</code> so‘rov, "
+        f"xato <code>{metrics.counter_total('bot_api_errors_total'):g}</code>, "
+        f"RetryAfter <code>{metrics.counter_total('bot_api_retry_after_total'):g}</code>",
+        f"Handler xatolari: <code>{metrics.counter_total('bot_handler_errors_total'):g}</code> | "
+        f"SQL: <code>{metrics.counter_total('bot_sql_statements_total'):g}</code>",
+    ]
+    ms = lambda v: "—" if v is None else ("&gt;10s" if v == float("inf") else f"≤{v * 1000:g}ms")
+    busiest = sorted(metrics.histograms("bot_handler_seconds").items(), key=lambda kv: -sum(kv[1][:-1]))
+    for labels, h in busiest[:top]:
+        lines.append(f"<code>{dict(labels)['handler']}</code>: {sum(h[:-1])} ta, "
+                     f"p50 {ms(metrics.quantile(h, 0.5))}, p95 {ms(metrics.quantile(h, 0.95))}")
+    return "\n".join(lines)
+
+# ==================== SHARDED WORKERS ====================
+def update_user_id(data: Dict[str, Any]) -> int:
+    """Routing key of a raw update: the sender's id, else the chat id, else 0."""
+    for body in data.values():
+        if isinstance(body, dict):
+            user = body.get("from") or body.get("user")
+            if user:
+                return user.get("id", 0)
+            chat = body.get("chat") or (body.get("message") or {}).get("chat")
+            if chat:
+                return chat.get("id", 0)
+    return 0
+
+def prepare_shared_dbs() -> None:
+    """Schema, WAL mode and the one-time orders.csv migration, done by the front before
+    N workers open the same files at once."""
+    orders._open(ORDERS_CSV)
+    sessions._db()
+    outbox._db()
+    for store in (orders, sessions, outbox):
+        store._conn.close()
+        store._conn = None
+
+class ShardRouter:
+    """
+    Front process for BOT_WORKERS > 1. Starts N bot.py workers (webhook mode on localhost)
+    and forwards every update, unparsed, to worker user_id % N. Each worker gets one ordered
+    stream, so a user's updates keep their order; a user's session lives in one worker.
+    Workers that exit are restarted; updates for them wait in their queue meanwhile.
+    """
+    RESTART_SECONDS = 2
+
+    def __init__(self, n: int):
+        self.n = n
+        self.secret = uuid.uuid4().hex   # front <-> worker only
+        self.queues = [asyncio.Queue() for _ in range(n)]
+        self.procs = [None] * n
+        self.forwarded = [0] * n
+        self._tasks = []
+        self._stopping = False
+
+    async def route(self, data: Dict[str, Any], body: bytes) -> None:
+        self.queues[abs(update_user_id(data)) % self.n].put_nowait(body)
+
+    async def _spawn(self, i: int) -> None:
+        env = dict(os.environ, WORKER_INDEX=str(i), BOT_WORKERS=str(self.n), BOT_MODE="webhook",
+                   WEBHOOK_LISTEN="127.0.0.1", WEBHOOK_PORT=str(WORKER_BASE_PORT + i),
+                   WEBHOOK_PATH=WEBHOOK_PATH, WEBHOOK_SECRET=self.secret, WEBHOOK_URL="")
+        self.procs[i] = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), env=env)
+
+    async def _supervise(self, i: int) -> None:
+        while True:
+            code = await self.procs[i].wait()
+            if self._stopping:
+                return
+            print(f"[warn] worker {i} exited with code {code}; restarting")
+            await asyncio.sleep(self.RESTART_SECONDS)
+            await self._spawn(i)
+
+    async def _forward(self, i: int) -> None:
+        """Deliver queue i to worker i in order over one keep-alive connection."""
+        q = self.queues[i]
+        head = (f"POST {WEBHOOK_PATH} HTTP/1.1\r\nHost: worker\r\nContent-Type: application/json\r\n"
+                f"X-Telegram-Bot-Api-Secret-Token: {self.secret}\r\n").encode("latin-1")
+        reader = writer = None
+        while True:
+            body = await q.get()
+            while True:
+                try:
+                    if writer is None:
+                        reader, writer = await asyncio.open_connection("127.0.0.1", WORKER_BASE_PORT + i)
+                    writer.write(head + f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body)
+                    await writer.drain()
+                    status = await read_http_response(reader)
+                    if status != 200:
+                        print(f"[warn] worker {i} rejected an update: HTTP {status}")
+                    break
+                except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+                    if writer:
+                        writer.close()
+                    reader = writer = None
+                    await asyncio.sleep(0.2)   # worker starting or restarting
+            self.forwarded[i] += 1
+            q.task_done()
+
+    async def _poll(self, bot, allowed: list) -> None:
+        await bot.delete_webhook()
+        offset = None
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed)
+            except RetryAfter as e:
+                await asyncio.sleep(retry_after_seconds(e))
+                continue
+            except (TimedOut, NetworkError) as e:
+                print(f"[warn] getUpdates: {e}")
+                await asyncio.sleep(1)
+                continue
+            for u in updates:
+                offset = u.update_id + 1
+                data = u.to_dict()
+                await self.route(data, json.dumps(data).encode("utf-8"))
+
+    async def run(self, app: Application) -> None:
+        stop = stop_event()
+        prepare_shared_dbs()
+        for i in range(self.n):
+            await self._spawn(i)
+            self._tasks.append(asyncio.create_task(self._supervise(i)))
+            self._tasks.append(asyncio.create_task(self._forward(i)))
+
+        server = None
+        async with app.bot:
+            if BOT_MODE == "webhook":
+                secret = webhook_secret()
+                server = await serve_http(WEBHOOK_LISTEN, WEBHOOK_PORT, webhook_handler(secret, self.route))
+                if WEBHOOK_URL:
+                    await app.bot.set_webhook(WEBHOOK_URL, secret_token=secret,
+                                              allowed_updates=allowed_updates(app))
+                print(f"Webhook: http://{WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH} -> {self.n} workers")
+            else:
+                self._tasks.append(asyncio.create_task(self._poll(app.bot, allowed_updates(app))))
+                print(f"Polling -> {self.n} workers")
+            await stop.wait()
+
+        if server:
+            server.close()
+            server.close_clients()
+        try:   # hand over what was already accepted
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self.queues)), 10)
+        except asyncio.TimeoutError:
+            print(f"[warn] {sum(q.qsize() for q in self.queues)} updates not forwarded")
+        self._stopping = True
+        for t in self._tasks:
+            t.cancel()
+        for p in self.procs:
+            if p.returncode is None:
+                p.terminate()
+        for p in self.procs:
+            try:
+                await asyncio.wait_for(p.wait(), 20)
+            except asyncio.TimeoutError:
+                p.kill()
 
 # ==================== MAIN ====================
-def main():
+async def post_init(app: Application):
+    sessions.start(SESSION_FLUSH_SECONDS)
+    if WORKER_INDEX < 0:
+        await orders.start(legacy_csv=ORDERS_CSV)
+        await outbox.start(app.bot)
+    else:   # one of BOT_WORKERS processes; the front already migrated orders.csv
+        await orders.start(shard=(WORKER_INDEX, BOT_WORKERS))
+        await outbox.start(app.bot, dispatch=WORKER_INDEX == 0)
+    cats = await run_db(load_categories)
+    print(f"Kategoriyalar yuklandi: {len(cats)}")
+    asyncio.get_running_loop().create_task(product_index())   # warm the order resolver
+    await serve_metrics(app)
+
+async def post_shutdown(app: Application):
+    await stop_metrics()
+    await outbox.stop()
+    await orders.stop()
+    await sessions.stop()
+
+def build_app() -> Application:
+    """The Application with every handler registered (main() runs it; bench_e2e.py drives it)."""
     # add timeouts so temporary network hiccups don’t crash
-    request = HTTPXRequest(connect_timeout=30, read_timeout=30)
-    app = Application.builder().token(BOT_TOKEN).request(request).build()
+    # HTTPXRequest defaults to a single connection, which would serialize concurrent handlers again
+    request = MeteredRequest(connect_timeout=30, read_timeout=30, pool_timeout=30,
+                             connection_pool_size=BOT_API_CONNECTIONS)
+    builder = (Application.builder().token(BOT_TOKEN).request(request).base_url(BOT_API_URL)
+               .post_init(post_init).post_shutdown(post_shutdown))
+    if UPDATE_CONCURRENCY > 1:
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(UPDATE_CONCURRENCY))
+    app = builder.build()
 
     # commands
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("chatid", chatid))
     app.add_handler(CommandHandler("faq", faq))
     app.add_handler(CommandHandler("status", status_cmd))
+    app.add_handler(CommandHandler("export", export_orders_cmd))
+    app.add_handler(CommandHandler("report", report_cmd))
     app.add_handler(CommandHandler("catalog", cmd_catalog))
     app.add_handler(CommandHandler("find", cmd_find))
     app.add_handler(CommandHandler("location", cmd_location))
@@ -705,21 +2680,41 @@ def main():
 
     # messages & callbacks
     app.add_handler(CallbackQueryHandler(confirm_callback, pattern=r"^confirm_"))
+    app.add_handler(CallbackQueryHandler(items_callback, pattern=r"^ITEMS\|"))
     app.add_handler(CallbackQueryHandler(catalog_callback, pattern=r"^(CAT|PROD|ADD|CART)\|"))
     app.add_handler(MessageHandler(filters.CONTACT, on_contact))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, on_text))
     app.add_handler(MessageHandler(filters.LOCATION, on_location))
+    app.add_handler(InlineQueryHandler(on_inline_query))
 
-    # schedulers
+    for group in app.handlers.values():
+        for h in group:
+            h.callback = timed_handler(h.callback)
+    return app
+
+def main():
+    app = build_app()
+
+    if BOT_WORKERS > 1 and WORKER_INDEX < 0:
+        print(f"Bot ishga tushdi… ({BOT_WORKERS} worker)")
+        asyncio.run(ShardRouter(BOT_WORKERS).run(app))
+        return
+
+    # schedulers (with several workers only worker 0 runs them)
     jq = app.job_queue
-    if jq is None:
+    if WORKER_INDEX > 0:
+        pass
+    elif jq is None:
         print('⚠️ Install job-queue extra: pip install "python-telegram-bot[job-queue]==20.7"')
     else:
         jq.run_daily(morning_broadcast, time=time(MORNING_HOUR, 0, tzinfo=TZ))
         jq.run_daily(evening_broadcast, time=time(EVENING_HOUR, 0, tzinfo=TZ))
 
     print("Bot ishga tushdi…")
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+    if BOT_MODE == "webhook":
+        asyncio.run(run_webhook(app))
+    else:
+        app.run_polling(allowed_updates=allowed_updates(app))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,203 @@
+"""Local stand-in for the Telegram Bot API, used by the bench_*.py scripts.
+
+Point the bot at it with BOT_API_URL=<stub.url>. Every method succeeds (after an
+optional simulated delay) and each call is recorded under its chat_id,
+callback_query_id or inline_query_id, so a harness can tell when the bot answered
+a given update.
+
+StubBotAPI runs in the harness process (exact timings); StubProcess runs the same
+server in a child process, for load tests where the harness would otherwise compete
+with the stub for the GIL.
+"""
+import re, json, time, socket, threading, http.client
+from typing import Dict, List, Tuple, Optional
+from urllib.parse import parse_qs
+from multiprocessing import Process
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256   # default backlog of 5 drops connection bursts
+
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Stub", "username": "stub_bot"}
+MULTIPART_FIELD_RE = re.compile(rb'name="([^"]+)"[^\r\n]*\r\n(?:[^\r\n]+\r\n)*\r\n(.*?)\r\n--', re.S)
+
+
+class StubBotAPI:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 method_latency: Optional[Dict[str, float]] = None):
+        self.latency = latency                        # seconds added to every call
+        self.method_latency = method_latency or {}    # e.g. {"sendPhoto": 0.5} for slow uploads
+        self.calls: Dict[str, int] = {}
+        self._first: Dict[str, float] = {}            # chat / callback / inline query id -> first call time
+        self.log: Dict[str, List[Tuple[str, str]]] = {}  # same key -> [(method, text), ...] in call order
+        self.keyed_calls = 0
+        self._cond = threading.Condition()
+        self._msg_id = 0
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True   # headers and body go out as separate writes
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if self.path.startswith("/_stub/"):
+                    out = json.dumps(stub.stats(with_log=self.path == "/_stub/log")).encode()
+                else:
+                    method = self.path.rstrip("/").rsplit("/", 1)[-1]
+                    params = stub.parse_params(self.headers.get("Content-Type", ""), body)
+                    out = json.dumps({"ok": True, "result": stub.handle(method, params)}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+            do_GET = do_POST
+
+        self.server = _Server((host, port), Handler)
+        self.url = f"http://{host}:{self.server.server_port}/bot"
+
+    # ---------- lifecycle ----------
+    def start(self) -> "StubBotAPI":
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    # ---------- requests ----------
+    @staticmethod
+    def parse_params(content_type: str, body: bytes) -> Dict[str, str]:
+        if content_type.startswith("multipart/"):
+            return {k.decode(): v.decode("utf-8", "replace")
+                    for k, v in MULTIPART_FIELD_RE.findall(body) if len(v) < 4096}
+        if content_type.startswith("application/json"):
+            return {k: v if isinstance(v, str) else json.dumps(v)
+                    for k, v in (json.loads(body or b"{}") or {}).items()}
+        return {k: v[0] for k, v in parse_qs(body.decode("utf-8")).items()}
+
+    def handle(self, method: str, params: Dict[str, str]):
+        delay = self.latency + self.method_latency.get(method, 0.0)
+        if delay:
+            time.sleep(delay)
+        key = params.get("chat_id") or params.get("callback_query_id") or params.get("inline_query_id")
+        with self._cond:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            if key is not None:
+                if key not in self._first:
+                    self._first[key] = time.perf_counter()
+                self.log.setdefault(key, []).append((method, params.get("text", "")))
+                self.keyed_calls += 1
+                self._cond.notify_all()
+            self._msg_id += 1
+            msg_id = self._msg_id
+
+        if method == "getMe":
+            return BOT_USER
+        if method.startswith(("send", "edit", "copy", "forward")):
+            chat_id = int(params.get("chat_id") or 0)
+            msg = {"message_id": msg_id, "date": int(time.time()), "from": BOT_USER,
+                   "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"}}
+            if method == "sendPhoto":
+                msg["photo"] = [{"file_id": f"stub-photo-{msg_id}", "file_unique_id": f"u{msg_id}",
+                                 "width": 1280, "height": 853}]
+            elif "text" in params:
+                msg["text"] = params["text"]
+            return msg
+        return True
+
+    # ---------- harness side ----------
+    def wait_for(self, key, timeout: float = 10.0) -> Optional[float]:
+        """perf_counter() time of the first call for chat/callback `key`, or None on timeout."""
+        key = str(key)
+        with self._cond:
+            self._cond.wait_for(lambda: key in self._first, timeout)
+            return self._first.get(key)
+
+    def wait_keyed_calls(self, n: int, timeout: float = 60.0) -> bool:
+        """Wait until n calls that belong to some chat/callback have been made."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.keyed_calls >= n, timeout)
+
+    def total_calls(self) -> int:
+        with self._cond:
+            return sum(self.calls.values())
+
+    def stats(self, with_log: bool = False) -> dict:
+        with self._cond:
+            out = {"keyed_calls": self.keyed_calls, "calls": dict(self.calls)}
+            if with_log:
+                out["log"] = {k: list(v) for k, v in self.log.items()}
+            return out
+
+
+def _serve(port: int, latency: float, method_latency: Optional[Dict[str, float]]) -> None:
+    StubBotAPI(port=port, latency=latency, method_latency=method_latency).server.serve_forever()
+
+
+class StubProcess:
+    """StubBotAPI in a child process; results are read back over its /_stub/ endpoints."""
+
+    def __init__(self, latency: float = 0.0, method_latency: Optional[Dict[str, float]] = None):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.port = s.getsockname()[1]
+        self.url = f"http://127.0.0.1:{self.port}/bot"
+        self._proc = Process(target=_serve, args=(self.port, latency, method_latency), daemon=True)
+
+    def start(self) -> "StubProcess":
+        self._proc.start()
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=0.2).close()
+                return self
+            except OSError:
+                time.sleep(0.05)
+        raise RuntimeError("Bot API stub did not start")
+
+    def stop(self) -> None:
+        self._proc.terminate()
+        self._proc.join()
+
+    def stats(self, with_log: bool = False) -> dict:
+        c = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+        c.request("GET", "/_stub/log" if with_log else "/_stub/stats")
+        out = json.loads(c.getresponse().read())
+        c.close()
+        return out
+
+    @property
+    def keyed_calls(self) -> int:
+        return self.stats()["keyed_calls"]
+
+    @property
+    def log(self) -> Dict[str, List[Tuple[str, str]]]:
+        return self.stats(with_log=True)["log"]
+
+    def total_calls(self) -> int:
+        return sum(self.stats()["calls"].values())
+
+    def wait_keyed_calls(self, n: int, timeout: float = 60.0) -> bool:
+        t_end = time.monotonic() + timeout
+        while time.monotonic() < t_end:
+            if self.keyed_calls >= n:
+                return True
+            time.sleep(0.02)
+        return False
+
+    def wait_for(self, key, timeout: float = 10.0) -> bool:
+        """True once some call for chat/callback `key` was made (no timestamp across processes)."""
+        t_end = time.monotonic() + timeout
+        while time.monotonic() < t_end:
+            if str(key) in self.log:
+                return True
+            time.sleep(0.02)
+        return False
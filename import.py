@@ -1,12 +1,19 @@
 #!/usr/bin/env python3
-import os, re, glob, math, sqlite3, hashlib
-from typing import List, Dict, Tuple, Optional
+import os, re, glob, math, time, sqlite3, hashlib, argparse
+from datetime import datetime
+from typing import List, Dict, Tuple, Optional, Iterator, Callable
+from multiprocessing import Pool
+import numpy as np
 import pandas as pd
 
+from textnorm import normalize
+
 # === Paths ===
 BASE_DIR = os.path.dirname(__file__)
 CATALOG_DIR = os.path.join(BASE_DIR, "catalog")
 DB_PATH = os.path.join(BASE_DIR, "products.db")
+IMAGES_SRC_DIR = os.path.join(CATALOG_DIR, "images")   # supplier photos, named <sku>.jpg or <title>.jpg
+IMAGES_DIR = os.path.join(BASE_DIR, "images")          # processed, content-addressed: <md5>.jpg
   # your bot uses shop.db
 
 # === DB schema expected by your bot.py ===
@@ -25,6 +32,96 @@ CREATE TABLE IF NOT EXISTS products (
 );
 """
 
+# covering index for the bot's keyset category paging: WHERE category=? ORDER BY title, sku
+INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_products_category_title ON products (category, title, sku, price);
+"""
+
+UPSERT_SQL = """
+INSERT INTO products (sku, title, price, category, subcategory, description, image_url, image_path, stock)
+VALUES (?, ?, ?, ?, '', '', '', '', 1)
+ON CONFLICT(sku) DO UPDATE SET
+    title=excluded.title,
+    price=excluded.price,
+    category=excluded.category
+"""
+BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+
+# one row per workbook (sheet='') and one per sheet; lets re-runs skip unchanged input
+MANIFEST_SQL = """
+CREATE TABLE IF NOT EXISTS import_manifest (
+    path TEXT NOT NULL,
+    sheet TEXT NOT NULL DEFAULT '',
+    size INTEGER,
+    mtime REAL,
+    hash TEXT,
+    settings TEXT,
+    imported_at TEXT,
+    PRIMARY KEY (path, sheet)
+);
+"""
+
+# key/value store shared with the bot; 'generation' is bumped whenever product rows change,
+# the bot uses it to drop its rendered catalog keyboards
+META_SQL = """
+CREATE TABLE IF NOT EXISTS catalog_meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER
+);
+"""
+
+# category list for the bot's /catalog: stable short id (md5(name)[:10], as used in CAT|id|...
+# callback data) + product count, so the bot needs no GROUP BY and no hashing at runtime
+CATEGORIES_SQL = """
+CREATE TABLE IF NOT EXISTS categories (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    count INTEGER NOT NULL
+);
+"""
+
+# Telegram file_id of an already uploaded product photo, keyed by image_key: md5 of the image
+# bytes for image_path, md5("url:" + image_url) for URLs. Written by the bot after the first
+# upload; an image changed by the import gets a new key, so a stale file_id is never reused.
+PHOTO_CACHE_SQL = """
+CREATE TABLE IF NOT EXISTS photo_file_ids (
+    image_key TEXT PRIMARY KEY,
+    file_id TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+# one row per source photo in catalog/images; out_hash/out_path is the processed file in images/.
+# size+mtime+settings unchanged -> the photo is skipped without being read again
+IMAGE_MANIFEST_SQL = """
+CREATE TABLE IF NOT EXISTS image_manifest (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime REAL,
+    settings TEXT,
+    source_hash TEXT,
+    out_hash TEXT,
+    out_path TEXT,
+    processed_at TEXT
+);
+"""
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif")
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1280"))   # Telegram shows photos at <= 1280px
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+IMAGE_JOBS = int(os.getenv("IMPORT_IMAGE_JOBS", "0")) or os.cpu_count() or 1   # photo worker processes
+
+# full-text index for /find; rowid == products.rowid, text columns hold textnorm.normalize() output
+FTS_SQL = """
+CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+    sku UNINDEXED,
+    title,
+    category,
+    sku_text,
+    tokenize='unicode61',
+    prefix='2 3'
+);
+"""
+
 # ---------- helpers ----------
 def db():
     return sqlite3.connect(DB_PATH)
@@ -32,11 +129,51 @@ def db():
 def ensure_schema() -> None:
     with db() as conn:
         conn.execute(CREATE_SQL)
+        conn.execute(INDEX_SQL)
+        conn.execute(MANIFEST_SQL)
+        conn.execute(META_SQL)
+        conn.execute(CATEGORIES_SQL)
+        conn.execute(PHOTO_CACHE_SQL)
+        conn.execute(IMAGE_MANIFEST_SQL)
+        conn.execute(FTS_SQL)
+        n_fts = conn.execute("SELECT COUNT(*) FROM products_fts").fetchone()[0]
+        n_products = conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+        if n_fts != n_products:
+            # first run on an existing DB (or out of sync): index everything once
+            print(f"[info] Rebuilding search index ({n_products} products)")
+            rebuild_fts(conn)
         conn.commit()
 
 def md5(s: str) -> str:
     return hashlib.md5(s.encode("utf-8")).hexdigest()
 
+def file_hash(path: str) -> str:
+    h = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def frame_hash(df: pd.DataFrame) -> str:
+    h = hashlib.md5(repr(list(df.columns)).encode("utf-8"))
+    h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return h.hexdigest()
+
+def manifest_get(conn: sqlite3.Connection, path: str, sheet: str = "") -> Optional[Dict]:
+    r = conn.execute("SELECT size, mtime, hash, settings FROM import_manifest WHERE path=? AND sheet=?",
+                     (path, sheet)).fetchone()
+    return dict(zip(["size", "mtime", "hash", "settings"], r)) if r else None
+
+def manifest_put(conn: sqlite3.Connection, path: str, sheet: str, size: Optional[int],
+                 mtime: Optional[float], h: str, settings: str) -> None:
+    conn.execute("""
+        INSERT INTO import_manifest (path, sheet, size, mtime, hash, settings, imported_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(path, sheet) DO UPDATE SET
+            size=excluded.size, mtime=excluded.mtime, hash=excluded.hash,
+            settings=excluded.settings, imported_at=excluded.imported_at
+    """, (path, sheet, size, mtime, h, settings, datetime.now().isoformat(timespec="seconds")))
+
 def clean_txt(x) -> str:
     if x is None or (isinstance(x, float) and math.isnan(x)):
         return ""
@@ -61,6 +198,36 @@ def parse_price(v) -> Optional[float]:
     except ValueError:
         return None
 
+# ---------- vectorized equivalents (same results as clean_txt / parse_price) ----------
+# plain decimal/exponent literals that float() and numpy agree on; anything else
+# (inf, nan, 1_000, non-ASCII digits, stray whitespace) goes through parse_price itself
+_PLAIN_NUM_RE = re.compile(r"[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?")
+
+def _as_text(s: pd.Series) -> pd.Series:
+    # astype(object) first so Timestamps etc. stringify exactly like str(x)
+    return s.astype(object).astype(str)
+
+def clean_txt_series(s: pd.Series) -> pd.Series:
+    out = _as_text(s).str.replace(r"\s+", " ", regex=True).str.strip()
+    return out.where(~s.isna(), "")
+
+def parse_price_series(s: pd.Series) -> pd.Series:
+    missing = s.isna()
+    txt = _as_text(s).str.strip()
+    txt = txt.str.replace(CURR_RE, "", regex=True).str.replace(" ", "", regex=False)
+    has_comma = txt.str.contains(",", regex=False)
+    has_dot = txt.str.contains(".", regex=False)
+    txt = txt.where(~(has_comma & has_dot), txt.str.replace(",", "", regex=False))    # 1,234.56
+    txt = txt.where(~(has_comma & ~has_dot), txt.str.replace(",", ".", regex=False))  # 1234,56
+
+    plain = txt.str.fullmatch(_PLAIN_NUM_RE).fillna(False).astype(bool) & ~missing
+    out = pd.Series(np.nan, index=s.index, dtype="float64")
+    out[plain] = txt[plain].to_numpy(dtype=object).astype(np.float64)
+    rest = ~missing & ~plain & (txt != "")
+    if rest.any():
+        out[rest] = s[rest].map(parse_price).astype("float64")
+    return out
+
 # header synonyms
 ALIASES = {
     "category": {"категория", "Категория", "category", "kategoriya"},
@@ -90,11 +257,117 @@ def map_columns(cols: List[str]) -> Dict[str, Optional[str]]:
                     out[key] = orig; break
     return out
 
-def import_dataframe(df: pd.DataFrame, src_file: str, sheet: str,
-                     default_currency: str, usd_rate: float) -> Tuple[int, int, int]:
-    """Returns (imported_ok, skipped_missing_cols, skipped_bad_rows)"""
+def upsert_rows(conn: sqlite3.Connection, rows: List[Tuple[str, str, float, str]]) -> int:
+    """executemany() in BATCH_SIZE chunks; caller owns the transaction."""
+    cur = conn.cursor()
+    for i in range(0, len(rows), BATCH_SIZE):
+        cur.executemany(UPSERT_SQL, rows[i:i + BATCH_SIZE])
+    return len(rows)
+
+def _fts_row(rowid: int, sku: str, title: str, category: str) -> Tuple[int, str, str, str, str]:
+    return (rowid, sku, normalize(title), normalize(category), sku.lower())
+
+def sync_fts(conn: sqlite3.Connection, rows: List[Tuple[str, str, float, str]]) -> None:
+    """Re-index just the given (already upserted) rows."""
+    if not rows:
+        return
+    latest = {r[0]: r for r in rows}
+    skus = list(latest)
+    ids = []
+    for i in range(0, len(skus), 500):
+        chunk = skus[i:i + 500]
+        q = f"SELECT rowid, sku FROM products WHERE sku IN ({','.join('?' * len(chunk))})"
+        ids.extend(conn.execute(q, chunk).fetchall())
+    conn.executemany("DELETE FROM products_fts WHERE rowid=?", [(rid,) for rid, _ in ids])
+    conn.executemany(
+        "INSERT INTO products_fts (rowid, sku, title, category, sku_text) VALUES (?, ?, ?, ?, ?)",
+        [_fts_row(rid, sku, latest[sku][1], latest[sku][3]) for rid, sku in ids])
+
+def rebuild_fts(conn: sqlite3.Connection) -> None:
+    conn.execute("DELETE FROM products_fts")
+    cur = conn.execute("SELECT rowid, sku, title, category FROM products")
+    while True:
+        batch = cur.fetchmany(BATCH_SIZE)
+        if not batch:
+            break
+        conn.executemany(
+            "INSERT INTO products_fts (rowid, sku, title, category, sku_text) VALUES (?, ?, ?, ?, ?)",
+            [_fts_row(rid, sku, title or "", category or "") for rid, sku, title, category in batch])
+
+def category_id(name: str) -> str:
+    return md5(name or "Other")[:10]
+
+def refresh_categories(conn: sqlite3.Connection) -> int:
+    """Rebuild the categories table from products; returns the number of categories."""
+    cats = conn.execute(
+        "SELECT COALESCE(category,'Other') AS c, COUNT(*) FROM products GROUP BY c").fetchall()
+    conn.execute("DELETE FROM categories")
+    conn.executemany("INSERT INTO categories (id, name, count) VALUES (?, ?, ?)",
+                     [(category_id(name), name, n) for name, n in cats])
+    return len(cats)
+
+def update_categories(conn: sqlite3.Connection, stats: Dict[str, int]) -> Optional[int]:
+    """
+    Rebuild categories after products changed (or if the table is still empty) and bump the
+    generation in the same transaction: a bot that polled between the product commits and
+    this one would otherwise cache the old categories under the new generation.
+    """
+    empty = conn.execute("SELECT COUNT(*) FROM categories").fetchone()[0] == 0
+    if not (stats["added"] or stats["updated"] or empty):
+        return None
+    n = refresh_categories(conn)
+    bump_generation(conn)
+    return n
+
+def bump_generation(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+        INSERT INTO catalog_meta (key, value) VALUES ('generation', 1)
+        ON CONFLICT(key) DO UPDATE SET value=value+1
+    """)
+
+def write_rows(conn: sqlite3.Connection, rows: List[Tuple[str, str, float, str]],
+               stats: Optional[Dict[str, int]] = None) -> None:
+    """Upsert the rows that actually changed and keep the search index in step."""
+    changed = changed_rows(conn, rows, stats)
+    if not changed:
+        return
+    upsert_rows(conn, changed)
+    sync_fts(conn, changed)
+    bump_generation(conn)
+
+def changed_rows(conn: sqlite3.Connection, rows: List[Tuple[str, str, float, str]],
+                 stats: Optional[Dict[str, int]] = None) -> List[Tuple[str, str, float, str]]:
+    """Keep only rows that are new or differ from what products already holds."""
+    latest = {r[0]: r for r in rows}  # duplicate SKUs in a sheet: last one wins, as before
+    skus = list(latest)
+    existing = {}
+    for i in range(0, len(skus), 500):
+        chunk = skus[i:i + 500]
+        q = f"SELECT sku, title, price, category FROM products WHERE sku IN ({','.join('?' * len(chunk))})"
+        existing.update((r[0], r) for r in conn.execute(q, chunk))
+    out = []
+    added = updated = 0
+    for sku, r in latest.items():
+        old = existing.get(sku)
+        if old is None:
+            added += 1
+        elif tuple(old) != r:
+            updated += 1
+        else:
+            continue
+        out.append(r)
+    if stats is not None:
+        stats["added"] = stats.get("added", 0) + added
+        stats["updated"] = stats.get("updated", 0) + updated
+        stats["unchanged"] = stats.get("unchanged", 0) + len(latest) - added - updated
+    return out
+
+def normalize_frame(df: pd.DataFrame, src_file: str, sheet: str,
+                    default_currency: str, usd_rate: float,
+                    log: Callable[[str], None] = print) -> Tuple[List[Tuple[str, str, float, str]], int, int]:
+    """Returns (rows, skipped_missing_cols, skipped_bad_rows); rows are (sku, title, price, category)"""
     if df is None or df.empty:
-        return (0, 0, 0)
+        return ([], 0, 0)
 
     # drop unnamed filler columns
     df = df.loc[:, [c for c in df.columns if not str(c).startswith("Unnamed")]]
@@ -102,69 +375,401 @@ def import_dataframe(df: pd.DataFrame, src_file: str, sheet: str,
     cm = map_columns(list(df.columns))
     cat_col, title_col, price_col = cm["category"], cm["title"], cm["price"]
     if not (cat_col and title_col and price_col):
-        print(f"  [skip] {os.path.basename(src_file)} / {sheet}: required columns not found")
-        print(f"        found: {list(df.columns)}")
-        return (0, 1, 0)
+        log(f"  [skip] {os.path.basename(src_file)} / {sheet}: required columns not found")
+        log(f"        found: {list(df.columns)}")
+        return ([], 1, 0)
 
     tmp = df[[cat_col, title_col, price_col]].copy()
     tmp.columns = ["category", "title", "price"]
-    tmp["category"] = tmp["category"].map(clean_txt)
-    tmp["title"]    = tmp["title"].map(clean_txt)
-    tmp["price"]    = tmp["price"].map(parse_price)
+    if default_currency.upper() == "USD":
+        log(f"    [info] Converting USD -> UZS @ {usd_rate:.2f}")
+    rows, bad_rows = normalize_columns(tmp, default_currency, usd_rate)
+    return (rows, 0, bad_rows)
 
-    # Convert USD -> UZS if requested
+def normalize_columns(tmp: pd.DataFrame, default_currency: str,
+                      usd_rate: float) -> Tuple[List[Tuple[str, str, float, str]], int]:
+    """tmp has exactly the columns category/title/price. Returns (rows, skipped_bad_rows)"""
+    tmp = tmp.copy()
+    tmp["category"] = clean_txt_series(tmp["category"])
+    tmp["title"]    = clean_txt_series(tmp["title"])
+    tmp["price"]    = parse_price_series(tmp["price"])
+
+    # Convert USD -> UZS if requested (NaN stays NaN)
     if default_currency.upper() == "USD":
-        print(f"    [info] Converting USD -> UZS @ {usd_rate:.2f}")
-        tmp["price"] = tmp["price"].apply(lambda x: x * usd_rate if x is not None else None)
+        tmp["price"] = tmp["price"] * usd_rate
 
     before = len(tmp)
     tmp = tmp.dropna(subset=["category", "title", "price"])
     bad_rows = before - len(tmp)
 
-    # Upsert to DB
+    # build the upsert rows column-wise; stable SKU = md5(category|title)
+    keys = (tmp["category"] + "|" + tmp["title"]).tolist()
+    rows = [(md5(k), t, p, c) for k, t, p, c in zip(keys, tmp["title"].tolist(),
+                                                   tmp["price"].tolist(), tmp["category"].tolist())]
+    return (rows, bad_rows)
+
+def import_dataframe(df: pd.DataFrame, src_file: str, sheet: str,
+                     default_currency: str, usd_rate: float,
+                     conn: Optional[sqlite3.Connection] = None,
+                     stats: Optional[Dict[str, int]] = None) -> Tuple[int, int, int]:
+    """Returns (imported_ok, skipped_missing_cols, skipped_bad_rows)"""
+    rows, miss, bad_rows = normalize_frame(df, src_file, sheet, default_currency, usd_rate)
+    if conn is not None:
+        write_rows(conn, rows, stats)
+    else:
+        with db() as own:
+            write_rows(own, rows, stats)
+    return (len(rows), miss, bad_rows)
+
+def check_manifest(path: str, default_currency: str, usd_rate: float, full: bool) -> Optional[Dict]:
+    """File-level manifest check. Returns None if the workbook can be skipped,
+    otherwise what the parse/write stages need (incl. known sheet hashes)."""
+    key = os.path.relpath(path, CATALOG_DIR)
+    settings = f"{default_currency.upper()}|{usd_rate}"
+    st = os.stat(path)
+
     with db() as conn:
-        cur = conn.cursor()
-        ok = 0
-        for _, r in tmp.iterrows():
-            category = r["category"]
-            title    = r["title"]
-            price    = float(r["price"])
-            # build a stable SKU if not provided in file: md5(category|title)
-            sku = md5(f"{category}|{title}")
-
-            cur.execute("""
-                INSERT INTO products (sku, title, price, category, subcategory, description, image_url, image_path, stock)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ON CONFLICT(sku) DO UPDATE SET
-                    title=excluded.title,
-                    price=excluded.price,
-                    category=excluded.category
-            """, (sku, title, price, category, "", "", "", "", 1))
-            ok += 1
-        conn.commit()
-    return (ok, 0, bad_rows)
+        prev = None if full else manifest_get(conn, key)
+        if prev and prev["settings"] == settings:
+            if prev["size"] == st.st_size and prev["mtime"] == st.st_mtime:
+                print("  = unchanged (size/mtime), skipped")
+                return None
+        fhash = file_hash(path)
+        if prev and prev["settings"] == settings and prev["hash"] == fhash:
+            # touched but identical: remember the new mtime so the next run skips cheaply
+            manifest_put(conn, key, "", st.st_size, st.st_mtime, fhash, settings)
+            print("  = unchanged (content hash), skipped")
+            return None
+        known = {} if full else {
+            sheet: h for sheet, h in conn.execute(
+                "SELECT sheet, hash FROM import_manifest WHERE path=? AND sheet<>'' AND settings=?",
+                (key, settings))
+        }
+    return {"path": path, "key": key, "settings": settings, "size": st.st_size,
+            "mtime": st.st_mtime, "hash": fhash, "known": known}
 
-def import_file(path: str, default_currency: str, usd_rate: float) -> Tuple[int, int, int]:
-    print(f"\n==> Importing: {os.path.basename(path)}")
+def parse_workbook(job: Dict, default_currency: str, usd_rate: float) -> Iterator[Dict]:
+    """Parse every sheet of one workbook (one ExcelFile, reused per sheet) into upsert rows.
+
+    Yields one dict per sheet; pure CPU work, never touches the DB, so it can run in a pool.
+    """
+    path = job["path"]
     try:
         xls = pd.ExcelFile(path)
     except Exception as e:
-        print(f"  [!] cannot open: {e}")
-        return (0,0,0)
-
-    tot_ok = tot_miss = tot_bad = 0
+        yield {"sheet": None, "error": f"  [!] cannot open: {e}"}
+        return
     for sheet in xls.sheet_names:
         try:
-            df = pd.read_excel(path, sheet_name=sheet)
+            df = xls.parse(sheet)
         except Exception as e:
-            print(f"  [!] cannot read sheet '{sheet}': {e}")
+            yield {"sheet": sheet, "error": f"  [!] cannot read sheet '{sheet}': {e}"}
             continue
-        ok, miss, bad = import_dataframe(df, path, sheet, default_currency, usd_rate)
-        print(f"  - {sheet}: imported={ok}, missing_cols={miss}, bad_rows={bad}")
-        tot_ok += ok; tot_miss += miss; tot_bad += bad
+        shash = frame_hash(df)
+        if job["known"].get(sheet) == shash:
+            yield {"sheet": sheet, "hash": shash, "unchanged": True}
+            continue
+        logs: List[str] = []
+        rows, miss, bad = normalize_frame(df, path, sheet, default_currency, usd_rate, log=logs.append)
+        yield {"sheet": sheet, "hash": shash, "rows": rows, "miss": miss, "bad": bad, "logs": logs}
+
+def _parse_workbook_job(args: Tuple[Dict, str, float]) -> Tuple[Dict, List[Dict]]:
+    job, default_currency, usd_rate = args
+    return job, list(parse_workbook(job, default_currency, usd_rate))
+
+def write_workbook(job: Dict, sheets: Iterator[Dict],
+                   stats: Optional[Dict[str, int]] = None) -> Tuple[int, int, int]:
+    """The single DB writer: applies parsed sheets of one workbook in one transaction."""
+    tot_ok = tot_miss = tot_bad = 0
+    t0 = time.perf_counter()
+    # one transaction per workbook: `with conn` commits on success, rolls back on error
+    with db() as conn:
+        for sh in sheets:
+            if sh.get("error"):
+                print(sh["error"])
+                if sh["sheet"] is None:
+                    return (0, 0, 0)
+                continue
+            if sh.get("unchanged"):
+                print(f"  - {sh['sheet']}: unchanged, skipped")
+                continue
+            for line in sh["logs"]:
+                print(line)
+            write_rows(conn, sh["rows"], stats)
+            manifest_put(conn, job["key"], sh["sheet"], None, None, sh["hash"], job["settings"])
+            ok, miss, bad = len(sh["rows"]), sh["miss"], sh["bad"]
+            print(f"  - {sh['sheet']}: imported={ok}, missing_cols={miss}, bad_rows={bad}")
+            tot_ok += ok; tot_miss += miss; tot_bad += bad
+        manifest_put(conn, job["key"], "", job["size"], job["mtime"], job["hash"], job["settings"])
+    dt = time.perf_counter() - t0
+    print(f"  = {tot_ok} rows in {dt:.2f}s ({tot_ok / dt if dt else 0:.0f} rows/sec)")
     return (tot_ok, tot_miss, tot_bad)
 
-def import_all() -> None:
+def import_file(path: str, default_currency: str, usd_rate: float,
+                full: bool = False, stats: Optional[Dict[str, int]] = None) -> Tuple[int, int, int]:
+    print(f"\n==> Importing: {os.path.basename(path)}")
+    job = check_manifest(path, default_currency, usd_rate, full)
+    if job is None:
+        return (0, 0, 0)
+    return write_workbook(job, parse_workbook(job, default_currency, usd_rate), stats)
+
+def import_files_parallel(files: List[str], default_currency: str, usd_rate: float,
+                          jobs: int, full: bool = False,
+                          stats: Optional[Dict[str, int]] = None) -> Tuple[int, int, int]:
+    """Parse workbooks in a process pool; this process stays the only SQLite writer."""
+    pending = []
+    for fp in files:
+        print(f"\n==> Checking: {os.path.basename(fp)}")
+        job = check_manifest(fp, default_currency, usd_rate, full)
+        if job is not None:
+            pending.append(job)
+
+    g_ok = g_miss = g_bad = 0
+    if not pending:
+        return (0, 0, 0)
+    with Pool(processes=min(jobs, len(pending))) as pool:
+        tasks = [(job, default_currency, usd_rate) for job in pending]
+        # imap (ordered) keeps the serial "later file wins" semantics for duplicate SKUs
+        for job, sheets in pool.imap(_parse_workbook_job, tasks):
+            print(f"\n==> Importing: {os.path.basename(job['path'])}")
+            ok, miss, bad = write_workbook(job, iter(sheets), stats)
+            g_ok += ok; g_miss += miss; g_bad += bad
+    return (g_ok, g_miss, g_bad)
+
+def _header_names(cells: Tuple) -> List[str]:
+    """Column names the way pd.read_excel would label them (Unnamed: i, dup.1, ...)."""
+    names, seen = [], {}
+    for i, v in enumerate(cells):
+        name = f"Unnamed: {i}" if v is None else str(v)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+def _data_rows(rows: Iterator[Tuple]) -> Iterator[Tuple]:
+    """Blank-row handling of pd.read_excel: leading and trailing blank rows are
+    dropped, blank rows between data rows are kept (and later count as bad rows)."""
+    started = False
+    blanks = 0
+    for r in rows:
+        if not any(v is not None for v in r):
+            blanks += started
+            continue
+        started = True
+        for _ in range(blanks):
+            yield ()
+        blanks = 0
+        yield r
+
+def stream_workbook(job: Dict, default_currency: str, usd_rate: float,
+                    chunk_rows: int, stats: Optional[Dict[str, int]] = None) -> Tuple[int, int, int]:
+    """Bounded-memory import: read-only openpyxl row iterator, only the three mapped
+    columns are kept, and rows are normalized and upserted CHUNK_ROWS at a time."""
+    from openpyxl import load_workbook
+
+    path = job["path"]
+    try:
+        wb = load_workbook(path, read_only=True, data_only=True)
+    except Exception as e:
+        print(f"  [!] cannot open: {e}")
+        return (0, 0, 0)
+
+    tot_ok = tot_miss = tot_bad = 0
+    t0 = time.perf_counter()
+    try:
+        with db() as conn:
+            for ws in wb.worksheets:
+                it = _data_rows(ws.iter_rows(values_only=True))
+                header = next(it, None)
+                first = next(it, None)
+                if header is None or first is None:
+                    print(f"  - {ws.title}: imported=0, missing_cols=0, bad_rows=0")
+                    continue
+                names = _header_names(header)
+                cm = map_columns([n for n in names if not n.startswith("Unnamed")])
+                if not all(cm.values()):
+                    print(f"  [skip] {os.path.basename(path)} / {ws.title}: required columns not found")
+                    print(f"        found: {names}")
+                    print(f"  - {ws.title}: imported=0, missing_cols=1, bad_rows=0")
+                    tot_miss += 1
+                    continue
+                if default_currency.upper() == "USD":
+                    print(f"    [info] Converting USD -> UZS @ {usd_rate:.2f}")
+                idx = [names.index(cm[k]) for k in ("category", "title", "price")]
+
+                ok = bad = 0
+                chunk = [first]
+                for r in it:
+                    chunk.append(r)
+                    if len(chunk) >= chunk_rows:
+                        n, b = _write_stream_chunk(conn, chunk, idx, default_currency, usd_rate, stats)
+                        ok += n; bad += b
+                        chunk = []
+                if chunk:
+                    n, b = _write_stream_chunk(conn, chunk, idx, default_currency, usd_rate, stats)
+                    ok += n; bad += b
+                print(f"  - {ws.title}: imported={ok}, missing_cols=0, bad_rows={bad}")
+                tot_ok += ok; tot_bad += bad
+            # sheet hashes from an earlier pandas run describe older content: a later normal
+            # import must not skip sheets against them
+            conn.execute("DELETE FROM import_manifest WHERE path=? AND sheet<>''", (job["key"],))
+            manifest_put(conn, job["key"], "", job["size"], job["mtime"], job["hash"], job["settings"])
+    finally:
+        wb.close()
+    dt = time.perf_counter() - t0
+    print(f"  = {tot_ok} rows in {dt:.2f}s ({tot_ok / dt if dt else 0:.0f} rows/sec)")
+    return (tot_ok, tot_miss, tot_bad)
+
+def _write_stream_chunk(conn: sqlite3.Connection, chunk: List[Tuple], idx: List[int],
+                        default_currency: str, usd_rate: float,
+                        stats: Optional[Dict[str, int]]) -> Tuple[int, int]:
+    cols = [[r[i] if i < len(r) else None for r in chunk] for i in idx]
+    tmp = pd.DataFrame({"category": pd.Series(cols[0], dtype=object),
+                        "title": pd.Series(cols[1], dtype=object),
+                        "price": pd.Series(cols[2], dtype=object)})
+    rows, bad = normalize_columns(tmp, default_currency, usd_rate)
+    write_rows(conn, rows, stats)
+    return (len(rows), bad)
+
+# ---------- product photos ----------
+# Pillow is only needed for this stage; the price import works without it.
+def _image_settings() -> str:
+    return f"max={IMAGE_MAX_SIDE};q={IMAGE_QUALITY}"
+
+def _init_image_worker(known: Dict[str, str]) -> None:
+    global _KNOWN_OUTPUTS
+    _KNOWN_OUTPUTS = known
+
+_KNOWN_OUTPUTS: Dict[str, str] = {}   # source_hash -> out_path, set per worker by _init_image_worker
+
+def _process_image(path: str) -> Tuple[str, Optional[str], Optional[str], Optional[str]]:
+    """Worker: resize + re-encode one photo into IMAGES_DIR -> (path, source_hash, out_path, error)."""
+    try:
+        src_hash = file_hash(path)
+        known = _KNOWN_OUTPUTS.get(src_hash)
+        if known and os.path.exists(known):
+            return (path, src_hash, known, None)   # same bytes under another name: reuse
+        from io import BytesIO
+        from PIL import Image, ImageOps
+        with Image.open(path) as im:
+            im = ImageOps.exif_transpose(im)
+            if im.mode in ("RGBA", "LA", "P"):
+                im = im.convert("RGBA")
+                bg = Image.new("RGB", im.size, (255, 255, 255))
+                bg.paste(im, mask=im.getchannel("A"))
+                im = bg
+            elif im.mode != "RGB":
+                im = im.convert("RGB")
+            im.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE), Image.LANCZOS)
+            buf = BytesIO()
+            im.save(buf, "JPEG", quality=IMAGE_QUALITY, optimize=True, progressive=True)
+        data = buf.getvalue()
+        out_path = os.path.join(IMAGES_DIR, hashlib.md5(data).hexdigest() + ".jpg")
+        if not os.path.exists(out_path):
+            tmp = f"{out_path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, out_path)
+        return (path, src_hash, out_path, None)
+    except Exception as e:
+        return (path, None, None, f"{type(e).__name__}: {e}")
+
+def match_images(conn: sqlite3.Connection, files: List[str]) -> Dict[str, List[str]]:
+    """Source photo -> SKUs: file name is the SKU, or the product title (compared via normalize())."""
+    skus = {r[0] for r in conn.execute("SELECT sku FROM products")}
+    by_title: Dict[str, List[str]] = {}
+    for sku, title in conn.execute("SELECT sku, title FROM products"):
+        by_title.setdefault(normalize(title), []).append(sku)
+    out: Dict[str, List[str]] = {}
+    for fp in files:
+        stem = os.path.splitext(os.path.basename(fp))[0]
+        if stem in skus:
+            out[fp] = [stem]
+        elif normalize(stem) in by_title:
+            out[fp] = by_title[normalize(stem)]
+    return out
+
+def import_images(jobs: int = IMAGE_JOBS, full: bool = False) -> Dict[str, int]:
+    """Process catalog/images into images/ and point products.image_path at the results.
+
+    Runs after the price import and only touches image_path, so a large photo folder never
+    holds up prices. Unchanged photos are skipped via image_manifest; identical photos end up
+    as one file, which the bot then uploads once (its file_id cache is keyed by content).
+    """
+    stats = {"processed": 0, "skipped": 0, "unmatched": 0, "failed": 0, "linked": 0}
+    if not os.path.isdir(IMAGES_SRC_DIR):
+        return stats
+    files = sorted(fp for fp in glob.glob(os.path.join(IMAGES_SRC_DIR, "*"))
+                   if fp.lower().endswith(IMAGE_EXTS))
+    if not files:
+        return stats
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        print("[info] Pillow is not installed (pip install Pillow); product photos skipped")
+        return stats
+
+    ensure_schema()
+    os.makedirs(IMAGES_DIR, exist_ok=True)
+    settings = _image_settings()
+    with db() as conn:
+        targets = match_images(conn, files)
+        stats["unmatched"] = len(files) - len(targets)
+
+        results: Dict[str, str] = {}   # source path -> out_path
+        todo = []
+        for fp in targets:
+            st = os.stat(fp)
+            row = conn.execute("SELECT size, mtime, settings, out_path FROM image_manifest WHERE path=?",
+                               (fp,)).fetchone()
+            if (not full and row and row[0] == st.st_size and row[1] == st.st_mtime
+                    and row[2] == settings and row[3] and os.path.exists(row[3])):
+                results[fp] = row[3]
+                stats["skipped"] += 1
+            else:
+                todo.append(fp)
+
+        if todo:
+            known = {h: p for h, p in conn.execute(
+                "SELECT source_hash, out_path FROM image_manifest WHERE settings=? AND out_path IS NOT NULL",
+                (settings,))}
+            print(f"[info] Processing {len(todo)} product photos")
+            now = datetime.now().isoformat(timespec="seconds")
+            if jobs > 1:
+                with Pool(processes=min(jobs, len(todo)), initializer=_init_image_worker,
+                          initargs=(known,)) as pool:
+                    done = list(pool.imap_unordered(_process_image, todo, chunksize=4))
+            else:
+                _init_image_worker(known)
+                done = [_process_image(fp) for fp in todo]
+            for fp, src_hash, out_path, err in done:
+                if err:
+                    print(f"[warn] {os.path.basename(fp)}: {err}")
+                    stats["failed"] += 1
+                    continue
+                st = os.stat(fp)
+                conn.execute("""INSERT OR REPLACE INTO image_manifest
+                                (path, size, mtime, settings, source_hash, out_hash, out_path, processed_at)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                             (fp, st.st_size, st.st_mtime, settings, src_hash,
+                              os.path.splitext(os.path.basename(out_path))[0], out_path, now))
+                results[fp] = out_path
+                stats["processed"] += 1
+
+        links = [(out_path, sku) for fp, out_path in results.items() for sku in targets[fp]]
+        before = conn.total_changes
+        conn.executemany("UPDATE products SET image_path=?1 WHERE sku=?2 AND image_path IS NOT ?1", links)
+        stats["linked"] = conn.total_changes - before
+        if stats["linked"]:
+            bump_generation(conn)   # the bot's product index and photo cache keys go by image_path
+        conn.commit()
+    return stats
+
+def import_all(full: bool = False, jobs: int = 1, stream: bool = False,
+               chunk_rows: int = 5000, images: bool = True, image_jobs: Optional[int] = None) -> None:
     ensure_schema()
 
     default_currency = os.getenv("DEFAULT_PRICE_CURRENCY", "UZS")
@@ -177,14 +782,68 @@ def import_all() -> None:
         return
 
     g_ok = g_miss = g_bad = 0
-    for fp in files:
-        ok, miss, bad = import_file(fp, default_currency, usd_rate)
-        g_ok += ok; g_miss += miss; g_bad += bad
+    stats: Dict[str, int] = {"added": 0, "updated": 0, "unchanged": 0}
+    if stream:
+        if jobs > 1:
+            print("[info] --stream imports one workbook at a time; --jobs ignored")
+        for fp in files:
+            print(f"\n==> Importing: {os.path.basename(fp)}")
+            job = check_manifest(fp, default_currency, usd_rate, full)
+            if job is None:
+                continue
+            if fp.lower().endswith(".xls"):
+                # openpyxl cannot read legacy .xls; load that one the regular way
+                ok, miss, bad = write_workbook(job, parse_workbook(job, default_currency, usd_rate), stats)
+            else:
+                ok, miss, bad = stream_workbook(job, default_currency, usd_rate, chunk_rows, stats)
+            g_ok += ok; g_miss += miss; g_bad += bad
+    elif jobs > 1:
+        g_ok, g_miss, g_bad = import_files_parallel(files, default_currency, usd_rate,
+                                                    jobs, full=full, stats=stats)
+    else:
+        for fp in files:
+            ok, miss, bad = import_file(fp, default_currency, usd_rate, full=full, stats=stats)
+            g_ok += ok; g_miss += miss; g_bad += bad
+
+    with db() as conn:
+        n_cats = update_categories(conn, stats)
+        if n_cats is not None:
+            print(f"\n[info] Categories refreshed: {n_cats}")
+
+    img = import_images(jobs=image_jobs or IMAGE_JOBS, full=full) if images else None
 
     print("\n==== SUMMARY ====")
     print(f"Imported rows:          {g_ok}")
     print(f"Sheets missing columns: {g_miss}")
     print(f"Rows skipped (bad):     {g_bad}")
+    print(f"Products added:         {stats['added']}")
+    print(f"Products updated:       {stats['updated']}")
+    print(f"Products unchanged:     {stats['unchanged']}")
+    if img and (img["processed"] or img["skipped"] or img["failed"] or img["unmatched"]):
+        print(f"Photos processed:       {img['processed']}")
+        print(f"Photos unchanged:       {img['skipped']}")
+        print(f"Photos failed:          {img['failed']}")
+        print(f"Photos without product: {img['unmatched']}")
+        print(f"Products relinked:      {img['linked']}")
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="Import supplier price lists from catalog/ into products.db")
+    ap.add_argument("--full", action="store_true",
+                    help="ignore the import manifest and re-import every workbook and sheet")
+    ap.add_argument("--jobs", type=int, default=int(os.getenv("IMPORT_JOBS", "1")),
+                    help="parse workbooks in N worker processes (default: 1, no pool)")
+    ap.add_argument("--stream", action="store_true", default=os.getenv("IMPORT_STREAM", "") == "1",
+                    help="bounded-memory mode: read .xlsx rows in chunks instead of whole sheets")
+    ap.add_argument("--chunk-rows", type=int, default=int(os.getenv("IMPORT_CHUNK_ROWS", "5000")),
+                    help="rows per chunk in --stream mode (default: 5000)")
+    ap.add_argument("--image-jobs", type=int, default=IMAGE_JOBS,
+                    help=f"resize photos in N worker processes, independent of --jobs (default: CPU count, {IMAGE_JOBS})")
+    ap.add_argument("--no-images", dest="images", action="store_false",
+                    default=os.getenv("IMPORT_IMAGES", "1") != "0",
+                    help="skip the catalog/images photo stage (needs Pillow)")
+    return ap.parse_args(argv)
 
 if __name__ == "__main__":
-    import_all()
+    args = parse_args()
+    import_all(full=args.full, jobs=args.jobs, stream=args.stream, chunk_rows=args.chunk_rows,
+               images=args.images, image_jobs=args.image_jobs)
@@ -0,0 +1,38 @@
+import os, sys, importlib.util
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("BOT_TOKEN", "123:test")   # bot.py refuses to import without one
+os.environ.setdefault("METRICS_PORT", "0")
+
+
+@pytest.fixture(scope="session")
+def imp():
+    """import.py as a module ("import" is a keyword, so it can't be imported by name)."""
+    spec = importlib.util.spec_from_file_location("catalog_import", os.path.join(ROOT, "import.py"))
+    mod = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = mod   # so worker pools can pickle its functions
+    spec.loader.exec_module(mod)
+    return mod
+
+
+@pytest.fixture(scope="session")
+def bot():
+    import bot
+    return bot
+
+
+@pytest.fixture
+def catalog_db(imp, bot, tmp_path, monkeypatch):
+    """Small products.db written by import.py; bot.py reads it for the duration of the test."""
+    path = os.path.join(tmp_path, "products.db")
+    monkeypatch.setattr(imp, "DB_PATH", path)
+    imp.ensure_schema()
+    with imp.db() as conn:
+        imp.write_rows(conn, [(f"sku{i}", f"Mahsulot {i}", float(100 * i), "Santan" if i % 2 else "Kalde")
+                              for i in range(1, 51)])
+        imp.refresh_categories(conn)
+    monkeypatch.setattr(bot, "DB", path)
+    return path
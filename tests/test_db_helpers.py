@@ -0,0 +1,44 @@
+import time, asyncio
+
+
+def test_cart_render_is_one_query(bot, catalog_db):
+    with bot.db_conn() as conn:   # the pool hands this connection out again (LIFO)
+        statements = []
+        conn.set_trace_callback(statements.append)
+    cart = [{"sku": "sku3", "qty": 2}, {"sku": "sku7", "qty": 1}, {"sku": "sku3", "qty": 1},
+            {"sku": "gone", "qty": 5}, {"sku": "sku50", "qty": 4}]
+    total, lines = bot.compute_cart_total(cart)
+    assert len([s for s in statements if s.lstrip().upper().startswith("SELECT")]) == 1
+    assert total == 300 * 2 + 700 + 300 + 5000 * 4
+    assert len(lines) == 4
+
+
+def test_run_db_calls_overlap_and_loop_stays_responsive(bot, catalog_db):
+    n, delay = bot.DB_POOL_SIZE, 0.3
+
+    def slow_lookup(sku):
+        with bot.db_conn() as conn:
+            row = conn.execute("SELECT title FROM products WHERE sku=?", (sku,)).fetchone()
+            time.sleep(delay)   # stands in for a slow query; holds its pooled connection
+        return row[0]
+
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        t = asyncio.ensure_future(ticker())
+        t0 = time.perf_counter()
+        titles = await asyncio.gather(*(bot.run_db(slow_lookup, f"sku{i}") for i in range(1, n + 1)))
+        wall = time.perf_counter() - t0
+        t.cancel()
+        return titles, wall, ticks
+
+    titles, wall, ticks = asyncio.run(scenario())
+    assert titles == [f"Mahsulot {i}" for i in range(1, n + 1)]
+    assert wall < delay * 1.8          # about one call, not n in a row
+    assert ticks >= delay / 0.01 / 2   # the event loop kept running meanwhile
@@ -0,0 +1,91 @@
+import asyncio, sqlite3
+
+from telegram.error import BadRequest, Forbidden
+
+
+class FlakyBot:
+    """send_message succeeds, except for the chats listed in `errors`."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        self.sent = []
+
+    async def send_message(self, chat_id, **kwargs):
+        if chat_id in self.errors:
+            raise self.errors[chat_id]
+        self.sent.append(chat_id)
+
+
+def test_broadcast_finishes_when_a_send_raises_unexpectedly(bot):
+    fake = FlakyBot({-2: TypeError("unexpected keyword"), -3: Forbidden("bot was kicked")})
+    stats = asyncio.run(asyncio.wait_for(bot.broadcast(fake, [-1, -2, -3, -4], text="Salom"), timeout=10))
+    assert stats == {"delivered": 2, "failed": 2, "retried": 0}
+    assert sorted(fake.sent) == [-4, -1]
+
+
+def test_broadcast_does_not_retry_permanent_errors(bot, monkeypatch):
+    monkeypatch.setattr(bot, "_chat_last_send", {})   # no per-chat pacing left over from other tests
+    fake = FlakyBot({-2: BadRequest("Chat not found"), -3: Forbidden("bot was blocked by the user")})
+    stats = asyncio.run(asyncio.wait_for(bot.broadcast(fake, [-1, -2, -3], text="Salom"), timeout=1))
+    assert stats == {"delivered": 1, "failed": 2, "retried": 0}
+    assert fake.sent == [-1]
+
+
+def test_outbox_keeps_dispatching_after_unexpected_errors(bot, tmp_path):
+    class StaffBot:
+        def __init__(self):
+            self.sent = []
+
+        async def send_message(self, chat_id, text):
+            self.sent.append(text)
+
+    async def scenario():
+        box = bot.Outbox(str(tmp_path / "outbox.db"), max_attempts=1)
+        staff = StaffBot()
+        await box.start(staff)
+        box.post("send_no_such_method", -100, text="a")   # AttributeError
+        box.post("send_message", -100, bogus=1)            # TypeError
+        box.post("send_message", -100, text="b")
+        for _ in range(200):
+            if staff.sent:
+                break
+            await asyncio.sleep(0.02)
+        await box.stop()
+        with sqlite3.connect(box.path) as conn:
+            rows = conn.execute("SELECT status, last_error FROM outbox ORDER BY id").fetchall()
+        return staff.sent, rows
+
+    sent, rows = asyncio.run(scenario())
+    assert sent == ["b"]
+    assert [r[0] for r in rows] == ["failed", "failed", "done"]
+    assert rows[0][1].startswith("AttributeError") and rows[1][1].startswith("TypeError")
+
+
+def test_outbox_fails_bad_request_at_once_and_delivers_the_next_row(bot, tmp_path):
+    class StaffBot:
+        def __init__(self):
+            self.sent = []
+
+        async def send_message(self, chat_id, text, parse_mode=None):
+            if "<" in text.replace("<b>", "").replace("</b>", ""):
+                raise BadRequest("Can't parse entities: unsupported start tag")
+            self.sent.append(text)
+
+    async def scenario():
+        box = bot.Outbox(str(tmp_path / "outbox.db"), max_attempts=8)
+        staff = StaffBot()
+        await box.start(staff)
+        box.post("send_message", -100, text="<b>Izoh:</b> a <3 b", parse_mode="HTML")
+        box.post("send_message", -100, text="<b>Izoh:</b> ok", parse_mode="HTML")
+        for _ in range(200):
+            if staff.sent:
+                break
+            await asyncio.sleep(0.02)
+        await box.stop()
+        with sqlite3.connect(box.path) as conn:
+            rows = conn.execute("SELECT status, attempts FROM outbox ORDER BY id").fetchall()
+        return staff.sent, rows
+
+    sent, rows = asyncio.run(scenario())
+    assert sent == ["<b>Izoh:</b> ok"]
+    assert rows == [("failed", 1), ("done", 1)]
@@ -0,0 +1,36 @@
+import asyncio
+
+
+async def exchange(bot, request: bytes, handle):
+    server = await bot.serve_http("127.0.0.1", 0, handle)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(request)
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        writer.close()
+        return status_line.decode("latin-1").strip()
+    finally:
+        server.close()
+        server.close_clients()
+        await server.wait_closed()
+
+
+async def ok(method, path, headers, body):
+    return (200, b"ok")
+
+
+async def boom(method, path, headers, body):
+    raise RuntimeError("boom")
+
+
+def test_malformed_content_length_is_a_bad_request(bot):
+    for value in (b"abc", b"-5", b"1e3"):
+        request = b"POST /hook HTTP/1.1\r\nContent-Length: " + value + b"\r\n\r\n"
+        assert asyncio.run(exchange(bot, request, ok)) == "HTTP/1.1 400 Bad Request"
+
+
+def test_handler_error_is_a_500_with_reason(bot):
+    request = b"GET /metrics HTTP/1.1\r\nConnection: close\r\n\r\n"
+    assert asyncio.run(exchange(bot, request, boom)) == "HTTP/1.1 500 Internal Server Error"
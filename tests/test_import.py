@@ -0,0 +1,116 @@
+import os, math, random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def generation(conn):
+    return conn.execute("SELECT value FROM catalog_meta WHERE key='generation'").fetchone()[0]
+
+
+def test_category_refresh_bumps_generation(imp, tmp_path, monkeypatch):
+    monkeypatch.setattr(imp, "DB_PATH", os.path.join(tmp_path, "products.db"))
+    imp.ensure_schema()
+    stats = {"added": 0, "updated": 0, "unchanged": 0}
+    with imp.db() as conn:
+        imp.write_rows(conn, [("a1", "Kran", 100.0, "Santan"), ("b1", "Truba", 50.0, "Kalde")], stats)
+    with imp.db() as conn:
+        seen = generation(conn)   # what a bot polling between the two commits would see
+        assert imp.update_categories(conn, stats) == 2
+    with imp.db() as conn:
+        assert generation(conn) > seen
+        assert conn.execute("SELECT COUNT(*) FROM categories").fetchone()[0] == 2
+        assert imp.update_categories(conn, {"added": 0, "updated": 0, "unchanged": 2}) is None
+
+
+# ---------- vectorized vs scalar parsing ----------
+PIECES = ["0", "1", "2", "5", "9", "12", "1000", ",", ".", " ", "  ", "\t", "e", "E", "-", "+", "_",
+          "$", "usd", "USD", "so'm", "som", "сум", "uzs", "inf", "nan", "٣", "５", "½", "x", " "]
+SPECIAL = [None, np.nan, float("inf"), float("-inf"), 0.0, -1.5, 1e21, 7, "", " ", "inf", "-Infinity",
+           "NaN", "1_000", "1_000.5", "١٢٣", "１２３", "1,234.56", "1234,56", "1 234 567", "12.5$",
+           "3e5", "1e", ".5", "5.", "+-1", "сум 15000", pd.Timestamp("2024-01-02")]
+
+
+def fuzz_values(n=5000, seed=4):
+    rnd = random.Random(seed)
+    return SPECIAL + ["".join(rnd.choice(PIECES) for _ in range(rnd.randint(0, 6))) for _ in range(n)]
+
+
+def same(a, b):
+    if a is None or (isinstance(a, float) and math.isnan(a)):
+        return b is None or (isinstance(b, float) and math.isnan(b))
+    return a == b
+
+
+def test_parse_price_series_matches_scalar(imp):
+    values = fuzz_values()
+    got = imp.parse_price_series(pd.Series(values, dtype=object))
+    assert [(v, imp.parse_price(v), g) for v, g in zip(values, got) if not same(imp.parse_price(v), g)] == []
+
+
+def test_clean_txt_series_matches_scalar(imp):
+    values = fuzz_values()
+    got = imp.clean_txt_series(pd.Series(values, dtype=object))
+    assert [(v, imp.clean_txt(v), g) for v, g in zip(values, got) if imp.clean_txt(v) != g] == []
+
+
+# ---------- manifest ----------
+def write_price_list(path, price, mtime):
+    pd.DataFrame({"Категория": ["Santan"], "Наименование товара": ["Kran 1/2"], "Цена": [price]}) \
+        .to_excel(path, sheet_name="Prices", index=False)
+    os.utime(path, (mtime, mtime))
+
+
+def test_stream_import_drops_stale_sheet_hashes(imp, tmp_path, monkeypatch):
+    monkeypatch.setattr(imp, "DB_PATH", os.path.join(tmp_path, "products.db"))
+    monkeypatch.setattr(imp, "CATALOG_DIR", str(tmp_path))
+    imp.ensure_schema()
+    fp = os.path.join(tmp_path, "prices.xlsx")
+
+    def price():
+        with imp.db() as conn:
+            return conn.execute("SELECT price FROM products").fetchone()[0]
+
+    write_price_list(fp, 1000, 1_700_000_000)          # A, normal import: per-sheet hashes
+    imp.import_file(fp, "UZS", 12500.0)
+    write_price_list(fp, 2000, 1_700_000_100)          # B, streamed
+    imp.stream_workbook(imp.check_manifest(fp, "UZS", 12500.0, False), "UZS", 12500.0, 100)
+    assert price() == 2000
+    write_price_list(fp, 1000, 1_700_000_200)          # back to A, normal import
+    imp.import_file(fp, "UZS", 12500.0)
+    assert price() == 1000
+
+
+# ---------- product photos ----------
+def test_photos_are_processed_in_a_worker_pool(imp, tmp_path, monkeypatch):
+    Image = pytest.importorskip("PIL.Image")
+    monkeypatch.setattr(imp, "DB_PATH", os.path.join(tmp_path, "products.db"))
+    imp.ensure_schema()
+    with imp.db() as conn:
+        imp.write_rows(conn, [(f"sku{i}", f"Kran {i}", 100.0, "Santan") for i in range(4)])
+    src = tmp_path / "src"
+    src.mkdir()
+    for i in range(4):
+        Image.new("RGB", (2000, 1000), (40 * i, 80, 120)).save(src / f"sku{i}.png")
+    monkeypatch.setattr(imp, "IMAGES_SRC_DIR", str(src))
+    monkeypatch.setattr(imp, "IMAGES_DIR", str(tmp_path / "images"))
+    pools = []
+    real_pool = imp.Pool
+    monkeypatch.setattr(imp, "Pool", lambda *a, **kw: pools.append(kw.get("processes")) or real_pool(*a, **kw))
+
+    with imp.db() as conn:
+        seen = generation(conn)
+    stats = imp.import_images(jobs=2)
+    assert pools == [2]
+    assert (stats["processed"], stats["failed"], stats["linked"]) == (4, 0, 4)
+    with imp.db() as conn:
+        paths = [r[0] for r in conn.execute("SELECT image_path FROM products ORDER BY sku")]
+        assert generation(conn) > seen   # the running bot picks up the new photos
+        seen = generation(conn)
+    assert all(p and os.path.exists(p) for p in paths)
+    assert max(Image.open(paths[0]).size) == imp.IMAGE_MAX_SIDE
+
+    assert imp.import_images(jobs=2)["linked"] == 0
+    with imp.db() as conn:
+        assert generation(conn) == seen
@@ -0,0 +1,32 @@
+import pytest
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Dush geli x2\n- 3 ta sovun", [("Dush geli", 2), ("sovun", 3)]),
+    ("Dush geli x2, 3 ta sovun", [("Dush geli", 2), ("sovun", 3)]),
+    ("Kran 2шт; Truba", [("Kran", 2), ("Truba", 1)]),
+    # commas inside titles stay in the line
+    ("Кабель 2,5 мм x3", [("Кабель 2,5 мм", 3)]),
+    ("Фильтр умягчитель Aquarius 1,2", [("Фильтр умягчитель Aquarius 1,2", 1)]),
+    ("Врезка по месту:Подключение к бетонной трубе, септик, колодец KG2000BA 160 x2",
+     [("Врезка по месту:Подключение к бетонной трубе, септик, колодец KG2000BA 160", 2)]),
+])
+def test_split_order_lines(bot, text, expected):
+    assert bot.split_order_lines(text) == expected
+
+
+def test_decimal_comma_titles_resolve_to_their_own_sku(bot):
+    rows = [
+        ("kg160", "Врезка по месту:Подключение к бетонной трубе, септик, колодец KG2000BA 160"),
+        ("kg200", "Врезка по месту:Подключение к бетонной трубе, септик, колодец KG2000BA 200"),
+        ("aq12", "Фильтр умягчитель Aquarius 1,2"),
+        ("aq34", "Фильтр умягчитель Aquarius 3,4"),
+        ("cab25", "Кабель 2,5 мм"),
+        ("cab15", "Кабель 1,5 мм"),
+    ]
+    index = bot.ProductIndex(0, rows)
+    text = ("Врезка по месту:Подключение к бетонной трубе, септик, колодец KG2000BA 160 x2\n"
+            "Фильтр умягчитель Aquarius 3,4\n"
+            "Кабель 2,5 мм x3")
+    assert [(qty, sku) for _, qty, sku in bot.resolve_order_text(index, text)] == \
+        [(2, "kg160"), (1, "aq34"), (3, "cab25")]
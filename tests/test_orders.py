@@ -0,0 +1,43 @@
+import asyncio, json, sqlite3
+from types import SimpleNamespace
+
+
+def order(name):
+    return {"user_id": 1, "username": "u", "name": name, "phone": "+998901234567", "address": "Chilonzor",
+            "location": "", "items": "Sovun x1", "note": "—", "total": "100", "status": "Yuborildi"}
+
+
+def test_permanent_write_error_does_not_block_later_orders(bot, tmp_path):
+    async def scenario():
+        store = bot.OrderStore(str(tmp_path / "orders.db"), batch_size=10, batch_wait=0.05)
+        await store.start()
+        with sqlite3.connect(store.path) as conn:   # another writer already took the next id
+            conn.execute("INSERT INTO orders (id, time) VALUES (?, '2026-01-01')", (store._next_id,))
+        bad = store.submit(order("Ali"))
+        good = store.submit(order("Vali"))
+        await asyncio.wait_for(store.stop(), timeout=5)
+        with sqlite3.connect(store.path) as conn:
+            stored = conn.execute("SELECT id, name FROM orders WHERE name IS NOT NULL").fetchall()
+            failed = conn.execute("SELECT id, payload, error FROM orders_failed").fetchall()
+        return bad, good, stored, failed
+
+    bad, good, stored, failed = asyncio.run(scenario())
+    assert stored == [(good, "Vali")]
+    assert [(r[0], json.loads(r[1])["name"]) for r in failed] == [(bad, "Ali")]
+    assert failed[0][2].startswith("IntegrityError")
+
+
+def test_export_is_refused_without_owner(bot, monkeypatch):
+    replies = []
+
+    async def reply_text(text):
+        replies.append(text)
+
+    async def reply_document(*args, **kwargs):
+        raise AssertionError("export sent without OWNER_USER_ID")
+
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=42),
+                             message=SimpleNamespace(reply_text=reply_text, reply_document=reply_document))
+    monkeypatch.setattr(bot, "OWNER_USER_ID", 0)
+    asyncio.run(bot.export_orders_cmd(update, None))
+    assert replies and "OWNER_USER_ID" in replies[0]
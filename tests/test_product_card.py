@@ -0,0 +1,41 @@
+import asyncio
+from types import SimpleNamespace
+
+from telegram.error import BadRequest
+
+
+class PhotoBot:
+    """send_photo rejects the file_ids in `stale`, anything else "uploads" as a new file_id."""
+
+    def __init__(self, stale):
+        self.stale = stale
+        self.calls = []
+
+    async def send_photo(self, chat_id, photo, caption=None, reply_markup=None):
+        self.calls.append(("photo", photo, reply_markup is not None))
+        if photo in self.stale:
+            raise BadRequest("Wrong file identifier/http url specified")
+        return SimpleNamespace(photo=[SimpleNamespace(file_id="small"), SimpleNamespace(file_id="FRESH")])
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        self.calls.append(("msg", text, reply_markup is not None))
+
+
+def test_stale_file_id_is_evicted_and_uploaded_again(bot, catalog_db, monkeypatch):
+    cache = bot.PhotoCache()
+    monkeypatch.setattr(bot, "photo_cache", cache)
+    product = {"sku": "sku1", "title": "Mahsulot 1", "price": 100, "image_url": "https://example.com/1.jpg"}
+    fake = PhotoBot({"STALE"})
+    context = SimpleNamespace(bot=fake)
+
+    async def scenario():
+        key = await bot.run_db(bot.image_key, product)
+        await cache.put(key, "STALE")
+        await bot.send_product_card(-1, product, context)
+        await bot.send_product_card(-1, product, context)
+        cache._mem.clear()   # the replacement was persisted, not just kept in memory
+        return await cache.get(key)
+
+    stored = asyncio.run(scenario())
+    assert fake.calls == [("photo", "STALE", True), ("photo", product["image_url"], True), ("photo", "FRESH", True)]
+    assert stored == "FRESH"
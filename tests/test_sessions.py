@@ -0,0 +1,34 @@
+import asyncio
+
+
+def test_session_store_roundtrip_through_flush(bot, tmp_path):
+    path = str(tmp_path / "sessions.db")
+
+    async def first_run():
+        store = bot.SessionStore(path, size=2, idle_seconds=3600, max_age_days=30)
+        store.set(1, {"step": "address", "cart": [{"sku": "a1", "qty": 2}]})
+        store.set(2, {"step": "phone"})
+        await store.flush()
+        state = await store.get(1)
+        state["cart"].append({"sku": "b1", "qty": 1})   # handlers mutate in place
+        state["step"] = "confirm"
+        store.pop(2)                                    # was already persisted: must be deleted
+        store.set(3, {"step": "note"})
+        store.set(4, {"cart": []})                      # size=2: user 1 is evicted before any flush
+        assert len(store) == 2
+        assert (await store.get(1))["step"] == "confirm"   # read back from the unflushed evictions
+        assert 3 not in store._mem                      # ... which pushed user 3 out in turn
+        await store.flush()
+
+    async def second_run():
+        store = bot.SessionStore(path, size=2, idle_seconds=3600, max_age_days=30)
+        return [await store.get(uid) for uid in (1, 2, 3, 4, 5)]
+
+    asyncio.run(first_run())
+    assert asyncio.run(second_run()) == [
+        {"step": "confirm", "cart": [{"sku": "a1", "qty": 2}, {"sku": "b1", "qty": 1}]},
+        None,
+        {"step": "note"},
+        {"cart": []},
+        None,
+    ]
@@ -0,0 +1,34 @@
+import asyncio
+
+from telegram import Update
+
+
+def message_update(update_id, user_id):
+    return Update.de_json({"update_id": update_id, "message": {
+        "message_id": update_id, "date": 1_700_000_000, "text": "salom",
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "Mijoz"}}}, None)
+
+
+def test_same_user_in_order_other_users_concurrently(bot):
+    events = []
+
+    async def handle(name, delay):
+        events.append(("start", name))
+        await asyncio.sleep(delay)
+        events.append(("end", name))
+
+    async def scenario():
+        proc = bot.PerUserUpdateProcessor(4)
+        await proc.initialize()
+        jobs = [("a1", 1, 0.05), ("a2", 1, 0.0), ("b1", 2, 0.0), ("a3", 1, 0.0)]
+        await asyncio.gather(*(proc.process_update(message_update(i, uid), handle(name, delay))
+                               for i, (name, uid, delay) in enumerate(jobs, 1)))
+        await proc.shutdown()
+        return proc.waiting_users()
+
+    assert asyncio.run(scenario()) == 0
+    a = [e for e in events if e[1].startswith("a")]
+    assert a == [("start", "a1"), ("end", "a1"), ("start", "a2"), ("end", "a2"), ("start", "a3"), ("end", "a3")]
+    # user 2 didn't wait for user 1's slow update
+    assert events.index(("end", "b1")) < events.index(("end", "a1"))
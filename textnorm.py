@@ -0,0 +1,34 @@
+"""Search-text normalization shared by import.py (index side) and bot.py (query side).
+
+Uzbek is written in both Latin and Cyrillic, with several apostrophe variants
+(o‘ / o` / o' / oʻ). Everything is folded to plain lower-case Latin so that
+"O‘zbek", "o'zbek", "Ўзбек" and "ozbek" all produce the same token.
+"""
+import re
+
+# Uzbek Cyrillic -> Latin (plus the Russian letters that show up in supplier price lists)
+CYR2LAT = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "yo", "ж": "j",
+    "з": "z", "и": "i", "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o",
+    "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "x", "ц": "ts",
+    "ч": "ch", "ш": "sh", "щ": "sh", "ъ": "", "ы": "i", "ь": "", "э": "e", "ю": "yu",
+    "я": "ya", "ў": "o", "қ": "q", "ғ": "g", "ҳ": "h",
+}
+_TRANS = str.maketrans(CYR2LAT)
+
+# o‘ o’ oʻ oʼ o` o´ o' -> o  (apostrophes are dropped, not turned into separators)
+APOSTROPHES_RE = re.compile(r"[‘’ʻʼ`´']")
+NON_WORD_RE = re.compile(r"[^0-9a-z]+")
+
+
+def normalize(s) -> str:
+    """Lower-case Latin, apostrophes removed, every other non-alphanumeric -> single space."""
+    if not s:
+        return ""
+    s = str(s).lower().translate(_TRANS)
+    s = APOSTROPHES_RE.sub("", s)
+    return NON_WORD_RE.sub(" ", s).strip()
+
+
+def tokens(s) -> list:
+    return normalize(s).split()